@@ -1,327 +1,322 @@
-import json
-import os
+'''
+Управление пользователями: авторизация админа, просмотр, редактирование, блокировка
+'''
 import hashlib
-import psycopg2
-from typing import Dict, Any
 from datetime import datetime
+from shared import session
+from shared.etag import conditional
+from shared.http import HttpError, Request, Router, json_response
+from shared.ratelimit import LoginGuard
+from shared.search import normalize_term, search_limit, search_users
 
 def hash_password(password: str) -> str:
     return hashlib.sha256(password.encode()).hexdigest()
 
-def get_db_connection():
-    return psycopg2.connect(os.environ['DATABASE_URL'])
-
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
-    '''
-    Управление пользователями: авторизация админа, просмотр, редактирование, блокировка
-    '''
-    method: str = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
+def require_user_id(request: Request):
+    user_id = request.body.get('userId')
+    if not user_id:
+        raise HttpError(400, 'ID пользователя обязателен')
+    return user_id
+
+LOGIN_GUARD = LoginGuard('admin_login')
+# Как в auth: длинное имя не доходит ни до счётчика попыток, ни до базы
+MAX_USERNAME_LENGTH = 50
+
+router = Router('GET, POST, OPTIONS', allow_headers='Content-Type, If-None-Match')
+
+@router.route('POST', 'login')
+def login(request: Request) -> dict:
+    username = (request.body.get('username') or '').strip()
+    password = (request.body.get('password') or '').strip()
+
+    if not username or not password:
+        raise HttpError(400, 'Введите логин и пароль')
+
+    if len(username) > MAX_USERNAME_LENGTH:
+        raise HttpError(400, f'Логин длиннее {MAX_USERNAME_LENGTH} символов')
+
+    # До хеширования и запроса: перебор паролей не доходит до базы
+    LOGIN_GUARD.check(request, username)
+    password_hash = hash_password(password)
+
+    cur = request.cursor()
+    cur.execute(
+        "SELECT id, username FROM admins WHERE username = %s AND password_hash = %s",
+        (username, password_hash)
+    )
+    admin = cur.fetchone()
+
+    if not admin:
+        raise HttpError(401, 'Неверный логин или пароль')
+
+    LOGIN_GUARD.succeeded(request, username)
+
+    return json_response(200, {
+        'success': True,
+        'admin': {
+            'id': admin[0],
+            'username': admin[1]
         }
-    
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
+    })
+
+@router.route('POST', 'update_user')
+def update_user(request: Request) -> dict:
+    user_id = require_user_id(request)
+    balance = request.body.get('balance')
+    referral_count = request.body.get('referralCount')
+
+    if balance is None and referral_count is None:
+        raise HttpError(400, 'Нет данных для обновления')
+
+    # Журнал и users.balance целые: дробный баланс разошёлся бы с журналом
+    if balance is not None and (not isinstance(balance, int) or isinstance(balance, bool)):
+        raise HttpError(400, 'Баланс должен быть целым числом')
+
+    cur = request.cursor()
+    if balance is not None:
+        # Баланс не перезаписывается: разница пишется в журнал (V0030),
+        # users.balance обновляет его триггер
+        cur.execute(
+            """
+            INSERT INTO balance_ledger (user_id, delta, kind, note)
+            SELECT id, %s - COALESCE(balance, 0), 'admin_adjustment', %s
+            FROM users
+            WHERE id = %s AND COALESCE(balance, 0) <> %s
+            FOR UPDATE
+            """,
+            (balance, request.body.get('note'), user_id, balance)
+        )
+
+    if referral_count is not None:
+        cur.execute("UPDATE users SET referral_count = %s WHERE id = %s", (referral_count, user_id))
+
+    cur.execute("SELECT id, username, balance, referral_count FROM users WHERE id = %s", (user_id,))
+    user = cur.fetchone()
+    request.conn.commit()
+
+    if not user:
+        raise HttpError(404, 'Пользователь не найден')
+
+    return json_response(200, {
+        'success': True,
+        'user': {
+            'id': user[0],
+            'username': user[1],
+            'balance': user[2],
+            'referralCount': user[3]
+        }
+    })
+
+@router.route('POST', 'ban_user')
+def ban_user(request: Request) -> dict:
+    user_id = request.body.get('userId')
+    reason = (request.body.get('reason') or '').strip()
+
+    if not user_id or not reason:
+        raise HttpError(400, 'ID пользователя и причина обязательны')
+
+    cur = request.cursor()
+    cur.execute(
+        "UPDATE users SET is_banned = TRUE, ban_reason = %s, banned_at = CURRENT_TIMESTAMP WHERE id = %s RETURNING id",
+        (reason, user_id)
+    )
+    result = cur.fetchone()
+    if result:
+        # Выданные токены перестают приниматься сразу, а не по истечении срока
+        session.revoke(cur, user_id)
+    request.conn.commit()
+
+    if not result:
+        raise HttpError(404, 'Пользователь не найден')
+
+    return json_response(200, {'success': True, 'message': 'Пользователь заблокирован'})
+
+@router.route('POST', 'unban_user')
+def unban_user(request: Request) -> dict:
+    user_id = require_user_id(request)
+
+    cur = request.cursor()
+    cur.execute(
+        "UPDATE users SET is_banned = FALSE, ban_reason = NULL, banned_at = NULL WHERE id = %s RETURNING id",
+        (user_id,)
+    )
+    result = cur.fetchone()
+    request.conn.commit()
+
+    if not result:
+        raise HttpError(404, 'Пользователь не найден')
+
+    return json_response(200, {'success': True, 'message': 'Пользователь разблокирован'})
+
+@router.route('POST', 'pin_user')
+def pin_user(request: Request) -> dict:
+    user_id = require_user_id(request)
+
+    cur = request.cursor()
+    cur.execute(
+        "UPDATE users SET is_pinned = TRUE WHERE id = %s RETURNING id",
+        (user_id,)
+    )
+    result = cur.fetchone()
+    request.conn.commit()
+
+    if not result:
+        raise HttpError(404, 'Пользователь не найден')
+
+    return json_response(200, {'success': True, 'message': 'Пользователь закреплён'})
+
+@router.route('POST', 'unpin_user')
+def unpin_user(request: Request) -> dict:
+    user_id = require_user_id(request)
+
+    cur = request.cursor()
+    cur.execute(
+        "UPDATE users SET is_pinned = FALSE WHERE id = %s RETURNING id",
+        (user_id,)
+    )
+    result = cur.fetchone()
+    request.conn.commit()
+
+    if not result:
+        raise HttpError(404, 'Пользователь не найден')
+
+    return json_response(200, {'success': True, 'message': 'Пользователь откреплён'})
+
+USER_COLUMNS = 'id, username, balance, referral_count, is_banned, ban_reason, created_at, is_pinned'
+
+def row_to_user(user: tuple) -> dict:
+    return {
+        'id': user[0],
+        'username': user[1],
+        'balance': user[2],
+        'referralCount': user[3],
+        'isBanned': user[4] or False,
+        'banReason': user[5],
+        'createdAt': user[6].isoformat() if user[6] else None,
+        'isPinned': user[7] or False
+    }
+
+def current_hour() -> str:
+    # Окно «последние 7 дней» сдвигается и без записей в users
+    return datetime.now().strftime('%Y-%m-%dT%H')
+
+@router.route('GET')
+@conditional('users', vary=current_hour)
+def list_users(request: Request) -> dict:
+    # Показываем: закреплённых пользователей + пользователей за последние 7 дней
+    cur = request.cursor()
+    cur.execute(
+        f"""
+        SELECT {USER_COLUMNS}
+        FROM users
+        WHERE is_pinned = TRUE OR created_at >= CURRENT_TIMESTAMP - INTERVAL '7 days'
+        ORDER BY is_pinned DESC, created_at DESC
+        """
+    )
+    users = cur.fetchall()
+
+    return json_response(200, {'users': [row_to_user(user) for user in users]})
+
+@router.route('GET', 'search')
+@conditional('users')
+def search(request: Request) -> dict:
+    try:
+        term = normalize_term(request.query.get('q'))
+    except ValueError:
+        raise HttpError(400, 'Введите строку поиска')
     try:
-        if method == 'POST':
-            body_data = json.loads(event.get('body', '{}'))
-            action = body_data.get('action')
-            
-            if action == 'login':
-                username = (body_data.get('username') or '').strip()
-                password = (body_data.get('password') or '').strip()
-                
-                if not username or not password:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Введите логин и пароль'}),
-                        'isBase64Encoded': False
-                    }
-                
-                password_hash = hash_password(password)
-                
-                cur.execute(
-                    "SELECT id, username FROM admins WHERE username = %s AND password_hash = %s",
-                    (username, password_hash)
-                )
-                admin = cur.fetchone()
-                
-                if not admin:
-                    return {
-                        'statusCode': 401,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Неверный логин или пароль'}),
-                        'isBase64Encoded': False
-                    }
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'success': True,
-                        'admin': {
-                            'id': admin[0],
-                            'username': admin[1]
-                        }
-                    }),
-                    'isBase64Encoded': False
-                }
-            
-            elif action == 'update_user':
-                user_id = body_data.get('userId')
-                balance = body_data.get('balance')
-                referral_count = body_data.get('referralCount')
-                
-                if not user_id:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'ID пользователя обязателен'}),
-                        'isBase64Encoded': False
-                    }
-                
-                updates = []
-                params = []
-                
-                if balance is not None:
-                    updates.append("balance = %s")
-                    params.append(balance)
-                
-                if referral_count is not None:
-                    updates.append("referral_count = %s")
-                    params.append(referral_count)
-                
-                if not updates:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Нет данных для обновления'}),
-                        'isBase64Encoded': False
-                    }
-                
-                params.append(user_id)
-                query = f"UPDATE users SET {', '.join(updates)} WHERE id = %s RETURNING id, username, balance, referral_count"
-                
-                cur.execute(query, params)
-                user = cur.fetchone()
-                conn.commit()
-                
-                if not user:
-                    return {
-                        'statusCode': 404,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Пользователь не найден'}),
-                        'isBase64Encoded': False
-                    }
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'success': True,
-                        'user': {
-                            'id': user[0],
-                            'username': user[1],
-                            'balance': user[2],
-                            'referralCount': user[3]
-                        }
-                    }),
-                    'isBase64Encoded': False
-                }
-            
-            elif action == 'ban_user':
-                user_id = body_data.get('userId')
-                reason = (body_data.get('reason') or '').strip()
-                
-                if not user_id or not reason:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'ID пользователя и причина обязательны'}),
-                        'isBase64Encoded': False
-                    }
-                
-                cur.execute(
-                    "UPDATE users SET is_banned = TRUE, ban_reason = %s, banned_at = CURRENT_TIMESTAMP WHERE id = %s RETURNING id",
-                    (reason, user_id)
-                )
-                result = cur.fetchone()
-                conn.commit()
-                
-                if not result:
-                    return {
-                        'statusCode': 404,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Пользователь не найден'}),
-                        'isBase64Encoded': False
-                    }
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True, 'message': 'Пользователь заблокирован'}),
-                    'isBase64Encoded': False
-                }
-            
-            elif action == 'unban_user':
-                user_id = body_data.get('userId')
-                
-                if not user_id:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'ID пользователя обязателен'}),
-                        'isBase64Encoded': False
-                    }
-                
-                cur.execute(
-                    "UPDATE users SET is_banned = FALSE, ban_reason = NULL, banned_at = NULL WHERE id = %s RETURNING id",
-                    (user_id,)
-                )
-                result = cur.fetchone()
-                conn.commit()
-                
-                if not result:
-                    return {
-                        'statusCode': 404,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Пользователь не найден'}),
-                        'isBase64Encoded': False
-                    }
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True, 'message': 'Пользователь разблокирован'}),
-                    'isBase64Encoded': False
-                }
-            
-            elif action == 'pin_user':
-                user_id = body_data.get('userId')
-                
-                if not user_id:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'ID пользователя обязателен'}),
-                        'isBase64Encoded': False
-                    }
-                
-                cur.execute(
-                    "UPDATE users SET is_pinned = TRUE WHERE id = %s RETURNING id",
-                    (user_id,)
-                )
-                result = cur.fetchone()
-                conn.commit()
-                
-                if not result:
-                    return {
-                        'statusCode': 404,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Пользователь не найден'}),
-                        'isBase64Encoded': False
-                    }
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True, 'message': 'Пользователь закреплён'}),
-                    'isBase64Encoded': False
-                }
-            
-            elif action == 'unpin_user':
-                user_id = body_data.get('userId')
-                
-                if not user_id:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'ID пользователя обязателен'}),
-                        'isBase64Encoded': False
-                    }
-                
-                cur.execute(
-                    "UPDATE users SET is_pinned = FALSE WHERE id = %s RETURNING id",
-                    (user_id,)
-                )
-                result = cur.fetchone()
-                conn.commit()
-                
-                if not result:
-                    return {
-                        'statusCode': 404,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Пользователь не найден'}),
-                        'isBase64Encoded': False
-                    }
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True, 'message': 'Пользователь откреплён'}),
-                    'isBase64Encoded': False
-                }
-            
-            else:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Неизвестное действие'}),
-                    'isBase64Encoded': False
-                }
-        
-        elif method == 'GET':
-            # Показываем: закреплённых пользователей + пользователей за последние 7 дней
-            cur.execute(
-                """
-                SELECT id, username, balance, referral_count, is_banned, ban_reason, created_at, is_pinned 
-                FROM users 
-                WHERE is_pinned = TRUE OR created_at >= CURRENT_TIMESTAMP - INTERVAL '7 days'
-                ORDER BY is_pinned DESC, created_at DESC
-                """
-            )
-            users = cur.fetchall()
-            
-            users_list = []
-            for user in users:
-                users_list.append({
-                    'id': user[0],
-                    'username': user[1],
-                    'balance': user[2],
-                    'referralCount': user[3],
-                    'isBanned': user[4] or False,
-                    'banReason': user[5],
-                    'createdAt': user[6].isoformat() if user[6] else None,
-                    'isPinned': user[7] or False
-                })
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'users': users_list}),
-                'isBase64Encoded': False
-            }
-        
-        else:
-            return {
-                'statusCode': 405,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Method not allowed'}),
-                'isBase64Encoded': False
-            }
-    
-    finally:
-        cur.close()
-        conn.close()
\ No newline at end of file
+        limit = search_limit(request.query.get('limit'))
+    except ValueError:
+        raise HttpError(400, 'limit должен быть числом')
+
+    users = search_users(request.cursor(), term, USER_COLUMNS, limit)
+    return json_response(200, {'users': [row_to_user(user) for user in users]})
+
+HISTORY_DEFAULT_LIMIT = 50
+HISTORY_MAX_LIMIT = 200
+
+@router.route('GET', 'balance_history')
+def balance_history(request: Request) -> dict:
+    # Движения баланса из журнала, новые первыми; cursor — id последней
+    # полученной записи
+    user_id = request.query.get('userId')
+    if not user_id:
+        raise HttpError(400, 'ID пользователя обязателен')
+
+    try:
+        limit = max(1, min(int(request.query.get('limit') or HISTORY_DEFAULT_LIMIT), HISTORY_MAX_LIMIT))
+        before = int(request.query['cursor']) if request.query.get('cursor') else None
+    except ValueError:
+        raise HttpError(400, 'limit и cursor должны быть числами')
+
+    cur = request.cursor()
+    cur.execute(
+        """
+        SELECT id, delta, kind, reference_id, note, created_at
+        FROM balance_ledger
+        WHERE user_id = %s AND (%s::BIGINT IS NULL OR id < %s::BIGINT)
+        ORDER BY id DESC
+        LIMIT %s
+        """,
+        (user_id, before, before, limit + 1)
+    )
+    rows = cur.fetchall()
+
+    # Кэш в users и сумма по журналу должны совпадать; расхождение видно сразу
+    cur.execute("SELECT balance, ledger_balance(id) FROM users WHERE id = %s", (user_id,))
+    balances = cur.fetchone()
+    if not balances:
+        raise HttpError(404, 'Пользователь не найден')
+
+    entries = [
+        {
+            'id': row[0],
+            'delta': int(row[1]),
+            'kind': row[2],
+            'referenceId': row[3],
+            'note': row[4],
+            'createdAt': row[5].isoformat() if row[5] else None,
+        }
+        for row in rows[:limit]
+    ]
+    return json_response(200, {
+        'balance': balances[0] or 0,
+        'ledgerBalance': int(balances[1]),
+        'entries': entries,
+        'nextCursor': str(entries[-1]['id']) if len(rows) > limit else None,
+    })
+
+# Ключи admin_counters (V0016) -> поля ответа
+STATS_FIELDS = {
+    'users_total': 'totalUsers',
+    'users_banned': 'bannedUsers',
+    'users_vip': 'vipUsers',
+    'users_balance': 'totalBalance',
+    'withdrawals_pending': 'pendingWithdrawals',
+    'vip_requests_pending': 'pendingVipRequests',
+    'support_unread_chats': 'unreadSupportChats',
+}
+
+@router.route('GET', 'stats')
+def stats(request: Request) -> dict:
+    # Счётчики поддерживаются триггерами, полные списки не читаются;
+    # значение счётчика — сумма его шардов (V0032)
+    cur = request.cursor()
+    cur.execute(
+        """
+        SELECT name, SUM(value) FROM t_p45110186_greeting_project_202.admin_counters
+        WHERE name = ANY(%s)
+        GROUP BY name
+        """,
+        (list(STATS_FIELDS),)
+    )
+    counters = dict(cur.fetchall())
+
+    result = {}
+    for name, field in STATS_FIELDS.items():
+        value = counters.get(name, 0)
+        result[field] = float(value) if name == 'users_balance' else int(value)
+
+    return json_response(200, result)
+
+handler = router
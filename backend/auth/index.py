@@ -1,10 +1,14 @@
-import json
-import os
+'''
+Обробка реєстрації та авторизації користувачів
+'''
 import hashlib
-import psycopg2
 import random
 import string
-from typing import Dict, Any
+from datetime import datetime
+from typing import Optional, Tuple
+from shared import session
+from shared.ratelimit import LoginGuard
+from shared.http import HttpError, Request, Router, json_response
 
 def hash_password(password: str) -> str:
     return hashlib.sha256(password.encode()).hexdigest()
@@ -12,175 +16,138 @@ def hash_password(password: str) -> str:
 def generate_referral_code() -> str:
     return ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
 
-def get_db_connection():
-    return psycopg2.connect(os.environ['DATABASE_URL'])
-
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
-    '''
-    Обробка реєстрації та авторизації користувачів
-    '''
-    method: str = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
-    
-    if method != 'POST':
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Method not allowed'}),
-            'isBase64Encoded': False
-        }
-    
-    body_data = json.loads(event.get('body', '{}'))
-    action = body_data.get('action')
+def read_credentials(request: Request) -> Tuple[str, str]:
+    body_data = request.body
     username = (body_data.get('username') or '').strip()
     password = (body_data.get('password') or '').strip()
-    referral_code = (body_data.get('referralCode') or '').strip()
-    
+
     if not username or not password:
-        return {
-            'statusCode': 400,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Имя пользователя и пароль обязательны'}),
-            'isBase64Encoded': False
-        }
-    
+        raise HttpError(400, 'Имя пользователя и пароль обязательны')
+
     if len(username) < 3 or len(username) > 50:
-        return {
-            'statusCode': 400,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Имя пользователя должно быть от 3 до 50 символов'}),
-            'isBase64Encoded': False
-        }
-    
+        raise HttpError(400, 'Имя пользователя должно быть от 3 до 50 символов')
+
     if len(password) < 4:
-        return {
-            'statusCode': 400,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Пароль должен быть минимум 4 символа'}),
-            'isBase64Encoded': False
+        raise HttpError(400, 'Пароль должен быть минимум 4 символа')
+
+    return username, password
+
+def auth_response(user: tuple, vip_expires_at: Optional[datetime] = None) -> dict:
+    body = {
+        'success': True,
+        'user': {
+            'id': user[0],
+            'username': user[1],
+            'balance': user[2],
+            'referralCount': user[3],
+            'referralCode': user[4]
         }
-    
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    try:
-        if action == 'register':
-            password_hash = hash_password(password)
-            
-            cur.execute("SELECT id FROM users WHERE username = %s", (username,))
-            if cur.fetchone():
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Пользователь с таким именем уже существует'}),
-                    'isBase64Encoded': False
-                }
-            
-            referred_by_id = None
-            if referral_code:
-                cur.execute("SELECT id FROM users WHERE referral_code = %s", (referral_code,))
-                referrer = cur.fetchone()
-                if referrer:
-                    referred_by_id = referrer[0]
-            
-            new_referral_code = generate_referral_code()
-            while True:
-                cur.execute("SELECT id FROM users WHERE referral_code = %s", (new_referral_code,))
-                if not cur.fetchone():
-                    break
-                new_referral_code = generate_referral_code()
-            
-            cur.execute(
-                "INSERT INTO users (username, password_hash, referral_code, referred_by) VALUES (%s, %s, %s, %s) RETURNING id, username, balance, referral_count, referral_code",
-                (username, password_hash, new_referral_code, referred_by_id)
-            )
-            user = cur.fetchone()
-            
-            if referred_by_id:
-                cur.execute(
-                    "UPDATE users SET referral_count = referral_count + 1 WHERE id = %s",
-                    (referred_by_id,)
-                )
-            
-            conn.commit()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
-                    'success': True,
-                    'user': {
-                        'id': user[0],
-                        'username': user[1],
-                        'balance': user[2],
-                        'referralCount': user[3],
-                        'referralCode': user[4]
-                    }
-                }),
-                'isBase64Encoded': False
-            }
-        
-        elif action == 'login':
-            password_hash = hash_password(password)
-            
-            cur.execute(
-                "SELECT id, username, balance, referral_count, referral_code, is_banned, ban_reason FROM users WHERE username = %s AND password_hash = %s",
-                (username, password_hash)
-            )
-            user = cur.fetchone()
-            
-            if not user:
-                return {
-                    'statusCode': 401,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Неверное имя пользователя или пароль'}),
-                    'isBase64Encoded': False
-                }
-            
-            if user[5]:
-                return {
-                    'statusCode': 403,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': f'Ваш аккаунт заблокирован. Причина: {user[6]}'}),
-                    'isBase64Encoded': False
-                }
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
-                    'success': True,
-                    'user': {
-                        'id': user[0],
-                        'username': user[1],
-                        'balance': user[2],
-                        'referralCount': user[3],
-                        'referralCode': user[4]
-                    }
-                }),
-                'isBase64Encoded': False
-            }
-        
-        else:
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Неизвестное действие'}),
-                'isBase64Encoded': False
-            }
-    
-    finally:
-        cur.close()
-        conn.close()
\ No newline at end of file
+    }
+    # Подписанный токен: остальные функции узнают пользователя без запроса к users
+    if session.enabled():
+        token, expires_in = session.issue(user[0], vip_expires_at=vip_expires_at)
+        body['session'] = {'token': token, 'expiresIn': expires_in}
+    return json_response(200, body)
+
+LOGIN_GUARD = LoginGuard('auth_login')
+
+router = Router('POST, OPTIONS')
+
+# Одна вставка: реферер ищется, код берётся из пула, пользователь создаётся
+# и счётчик реферера увеличивается в одном операторе. Уникальные индексы на
+# username и referral_code отсекают дубли атомарно, без предварительных SELECT.
+# Код из пула (V0018) уже проверен на уникальность; SKIP LOCKED не даёт
+# параллельным регистрациям ждать друг друга. Если пул пуст, используется
+# случайный код, сгенерированный на стороне функции
+REGISTER_SQL = """
+    WITH referrer AS (
+        SELECT id FROM users WHERE referral_code = %(referral_code)s
+    ),
+    pooled_code AS (
+        DELETE FROM referral_code_pool
+        WHERE code = (
+            SELECT code FROM referral_code_pool
+            ORDER BY code
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING code
+    ),
+    inserted AS (
+        INSERT INTO users (username, password_hash, referral_code, referred_by)
+        VALUES (
+            %(username)s,
+            %(password_hash)s,
+            COALESCE((SELECT code FROM pooled_code), %(fallback_referral_code)s),
+            (SELECT id FROM referrer)
+        )
+        ON CONFLICT DO NOTHING
+        RETURNING id, username, balance, referral_count, referral_code, referred_by
+    ),
+    referrer_update AS (
+        UPDATE users SET referral_count = referral_count + 1
+        WHERE id = (SELECT referred_by FROM inserted)
+    )
+    SELECT id, username, balance, referral_count, referral_code FROM inserted
+"""
+
+# Совпадение случайного кода (36^8 вариантов) почти невероятно;
+# ограничение только страхует от бесконечного цикла
+MAX_REFERRAL_CODE_ATTEMPTS = 5
+
+@router.route('POST', 'register')
+def register(request: Request) -> dict:
+    username, password = read_credentials(request)
+    referral_code = (request.body.get('referralCode') or '').strip()
+
+    params = {
+        'username': username,
+        'password_hash': hash_password(password),
+        'referral_code': referral_code or None,
+    }
+
+    cur = request.cursor()
+    user = None
+    for _ in range(MAX_REFERRAL_CODE_ATTEMPTS):
+        params['fallback_referral_code'] = generate_referral_code()
+        cur.execute(REGISTER_SQL, params)
+        user = cur.fetchone()
+        if user:
+            break
+
+        # Конфликт: либо имя занято, либо совпал случайный код
+        cur.execute("SELECT 1 FROM users WHERE username = %s", (username,))
+        if cur.fetchone():
+            raise HttpError(400, 'Пользователь с таким именем уже существует')
+
+    if not user:
+        raise HttpError(500, 'Не удалось создать пользователя')
+
+    request.conn.commit()
+
+    return auth_response(user)
+
+@router.route('POST', 'login')
+def login(request: Request) -> dict:
+    username, password = read_credentials(request)
+    # До хеширования и запроса: перебор паролей не доходит до базы
+    LOGIN_GUARD.check(request, username)
+    password_hash = hash_password(password)
+
+    cur = request.cursor()
+    cur.execute(
+        "SELECT id, username, balance, referral_count, referral_code, is_banned, ban_reason, is_vip, vip_expires_at FROM users WHERE username = %s AND password_hash = %s",
+        (username, password_hash)
+    )
+    user = cur.fetchone()
+
+    if not user:
+        raise HttpError(401, 'Неверное имя пользователя или пароль')
+
+    if user[5]:
+        raise HttpError(403, f'Ваш аккаунт заблокирован. Причина: {user[6]}')
+
+    LOGIN_GUARD.succeeded(request, username)
+    return auth_response(user, vip_expires_at=user[8] if user[7] else None)
+
+handler = router
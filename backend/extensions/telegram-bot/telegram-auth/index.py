@@ -9,30 +9,28 @@ Flow:
 4. Refresh tokens stored hashed (SHA256) in DB
 """
 
-import json
 import os
 import hashlib
 import secrets
 from datetime import datetime, timezone, timedelta
+from functools import lru_cache
 from typing import Optional
-import psycopg2
-import jwt
+
+from shared.http import HttpError, Request, Router, json_response
 
 
 # =============================================================================
 # CONFIGURATION
 # =============================================================================
 
-def get_db_connection():
-    return psycopg2.connect(os.environ["DATABASE_URL"])
-
-
+@lru_cache(maxsize=None)
 def get_schema() -> str:
     """Get database schema prefix."""
     schema = os.environ.get("MAIN_DB_SCHEMA", "public")
     return f"{schema}." if schema else ""
 
 
+@lru_cache(maxsize=None)
 def get_env(key: str) -> str:
     value = os.environ.get(key)
     if not value:
@@ -53,6 +51,9 @@ def generate_token(length: int = 32) -> str:
 
 
 def create_jwt(user_id: int, secret: str, expires_in: int = 900) -> str:
+    # PyJWT is only needed to issue tokens, not for preflight or logout
+    import jwt
+
     payload = {
         "user_id": user_id,
         "exp": datetime.now(timezone.utc) + timedelta(seconds=expires_in),
@@ -245,35 +246,6 @@ def cleanup_expired_refresh_tokens(cursor) -> None:
     cursor.execute(f"DELETE FROM {schema}refresh_tokens WHERE expires_at < NOW()")
 
 
-# =============================================================================
-# CORS HELPERS
-# =============================================================================
-
-def get_cors_headers() -> dict:
-    allowed_origins = os.environ.get("ALLOWED_ORIGINS", "*")
-    return {
-        "Access-Control-Allow-Origin": allowed_origins,
-        "Access-Control-Allow-Methods": "POST, OPTIONS",
-        "Access-Control-Allow-Headers": "Content-Type",
-    }
-
-
-def cors_response(status: int, body: dict) -> dict:
-    return {
-        "statusCode": status,
-        "headers": {**get_cors_headers(), "Content-Type": "application/json"},
-        "body": json.dumps(body),
-    }
-
-
-def options_response() -> dict:
-    return {
-        "statusCode": 204,
-        "headers": get_cors_headers(),
-        "body": "",
-    }
-
-
 # =============================================================================
 # ACTION HANDLERS
 # =============================================================================
@@ -287,14 +259,14 @@ def handle_callback(cursor, body: dict) -> dict:
     token = body.get("token")
     print(f"[DEBUG] Callback received token: {token}")
     if not token:
-        return cors_response(400, {"error": "Missing token"})
+        return json_response(400, {"error": "Missing token"})
 
     token_data = get_auth_token(cursor, token)
     print(f"[DEBUG] Token data from DB: {token_data}")
 
     if not token_data:
         print(f"[DEBUG] Token not found in DB. Token hash: {hash_token(token)}")
-        return cors_response(404, {"error": "Token not found"})
+        return json_response(404, {"error": "Token not found"})
 
     # Check if expired (handle both naive and aware datetime from DB)
     expires_at = token_data["expires_at"]
@@ -303,20 +275,20 @@ def handle_callback(cursor, body: dict) -> dict:
     if expires_at.tzinfo is None:
         expires_at = expires_at.replace(tzinfo=timezone.utc)
     if expires_at < now:
-        return cors_response(410, {"error": "Token expired"})
+        return json_response(410, {"error": "Token expired"})
 
     # Check if already used
     if token_data["used"]:
-        return cors_response(410, {"error": "Token already used"})
+        return json_response(410, {"error": "Token already used"})
 
     # Check if user data exists
     if not token_data["telegram_id"]:
-        return cors_response(400, {"error": "Token not authenticated"})
+        return json_response(400, {"error": "Token not authenticated"})
 
     # Get JWT secret
     jwt_secret = get_env("JWT_SECRET")
     if len(jwt_secret) < 32:
-        return cors_response(500, {"error": "Server configuration error"})
+        return json_response(500, {"error": "Server configuration error"})
 
     # Create or update user
     user = create_or_update_user(
@@ -339,7 +311,7 @@ def handle_callback(cursor, body: dict) -> dict:
 
     save_refresh_token(cursor, user["id"], refresh_token_hash, refresh_expires)
 
-    return cors_response(200, {
+    return json_response(200, {
         "access_token": access_token,
         "refresh_token": refresh_token,
         "expires_in": 900,
@@ -354,23 +326,23 @@ def handle_refresh(cursor, body: dict) -> dict:
     """
     refresh_token = body.get("refresh_token")
     if not refresh_token:
-        return cors_response(400, {"error": "Missing refresh_token"})
+        return json_response(400, {"error": "Missing refresh_token"})
 
     jwt_secret = get_env("JWT_SECRET")
     token_hash = hash_token(refresh_token)
 
     token_data = find_refresh_token(cursor, token_hash)
     if not token_data:
-        return cors_response(401, {"error": "Invalid or expired refresh token"})
+        return json_response(401, {"error": "Invalid or expired refresh token"})
 
     user = get_user_by_id(cursor, token_data["user_id"])
     if not user:
-        return cors_response(401, {"error": "User not found"})
+        return json_response(401, {"error": "User not found"})
 
     # Generate new access token
     access_token = create_jwt(user["id"], jwt_secret)
 
-    return cors_response(200, {
+    return json_response(200, {
         "access_token": access_token,
         "expires_in": 900,
         "user": user,
@@ -387,63 +359,42 @@ def handle_logout(cursor, body: dict) -> dict:
         token_hash = hash_token(refresh_token)
         delete_refresh_token(cursor, token_hash)
 
-    return cors_response(200, {"success": True})
+    return json_response(200, {"success": True})
 
 
 # =============================================================================
 # MAIN HANDLER
 # =============================================================================
 
-def handler(event, context):
-    """Main entry point."""
-    method = event.get("httpMethod", "GET")
-
-    # Handle CORS preflight
-    if method == "OPTIONS":
-        return options_response()
+router = Router(
+    "POST, OPTIONS",
+    origin=os.environ.get("ALLOWED_ORIGINS", "*"),
+    preflight_status=204,
+    unknown_action="Unknown action: {action}",
+    expose_errors=False,
+)
 
-    # Parse query params
-    params = event.get("queryStringParameters") or {}
-    action = params.get("action", "")
 
-    # Parse body for POST requests
-    body = {}
-    if method == "POST":
-        raw_body = event.get("body", "{}")
+def with_cleanup(action):
+    """Wrap action handler: cleanup expired tokens, run action, commit."""
+    def route(request: Request) -> dict:
+        cursor = request.cursor()
         try:
-            body = json.loads(raw_body) if raw_body else {}
-        except json.JSONDecodeError:
-            return cors_response(400, {"error": "Invalid JSON"})
-
-    conn = None
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        # Cleanup expired tokens periodically
-        cleanup_expired_tokens(cursor)
-        cleanup_expired_refresh_tokens(cursor)
-
-        # Route to action handler
-        if action == "callback" and method == "POST":
-            response = handle_callback(cursor, body)
-        elif action == "refresh" and method == "POST":
-            response = handle_refresh(cursor, body)
-        elif action == "logout" and method == "POST":
-            response = handle_logout(cursor, body)
-        else:
-            response = cors_response(400, {"error": f"Unknown action: {action}"})
-
-        conn.commit()
+            # Cleanup expired tokens periodically
+            cleanup_expired_tokens(cursor)
+            cleanup_expired_refresh_tokens(cursor)
+
+            response = action(cursor, request.body)
+        except ValueError:
+            raise HttpError(500, "Server configuration error")
+
+        request.conn.commit()
         return response
+    return route
+
+
+router.route("POST", "callback")(with_cleanup(handle_callback))
+router.route("POST", "refresh")(with_cleanup(handle_refresh))
+router.route("POST", "logout")(with_cleanup(handle_logout))
 
-    except ValueError as e:
-        return cors_response(500, {"error": "Server configuration error"})
-    except Exception as e:
-        if conn:
-            conn.rollback()
-        print(f"Error: {e}")
-        return cors_response(500, {"error": "Internal server error"})
-    finally:
-        if conn:
-            conn.close()
\ No newline at end of file
+handler = router
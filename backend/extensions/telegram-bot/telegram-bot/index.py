@@ -12,16 +12,23 @@ import os
 import uuid
 import hashlib
 from datetime import datetime, timezone, timedelta
-from typing import Optional
+from functools import lru_cache
+from typing import TYPE_CHECKING, Optional
 
-import psycopg2
-import telebot
+from shared import db
+from shared.http import HttpError, Request, Router, json_response
+
+# pyTelegramBotAPI тянет за собой requests и занимает большую часть холодного
+# старта, поэтому импортируется только на путях, которые отправляют сообщения
+if TYPE_CHECKING:
+    import telebot
 
 
 # =============================================================================
 # CONFIGURATION
 # =============================================================================
 
+@lru_cache(maxsize=None)
 def get_bot_token() -> str:
     """Get Telegram bot token."""
     token = os.environ.get("TELEGRAM_BOT_TOKEN", "")
@@ -30,51 +37,31 @@ def get_bot_token() -> str:
     return token
 
 
-def get_bot() -> telebot.TeleBot:
-    """Create bot instance."""
-    return telebot.TeleBot(get_bot_token())
+def load_telebot():
+    """Import pyTelegramBotAPI on first use."""
+    import telebot
+    return telebot
+
+
+@lru_cache(maxsize=None)
+def get_bot() -> "telebot.TeleBot":
+    """Bot instance, shared by warm invocations of the container."""
+    return load_telebot().TeleBot(get_bot_token())
 
 
+@lru_cache(maxsize=None)
 def get_default_chat_id() -> str:
     """Get default chat ID for notifications."""
     return os.environ.get("TELEGRAM_CHAT_ID", "")
 
 
+@lru_cache(maxsize=None)
 def get_schema() -> str:
     """Get database schema prefix."""
     schema = os.environ.get("MAIN_DB_SCHEMA", "public")
     return f"{schema}." if schema else ""
 
 
-# =============================================================================
-# CORS HELPERS
-# =============================================================================
-
-def get_cors_headers() -> dict:
-    allowed_origins = os.environ.get("ALLOWED_ORIGINS", "*")
-    return {
-        "Access-Control-Allow-Origin": allowed_origins,
-        "Access-Control-Allow-Methods": "POST, OPTIONS",
-        "Access-Control-Allow-Headers": "Content-Type, X-Telegram-Bot-Api-Secret-Token",
-    }
-
-
-def cors_response(status: int, body: dict) -> dict:
-    return {
-        "statusCode": status,
-        "headers": {**get_cors_headers(), "Content-Type": "application/json"},
-        "body": json.dumps(body),
-    }
-
-
-def options_response() -> dict:
-    return {
-        "statusCode": 204,
-        "headers": get_cors_headers(),
-        "body": "",
-    }
-
-
 # =============================================================================
 # DATABASE OPERATIONS
 # =============================================================================
@@ -90,7 +77,7 @@ def save_auth_token(
     token_hash = hashlib.sha256(token.encode()).hexdigest()
     schema = get_schema()
 
-    conn = psycopg2.connect(os.environ["DATABASE_URL"])
+    conn = db.acquire()
     try:
         cursor = conn.cursor()
         cursor.execute(f"""
@@ -109,7 +96,7 @@ def save_auth_token(
         ))
         conn.commit()
     finally:
-        conn.close()
+        db.release(conn)
 
     return token
 
@@ -130,6 +117,7 @@ def handle_web_auth(chat_id: int, user: dict) -> None:
     site_url = os.environ["SITE_URL"].rstrip("/")
     auth_url = f"{site_url}/auth/telegram/callback?token={token}"
 
+    telebot = load_telebot()
     bot = get_bot()
     bot.send_message(
         chat_id,
@@ -154,7 +142,7 @@ def process_webhook(body: dict) -> dict:
 
     if not message:
         print("[DEBUG] No message in webhook body")
-        return {"statusCode": 200, "body": json.dumps({"ok": True})}
+        return json_response(200, {"ok": True})
 
     text = message.get("text", "")
     user = message.get("from", {})
@@ -164,18 +152,22 @@ def process_webhook(body: dict) -> dict:
 
     if not chat_id:
         print("[DEBUG] No chat_id in message")
-        return {"statusCode": 200, "body": json.dumps({"ok": True})}
+        return json_response(200, {"ok": True})
 
+    # Остальные сообщения не требуют ответа — telebot не импортируется
+    if not text.startswith("/start"):
+        return json_response(200, {"ok": True})
+
+    telebot = load_telebot()
     try:
-        if text.startswith("/start"):
-            parts = text.split(" ", 1)
-            print(f"[DEBUG] /start command detected, parts: {parts}")
-            if len(parts) > 1 and parts[1] == "web_auth":
-                print("[DEBUG] Calling handle_web_auth")
-                handle_web_auth(chat_id, user)
-            else:
-                print("[DEBUG] Calling handle_start")
-                handle_start(chat_id)
+        parts = text.split(" ", 1)
+        print(f"[DEBUG] /start command detected, parts: {parts}")
+        if len(parts) > 1 and parts[1] == "web_auth":
+            print("[DEBUG] Calling handle_web_auth")
+            handle_web_auth(chat_id, user)
+        else:
+            print("[DEBUG] Calling handle_start")
+            handle_start(chat_id)
     except telebot.apihelper.ApiTelegramException as e:
         print(f"[ERROR] Telegram API error: {e}")
     except Exception as e:
@@ -183,7 +175,7 @@ def process_webhook(body: dict) -> dict:
         import traceback
         print(f"[ERROR] Traceback: {traceback.format_exc()}")
 
-    return {"statusCode": 200, "body": json.dumps({"ok": True})}
+    return json_response(200, {"ok": True})
 
 
 # =============================================================================
@@ -201,14 +193,15 @@ def handle_send(body: dict) -> dict:
     silent = body.get("silent", False)
 
     if not text:
-        return cors_response(400, {"error": "text is required"})
+        return json_response(400, {"error": "text is required"})
 
     if not chat_id:
-        return cors_response(400, {"error": "chat_id is required"})
+        return json_response(400, {"error": "chat_id is required"})
 
     if len(text) > 4096:
-        return cors_response(400, {"error": "Message too long (max 4096 characters)"})
+        return json_response(400, {"error": "Message too long (max 4096 characters)"})
 
+    telebot = load_telebot()
     try:
         bot = get_bot()
         result = bot.send_message(
@@ -218,17 +211,17 @@ def handle_send(body: dict) -> dict:
             disable_notification=silent,
             disable_web_page_preview=True,
         )
-        return cors_response(200, {
+        return json_response(200, {
             "success": True,
             "message_id": result.message_id,
         })
     except telebot.apihelper.ApiTelegramException as e:
-        return cors_response(400, {
+        return json_response(400, {
             "error": e.description,
             "error_code": e.error_code,
         })
     except Exception as e:
-        return cors_response(500, {"error": str(e)})
+        return json_response(500, {"error": str(e)})
 
 
 def handle_send_photo(body: dict) -> dict:
@@ -242,11 +235,12 @@ def handle_send_photo(body: dict) -> dict:
     parse_mode = body.get("parse_mode", "HTML")
 
     if not photo_url:
-        return cors_response(400, {"error": "photo_url is required"})
+        return json_response(400, {"error": "photo_url is required"})
 
     if not chat_id:
-        return cors_response(400, {"error": "chat_id is required"})
+        return json_response(400, {"error": "chat_id is required"})
 
+    telebot = load_telebot()
     try:
         bot = get_bot()
         result = bot.send_photo(
@@ -255,17 +249,17 @@ def handle_send_photo(body: dict) -> dict:
             caption=caption if caption else None,
             parse_mode=parse_mode,
         )
-        return cors_response(200, {
+        return json_response(200, {
             "success": True,
             "message_id": result.message_id,
         })
     except telebot.apihelper.ApiTelegramException as e:
-        return cors_response(400, {
+        return json_response(400, {
             "error": e.description,
             "error_code": e.error_code,
         })
     except Exception as e:
-        return cors_response(500, {"error": str(e)})
+        return json_response(500, {"error": str(e)})
 
 
 def handle_test(body: dict) -> dict:
@@ -276,7 +270,7 @@ def handle_test(body: dict) -> dict:
     chat_id = body.get("chat_id") or get_default_chat_id()
 
     if not chat_id:
-        return cors_response(400, {"error": "chat_id is required"})
+        return json_response(400, {"error": "chat_id is required"})
 
     text = f"""<b>Тестовое сообщение</b>
 
@@ -284,6 +278,7 @@ def handle_test(body: dict) -> dict:
 
 <i>Время: {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}</i>"""
 
+    telebot = load_telebot()
     try:
         bot = get_bot()
         result = bot.send_message(
@@ -291,62 +286,59 @@ def handle_test(body: dict) -> dict:
             text=text,
             parse_mode="HTML",
         )
-        return cors_response(200, {
+        return json_response(200, {
             "success": True,
             "message": "Test message sent",
             "message_id": result.message_id,
         })
     except telebot.apihelper.ApiTelegramException as e:
-        return cors_response(400, {
+        return json_response(400, {
             "error": e.description,
             "error_code": e.error_code,
         })
     except Exception as e:
-        return cors_response(500, {"error": str(e)})
+        return json_response(500, {"error": str(e)})
 
 
 # =============================================================================
 # MAIN HANDLER
 # =============================================================================
 
-def handler(event: dict, context) -> dict:
-    """Main entry point."""
-    method = event.get("httpMethod", "POST")
-
-    if method == "OPTIONS":
-        return options_response()
-
-    params = event.get("queryStringParameters") or {}
-    action = params.get("action", "")
-
-    # If action specified — handle notification API
-    if action:
-        body = {}
-        if method == "POST":
-            raw_body = event.get("body", "{}")
-            try:
-                body = json.loads(raw_body) if raw_body else {}
-            except json.JSONDecodeError:
-                return cors_response(400, {"error": "Invalid JSON"})
-
-        if action == "send" and method == "POST":
-            return handle_send(body)
-        elif action == "send-photo" and method == "POST":
-            return handle_send_photo(body)
-        elif action == "test" and method == "POST":
-            return handle_test(body)
-        else:
-            return cors_response(400, {"error": f"Unknown action: {action}"})
+router = Router(
+    "POST, OPTIONS",
+    allow_headers="Content-Type, X-Telegram-Bot-Api-Secret-Token",
+    origin=os.environ.get("ALLOWED_ORIGINS", "*"),
+    preflight_status=204,
+    default_method="POST",
+    unknown_action="Unknown action: {action}",
+)
+
+@router.route("POST", "send")
+def send(request: Request) -> dict:
+    return handle_send(request.body)
+
+
+@router.route("POST", "send-photo")
+def send_photo(request: Request) -> dict:
+    return handle_send_photo(request.body)
 
-    # No action — handle Telegram webhook
-    headers = event.get("headers", {})
-    headers_lower = {k.lower(): v for k, v in headers.items()}
+
+@router.route("POST", "test")
+def test(request: Request) -> dict:
+    return handle_test(request.body)
+
+
+@router.route("POST", "")
+def webhook(request: Request) -> dict:
+    """No action — handle Telegram webhook."""
     webhook_secret = os.environ.get("TELEGRAM_WEBHOOK_SECRET")
 
     if webhook_secret:
-        request_secret = headers_lower.get("x-telegram-bot-api-secret-token", "")
+        request_secret = request.headers.get("x-telegram-bot-api-secret-token", "")
         if request_secret != webhook_secret:
-            return {"statusCode": 401, "body": json.dumps({"error": "Unauthorized"})}
+            raise HttpError(401, "Unauthorized")
+
+    return process_webhook(request.body)
+
 
-    body = json.loads(event.get("body", "{}"))
-    return process_webhook(body)
\ No newline at end of file
+handler = router
@@ -1,99 +1,291 @@
-import json
-import os
-import psycopg2
-
-def handler(event: dict, context) -> dict:
-    '''API для получения списка всех игроков'''
-    
-    method = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Admin-Token',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
-    
-    if method != 'GET':
-        return {
-            'statusCode': 405,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'error': 'Method not allowed'}),
-            'isBase64Encoded': False
-        }
-    
-    conn = None
+import io
+import csv
+import gzip
+import base64
+from datetime import datetime
+from typing import Iterator, Optional, Tuple
+from shared.etag import conditional
+from shared.http import HttpError, JSON_HEADERS, Request, Router, dumps, json_response
+from shared.search import normalize_term, search_limit, search_users
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Сколько строк за раз забирает серверный курсор при выгрузке
+EXPORT_BATCH_SIZE = 2000
+# Выгрузка собирается в памяти целиком, поэтому за один вызов отдаётся не
+# больше EXPORT_MAX_ROWS строк; продолжение — запрос с ?cursor= из
+# заголовка X-Next-Cursor (его нет на последней части)
+EXPORT_MAX_ROWS = 20000
+EXPORT_FORMATS = {
+    'ndjson': ('application/x-ndjson', 'players.ndjson'),
+    'csv': ('text/csv; charset=utf-8', 'players.csv'),
+}
+
+TRUE_VALUES = ('true', '1', 'yes')
+FALSE_VALUES = ('false', '0', 'no')
+
+PLAYER_COLUMNS = '''
+    id,
+    username,
+    balance,
+    referral_count,
+    created_at,
+    is_banned,
+    ban_reason,
+    is_vip,
+    vip_expires_at,
+    telegram_username,
+    last_login_at
+'''
+PLAYER_FIELDS = [
+    'id', 'username', 'balance', 'referralCount', 'createdAt', 'isBanned',
+    'banReason', 'isVip', 'vipExpiresAt', 'telegramUsername', 'lastLoginAt'
+]
+
+
+def encode_cursor(created_at: datetime, user_id: int) -> str:
+    raw = f'{created_at.isoformat()}|{user_id}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    padded = cursor + '=' * (-len(cursor) % 4)
+    created_at, user_id = base64.urlsafe_b64decode(padded.encode()).decode().split('|', 1)
+    return datetime.fromisoformat(created_at), int(user_id)
+
+
+def parse_bool(value: Optional[str]) -> Optional[bool]:
+    if value is None or value == '':
+        return None
+    value = value.lower()
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    raise ValueError(value)
+
+
+def build_filters(params: dict) -> Tuple[list, list]:
+    '''Условия WHERE под частичные индексы из V0013'''
+    conditions = []
+    values = []
+
+    banned = parse_bool(params.get('banned'))
+    if banned is True:
+        conditions.append('is_banned = TRUE')
+    elif banned is False:
+        conditions.append('is_banned = FALSE')
+
+    vip = parse_bool(params.get('vip'))
+    if vip is True:
+        conditions.append('is_vip = TRUE')
+    elif vip is False:
+        conditions.append('is_vip = FALSE')
+
+    has_telegram = parse_bool(params.get('hasTelegram'))
+    if has_telegram is True:
+        conditions.append('telegram_id IS NOT NULL')
+    elif has_telegram is False:
+        conditions.append('telegram_id IS NULL')
+
+    if params.get('createdFrom'):
+        conditions.append('created_at >= %s')
+        values.append(datetime.fromisoformat(params['createdFrom']))
+
+    if params.get('createdTo'):
+        conditions.append('created_at < %s')
+        values.append(datetime.fromisoformat(params['createdTo']))
+
+    return conditions, values
+
+
+def row_to_player(row: tuple) -> dict:
+    return {
+        'id': row[0],
+        'username': row[1],
+        'balance': row[2] or 0,
+        'referralCount': row[3] or 0,
+        'createdAt': row[4].isoformat() if row[4] else None,
+        'isBanned': row[5] or False,
+        'banReason': row[6],
+        'isVip': row[7] or False,
+        'vipExpiresAt': row[8].isoformat() if row[8] else None,
+        'telegramUsername': row[9],
+        'lastLoginAt': row[10].isoformat() if row[10] else None
+    }
+
+
+def iter_export_chunks(cursor, fmt: str, header: bool, page: dict) -> Iterator[str]:
+    '''
+    Кодирует строки курсора пачками по EXPORT_BATCH_SIZE, не больше
+    EXPORT_MAX_ROWS; если строки остались, в page['next'] — курсор продолжения
+    '''
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if fmt == 'csv' else None
+
+    # Заголовок CSV только в первой части, чтобы части можно было склеить
+    if writer and header:
+        writer.writerow(PLAYER_FIELDS)
+
+    remaining = EXPORT_MAX_ROWS
+    last = None
+    while True:
+        rows = cursor.fetchmany(EXPORT_BATCH_SIZE)
+        if not rows:
+            break
+        if len(rows) > remaining:
+            rows = rows[:remaining]
+            last = rows[-1] if rows else last
+            page['next'] = encode_cursor(last[4], last[0])
+            remaining = 0
+        else:
+            remaining -= len(rows)
+            last = rows[-1]
+        for row in rows:
+            player = row_to_player(row)
+            if writer:
+                writer.writerow([player[field] for field in PLAYER_FIELDS])
+            else:
+                buffer.write(dumps(player))
+                buffer.write('\n')
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        if 'next' in page:
+            break
+
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def next_cursor_headers(next_cursor: str) -> dict:
+    return {'X-Next-Cursor': next_cursor, 'Access-Control-Expose-Headers': 'X-Next-Cursor'}
+
+
+def export_players(conn, fmt: str, compress: bool, where: str, values: list, first: bool) -> dict:
+    '''
+    Часть выгрузки игроков (до EXPORT_MAX_ROWS строк) через именованный
+    (серверный) курсор: в памяти одновременно только одна пачка строк и
+    уже закодированный результат
+    '''
+    page: dict = {}
+    cursor = conn.cursor(name='players_export')
+    cursor.itersize = EXPORT_BATCH_SIZE
+
     try:
-        dsn = os.environ.get('DATABASE_URL')
-        conn = psycopg2.connect(dsn)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT 
-                id,
-                username,
-                balance,
-                referral_count,
-                created_at,
-                is_banned,
-                ban_reason,
-                is_vip,
-                vip_expires_at,
-                telegram_username,
-                last_login_at
+        cursor.execute(f'''
+            SELECT {PLAYER_COLUMNS}
             FROM t_p45110186_greeting_project_202.users
-            ORDER BY created_at DESC
-        ''')
-        
-        rows = cursor.fetchall()
-        
-        result = []
-        for row in rows:
-            result.append({
-                'id': row[0],
-                'username': row[1],
-                'balance': row[2] or 0,
-                'referralCount': row[3] or 0,
-                'createdAt': row[4].isoformat() if row[4] else None,
-                'isBanned': row[5] or False,
-                'banReason': row[6],
-                'isVip': row[7] or False,
-                'vipExpiresAt': row[8].isoformat() if row[8] else None,
-                'telegramUsername': row[9],
-                'lastLoginAt': row[10].isoformat() if row[10] else None
-            })
-        
-        cursor.close()
-        
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'players': result}),
-            'isBase64Encoded': False
+            {where}
+            ORDER BY created_at DESC, id DESC
+            LIMIT %s
+        ''', values + [EXPORT_MAX_ROWS + 1])
+
+        content_type, filename = EXPORT_FORMATS[fmt]
+        if compress:
+            filename += '.gz'
+        headers = {
+            **JSON_HEADERS,
+            'Content-Type': content_type,
+            'Content-Disposition': f'attachment; filename="{filename}"'
         }
-        
-    except Exception as e:
+
+        if compress:
+            output = io.BytesIO()
+            with gzip.GzipFile(fileobj=output, mode='wb', compresslevel=6) as archive:
+                for chunk in iter_export_chunks(cursor, fmt, first, page):
+                    archive.write(chunk.encode())
+            headers['Content-Encoding'] = 'gzip'
+            if page:
+                headers.update(next_cursor_headers(page['next']))
+            return {
+                'statusCode': 200,
+                'headers': headers,
+                'body': base64.b64encode(output.getvalue()).decode(),
+                'isBase64Encoded': True
+            }
+
+        output = io.StringIO()
+        for chunk in iter_export_chunks(cursor, fmt, first, page):
+            output.write(chunk)
+        if page:
+            headers.update(next_cursor_headers(page['next']))
         return {
-            'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'error': str(e)}),
+            'statusCode': 200,
+            'headers': headers,
+            'body': output.getvalue(),
             'isBase64Encoded': False
         }
     finally:
-        if conn:
-            conn.close()
\ No newline at end of file
+        cursor.close()
+
+
+router = Router('GET, OPTIONS', allow_headers='Content-Type, X-Admin-Token, If-None-Match')
+
+
+@router.route('GET')
+@conditional('users')
+def list_players(request: Request) -> dict:
+    '''API для постраничного получения списка игроков с фильтрами и их выгрузки'''
+    params = request.query
+    export_format = params.get('export')
+
+    try:
+        if export_format and export_format not in EXPORT_FORMATS:
+            raise ValueError(export_format)
+        compress = bool(parse_bool(params.get('gzip')))
+        limit = min(max(int(params.get('limit') or DEFAULT_PAGE_SIZE), 1), MAX_PAGE_SIZE)
+        conditions, values = build_filters(params)
+        if params.get('cursor'):
+            cursor_created_at, cursor_id = decode_cursor(params['cursor'])
+            conditions.append('(created_at, id) < (%s, %s)')
+            values.extend([cursor_created_at, cursor_id])
+    except ValueError:
+        raise HttpError(400, 'Некорректные параметры запроса')
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+    if export_format:
+        return export_players(request.conn, export_format, compress, where, values, not params.get('cursor'))
+
+    cursor = request.cursor()
+
+    # Берём на одну строку больше, чтобы понять, есть ли следующая страница
+    cursor.execute(f'''
+        SELECT {PLAYER_COLUMNS}
+        FROM t_p45110186_greeting_project_202.users
+        {where}
+        ORDER BY created_at DESC, id DESC
+        LIMIT %s
+    ''', values + [limit + 1])
+
+    rows = cursor.fetchall()
+    cursor.close()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][4], rows[-1][0])
+
+    return json_response(200, {
+        'players': [row_to_player(row) for row in rows],
+        'next': next_cursor
+    })
+
+
+@router.route('GET', 'search')
+@conditional('users')
+def search_players(request: Request) -> dict:
+    '''Поиск игроков по username и telegram_username (?action=search&q=...)'''
+    try:
+        term = normalize_term(request.query.get('q'))
+        limit = search_limit(request.query.get('limit'))
+    except ValueError:
+        raise HttpError(400, 'Некорректные параметры запроса')
+
+    rows = search_users(request.cursor(), term, PLAYER_COLUMNS, limit)
+    return json_response(200, {'players': [row_to_player(row) for row in rows]})
+
+
+handler = router
@@ -1,131 +1,337 @@
-import json
+'''API для отслеживания реферальных переходов и получения статистики'''
 import os
-import psycopg2
-from urllib.parse import parse_qs
-
-def handler(event: dict, context) -> dict:
-    '''API для отслеживания реферальных переходов и получения статистики'''
-    
-    method = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type'
-            },
-            'body': ''
-        }
-    
-    dsn = os.environ.get('DATABASE_URL')
-    schema = 't_p45110186_greeting_project_202'
-    
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, timedelta
+
+from shared.http import HttpError, Request, Router, json_response
+from shared.session import caller_id
+
+schema = 't_p45110186_greeting_project_202'
+
+router = Router('GET, POST, OPTIONS', allow_headers='Content-Type, Authorization')
+
+# За сколько последних суток считать уникальных посетителей
+UNIQUE_VISITORS_DAYS = 30
+
+# Корзина графика -> (таблица V0024, столбец корзины, шаг, выражение для
+# ещё не агрегированных кликов, длина по умолчанию и максимальная, сутки)
+SERIES_BUCKETS = {
+    'day': ('referral_stats_daily', 'day', '1 day', 'created_at::DATE', 7, 366),
+    'hour': ('referral_stats_hourly', 'bucket', '1 hour', "date_trunc('hour', created_at)", 1, 31),
+}
+
+# Рейтинг рефереров читается из снимка V0025; кэш в памяти контейнера
+# держит верх рейтинга и места пользователей до LEADERBOARD_CACHE_TTL секунд
+LEADERBOARD_CACHE_TTL = int(os.environ.get('LEADERBOARD_CACHE_TTL') or 60)
+LEADERBOARD_DEFAULT_LIMIT = 10
+LEADERBOARD_MAX_LIMIT = 100
+
+
+class TTLCache:
+    '''Значения живут ttl секунд; сверх max_keys вытесняются самые давние'''
+
+    def __init__(self, ttl: float, max_keys: int = 10_000):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        # key -> (значение, момент устаревания)
+        self._items: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, load):
+        now = time.monotonic()
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and item[1] > now:
+                return item[0]
+
+        value = load()
+        with self._lock:
+            self._items[key] = (value, now + self.ttl)
+            self._items.move_to_end(key)
+            if len(self._items) > self.max_keys:
+                self._items.popitem(last=False)
+        return value
+
+
+LEADERBOARD_CACHE = TTLCache(LEADERBOARD_CACHE_TTL)
+
+# Оценка уникальных посетителей — объединение суточных скетчей за
+# UNIQUE_VISITORS_DAYS; кэш избавляет частые опросы статистики от
+# повторного объединения
+UNIQUE_VISITORS_CACHE_TTL = int(os.environ.get('UNIQUE_VISITORS_CACHE_TTL') or 300)
+UNIQUE_VISITORS_CACHE = TTLCache(UNIQUE_VISITORS_CACHE_TTL)
+
+# Уровни реферального дерева (V0026): по умолчанию показываются три,
+# глубже 10 связи не хранятся
+REFERRAL_LEVELS = 3
+REFERRAL_MAX_LEVEL = 10
+DOWNLINE_DEFAULT_LIMIT = 50
+DOWNLINE_MAX_LIMIT = 100
+
+
+def int_param(request: Request, name: str, default: int, low: int, high: int) -> int:
+    value = request.query.get(name)
+    if value in (None, ''):
+        return default
     try:
-        conn = psycopg2.connect(dsn)
-        cur = conn.cursor()
-        
-        if method == 'POST':
-            body = json.loads(event.get('body', '{}'))
-            action = body.get('action')
-            
-            if action == 'track_click':
-                ref_user_id = body.get('refUserId')
-                visitor_ip = event.get('requestContext', {}).get('identity', {}).get('sourceIp', '')
-                
-                if not ref_user_id:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'refUserId required'})
-                    }
-                
-                cur.execute(f"UPDATE {schema}.users SET referral_clicks = referral_clicks + 1 WHERE id = %s", (ref_user_id,))
-                conn.commit()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True, 'message': 'Click tracked'})
-                }
-            
-            elif action == 'track_registration':
-                ref_user_id = body.get('refUserId')
-                new_user_id = body.get('newUserId')
-                
-                if not ref_user_id or not new_user_id:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'refUserId and newUserId required'})
-                    }
-                
-                cur.execute(f"SELECT id FROM {schema}.users WHERE id = %s", (ref_user_id,))
-                if cur.fetchone():
-                    cur.execute(f"UPDATE {schema}.users SET referral_registrations = referral_registrations + 1, referral_count = referral_count + 1 WHERE id = %s", (ref_user_id,))
-                    
-                    cur.execute(f"UPDATE {schema}.users SET referred_by = %s WHERE id = %s", (ref_user_id, new_user_id))
-                    
-                    conn.commit()
-                    
-                    return {
-                        'statusCode': 200,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'success': True, 'message': 'Registration tracked'})
-                    }
-                else:
-                    return {
-                        'statusCode': 404,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Referrer not found'})
-                    }
-        
-        elif method == 'GET':
-            query_params = event.get('queryStringParameters') or {}
-            user_id = query_params.get('userId')
-            
-            if not user_id:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'userId required'})
-                }
-            
-            cur.execute(f"SELECT referral_clicks, referral_registrations, referral_count FROM {schema}.users WHERE id = %s", (user_id,))
-            result = cur.fetchone()
-            
-            if result:
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'clicks': result[0] or 0,
-                        'registrations': result[1] or 0,
-                        'deposits': result[2] or 0
-                    })
-                }
-            else:
-                return {
-                    'statusCode': 404,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'User not found'})
-                }
-        
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Method not allowed'})
-        }
-        
-    except Exception as e:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': str(e)})
+        return max(low, min(int(value), high))
+    except ValueError:
+        raise HttpError(400, f'{name} must be a number')
+
+
+@router.route('POST', 'track_click')
+def track_click(request: Request) -> dict:
+    ref_user_id = request.body.get('refUserId')
+    visitor_ip = request.source_ip
+
+    if not ref_user_id:
+        raise HttpError(400, 'refUserId required')
+
+    # Только вставка: клики не блокируют строку реферера в users,
+    # в referral_clicks их переносит tools/aggregate_referral_clicks.py
+    cur = request.cursor()
+    cur.execute(
+        f"INSERT INTO {schema}.referral_click_events (ref_user_id, visitor_ip) VALUES (%s, %s)",
+        (ref_user_id, visitor_ip or None)
+    )
+    request.conn.commit()
+
+    return json_response(200, {'success': True, 'message': 'Click tracked'})
+
+
+@router.route('POST', 'track_registration')
+def track_registration(request: Request) -> dict:
+    ref_user_id = request.body.get('refUserId')
+    new_user_id = request.body.get('newUserId')
+
+    if not ref_user_id or not new_user_id:
+        raise HttpError(400, 'refUserId and newUserId required')
+    if str(ref_user_id) == str(new_user_id):
+        raise HttpError(400, 'User cannot refer themselves')
+
+    cur = request.cursor()
+    cur.execute(f"SELECT id FROM {schema}.users WHERE id = %s", (ref_user_id,))
+    if not cur.fetchone():
+        raise HttpError(404, 'Referrer not found')
+
+    cur.execute(f"UPDATE {schema}.users SET referral_registrations = referral_registrations + 1, referral_count = referral_count + 1 WHERE id = %s", (ref_user_id,))
+
+    cur.execute(f"UPDATE {schema}.users SET referred_by = %s WHERE id = %s", (ref_user_id, new_user_id))
+
+    request.conn.commit()
+
+    return json_response(200, {'success': True, 'message': 'Registration tracked'})
+
+
+@router.route('GET')
+def get_stats(request: Request) -> dict:
+    user_id = caller_id(request, request.query.get('userId'))
+
+    if not user_id:
+        raise HttpError(400, 'userId required')
+
+    cur = request.cursor()
+    # Счётчик плюс клики, ещё не перенесённые агрегатором
+    cur.execute(f"""
+        SELECT COALESCE(u.referral_clicks, 0) + (
+                   SELECT COUNT(*) FROM {schema}.referral_click_events e WHERE e.ref_user_id = u.id
+               ),
+               u.referral_registrations, u.referral_count
+        FROM {schema}.users u
+        WHERE u.id = %s
+    """, (user_id,))
+    result = cur.fetchone()
+
+    if not result:
+        raise HttpError(404, 'User not found')
+
+    return json_response(200, {
+        'clicks': result[0] or 0,
+        'registrations': result[1] or 0,
+        'deposits': result[2] or 0,
+        'uniqueVisitors': UNIQUE_VISITORS_CACHE.get(str(user_id), lambda: unique_visitors(cur, user_id))
+    })
+
+
+def unique_visitors(cur, user_id) -> int:
+    '''
+    Оценка по сохранённым суточным скетчам (V0023). Клики из очереди сюда
+    не входят: aggregate_referral_clicks вливает их в скетч своих суток
+    '''
+    cur.execute(f"""
+        SELECT {schema}.hll_estimate({schema}.hll_union(sketch))
+        FROM {schema}.referral_visitor_sketches
+        WHERE ref_user_id = %s AND day > CURRENT_DATE - %s
+    """, (user_id, UNIQUE_VISITORS_DAYS))
+    return cur.fetchone()[0] or 0
+
+
+
+@router.route('GET', 'series')
+def get_series(request: Request) -> dict:
+    '''Клики и регистрации по часам или суткам за период [from, to]'''
+    user_id = caller_id(request, request.query.get('userId'))
+    if not user_id:
+        raise HttpError(400, 'userId required')
+
+    bucket = request.query.get('bucket') or 'day'
+    if bucket not in SERIES_BUCKETS:
+        raise HttpError(400, 'bucket must be day or hour')
+    table, column, step, pending_bucket, default_days, max_days = SERIES_BUCKETS[bucket]
+
+    try:
+        date_to = date.fromisoformat(request.query['to']) if request.query.get('to') else date.today()
+        date_from = (
+            date.fromisoformat(request.query['from']) if request.query.get('from')
+            else date_to - timedelta(days=default_days - 1)
+        )
+    except ValueError:
+        raise HttpError(400, 'from and to must be YYYY-MM-DD')
+
+    if date_from > date_to:
+        raise HttpError(400, 'from must not be after to')
+    if (date_to - date_from).days + 1 > max_days:
+        raise HttpError(400, f'Period too long for bucket={bucket}: max {max_days} days')
+
+    # Готовые корзины плюс клики, ещё не перенесённые агрегатором;
+    # пустые корзины заполняются нулями, чтобы график был непрерывным
+    cur = request.cursor()
+    cur.execute(f"""
+        SELECT b.at, COALESCE(r.clicks, 0) + COALESCE(p.clicks, 0), COALESCE(r.registrations, 0)
+        FROM generate_series(
+            %(from)s::TIMESTAMP,
+            %(to)s::TIMESTAMP + INTERVAL '1 day' - INTERVAL '{step}',
+            INTERVAL '{step}'
+        ) AS b(at)
+        LEFT JOIN {schema}.{table} r
+            ON r.ref_user_id = %(user_id)s AND r.{column} = b.at
+        LEFT JOIN (
+            SELECT {pending_bucket} AS at, COUNT(*) AS clicks
+            FROM {schema}.referral_click_events
+            WHERE ref_user_id = %(user_id)s
+            GROUP BY 1
+        ) p ON p.at = b.at
+        ORDER BY b.at
+    """, {'from': date_from, 'to': date_to, 'user_id': user_id})
+
+    return json_response(200, {
+        'bucket': bucket,
+        'from': date_from,
+        'to': date_to,
+        'series': [
+            {
+                'at': at.date() if bucket == 'day' else at,
+                'clicks': clicks,
+                'registrations': registrations,
+            }
+            for at, clicks, registrations in cur.fetchall()
+        ]
+    })
+
+
+@router.route('GET', 'leaderboard')
+def get_leaderboard(request: Request) -> dict:
+    '''Верх рейтинга рефереров и, если пользователь известен, его место'''
+    limit = int_param(request, 'limit', LEADERBOARD_DEFAULT_LIMIT, 1, LEADERBOARD_MAX_LIMIT)
+
+    def load_top() -> list:
+        cur = request.cursor()
+        cur.execute(f"""
+            SELECT rank, username, referral_count, refreshed_at
+            FROM {schema}.referral_leaderboard
+            ORDER BY rank, user_id
+            LIMIT %s
+        """, (LEADERBOARD_MAX_LIMIT,))
+        return cur.fetchall()
+
+    top = LEADERBOARD_CACHE.get('top', load_top)
+    body = {
+        'leaders': [
+            {'rank': rank, 'username': username, 'referralCount': referral_count}
+            for rank, username, referral_count, _ in top[:limit]
+        ],
+        'updatedAt': top[0][3] if top else None,
+    }
+
+    user_id = caller_id(request, request.query.get('userId'))
+    if not user_id:
+        return json_response(200, body, {'Cache-Control': f'public, max-age={LEADERBOARD_CACHE_TTL}'})
+
+    def load_rank():
+        cur = request.cursor()
+        cur.execute(
+            f"SELECT rank, referral_count FROM {schema}.referral_leaderboard WHERE user_id = %s",
+            (user_id,)
+        )
+        return cur.fetchone()
+
+    # Пользователя нет в снимке — он ещё никого не пригласил
+    rank = LEADERBOARD_CACHE.get(('rank', str(user_id)), load_rank)
+    body['you'] = {'rank': rank[0], 'referralCount': rank[1]} if rank else None
+    return json_response(200, body)
+
+
+@router.route('GET', 'levels')
+def get_levels(request: Request) -> dict:
+    '''Сколько приглашённых на каждом уровне дерева до levels включительно'''
+    user_id = caller_id(request, request.query.get('userId'))
+    if not user_id:
+        raise HttpError(400, 'userId required')
+    levels = int_param(request, 'levels', REFERRAL_LEVELS, 1, REFERRAL_MAX_LEVEL)
+
+    cur = request.cursor()
+    cur.execute(f"""
+        SELECT depth, COUNT(*)
+        FROM {schema}.referral_tree
+        WHERE ancestor_id = %s AND depth <= %s
+        GROUP BY depth
+    """, (user_id, levels))
+    counts = dict(cur.fetchall())
+
+    return json_response(200, {
+        'levels': [{'level': level, 'count': counts.get(level, 0)} for level in range(1, levels + 1)],
+        'total': sum(counts.values()),
+    })
+
+
+@router.route('GET', 'downline')
+def get_downline(request: Request) -> dict:
+    '''Приглашённые на уровне level, страницами по id'''
+    user_id = caller_id(request, request.query.get('userId'))
+    if not user_id:
+        raise HttpError(400, 'userId required')
+    level = int_param(request, 'level', 1, 1, REFERRAL_MAX_LEVEL)
+    limit = int_param(request, 'limit', DOWNLINE_DEFAULT_LIMIT, 1, DOWNLINE_MAX_LIMIT)
+    after = int_param(request, 'cursor', 0, 0, 2 ** 31 - 1)
+
+    cur = request.cursor()
+    cur.execute(f"""
+        SELECT u.id, u.username, u.referred_by, u.referral_count, u.created_at
+        FROM {schema}.referral_tree t
+        JOIN {schema}.users u ON u.id = t.descendant_id
+        WHERE t.ancestor_id = %s AND t.depth = %s AND t.descendant_id > %s
+        ORDER BY t.descendant_id
+        LIMIT %s
+    """, (user_id, level, after, limit + 1))
+    rows = cur.fetchall()
+
+    users = [
+        {
+            'id': row[0],
+            'username': row[1],
+            'referredBy': row[2],
+            'referralCount': row[3] or 0,
+            'createdAt': row[4].isoformat() if row[4] else None,
         }
-    finally:
-        if 'cur' in locals():
-            cur.close()
-        if 'conn' in locals():
-            conn.close()
+        for row in rows[:limit]
+    ]
+    return json_response(200, {
+        'level': level,
+        'users': users,
+        'nextCursor': str(users[-1]['id']) if len(rows) > limit else None,
+    })
+
+
+handler = router
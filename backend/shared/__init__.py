@@ -0,0 +1,6 @@
+"""
+Общий код backend-функций.
+
+Каталог backend/ добавляется в PYTHONPATH при сборке каждой функции,
+поэтому модули подключаются как `from shared import db`.
+"""
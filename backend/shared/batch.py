@@ -0,0 +1,105 @@
+"""
+Пакетная обработка заявок на вывод.
+
+Администратор одобряет или отклоняет сразу список заявок
+(`withdrawalIds`) либо все ожидающие заявки под фильтр (`filter`):
+
+    {"action": "approve", "withdrawalIds": [1, 2, 3]}
+    {"action": "reject", "filter": {"maxAmount": 50, "network": "TRC20"}}
+
+Все переходы выполняются одним запросом в одной транзакции; в ответе —
+итог по каждой заявке. За один вызов обрабатывается не больше
+BATCH_LIMIT заявок, остаток забирается повторным вызовом.
+"""
+
+from decimal import Decimal, InvalidOperation
+from typing import Dict, Iterable, List, Optional
+
+from shared.http import HttpError
+
+BATCH_LIMIT = 1000
+
+# Ключ фильтра в запросе -> параметр SQL
+FILTER_FIELDS = {
+    'maxAmount': 'max_amount',
+    'network': 'network',
+    'cryptoType': 'crypto_type',
+}
+
+
+def is_batch(body: dict) -> bool:
+    return 'withdrawalIds' in body or 'filter' in body
+
+
+def parse_selection(body: dict, allowed_filters: Iterable[str]) -> dict:
+    """
+    Параметры выборки для SQL: ids, фильтры из allowed_filters и limit.
+    Отсутствующие значения — None, чтобы запрос мог написать
+    `(%(network)s IS NULL OR network = %(network)s)`.
+    """
+    allowed_filters = tuple(allowed_filters)
+    selection: Dict[str, object] = {FILTER_FIELDS[name]: None for name in allowed_filters}
+    selection['ids'] = None
+    selection['limit'] = BATCH_LIMIT
+
+    ids = body.get('withdrawalIds')
+    if ids is not None:
+        if not isinstance(ids, list) or not ids:
+            raise HttpError(400, 'withdrawalIds must be a non-empty list')
+        if len(ids) > BATCH_LIMIT:
+            raise HttpError(400, f'No more than {BATCH_LIMIT} withdrawalIds per call')
+        try:
+            selection['ids'] = sorted({int(value) for value in ids})
+        except (TypeError, ValueError):
+            raise HttpError(400, 'withdrawalIds must be integers')
+
+    filters = body.get('filter')
+    if filters is not None:
+        if not isinstance(filters, dict):
+            raise HttpError(400, 'filter must be an object')
+        unknown = set(filters) - set(allowed_filters)
+        if unknown:
+            raise HttpError(400, f'Unknown filter fields: {", ".join(sorted(unknown))}')
+        for name, value in filters.items():
+            if value in (None, ''):
+                continue
+            if name == 'maxAmount':
+                try:
+                    value = Decimal(str(value))
+                except InvalidOperation:
+                    raise HttpError(400, 'maxAmount must be a number')
+            selection[FILTER_FIELDS[name]] = value
+
+    # Пустой фильтр без списка id обработал бы все ожидающие заявки разом
+    if selection['ids'] is None and all(selection[FILTER_FIELDS[name]] is None for name in allowed_filters):
+        raise HttpError(400, 'withdrawalIds or a non-empty filter required')
+
+    return selection
+
+
+def batch_results(
+    requested: Optional[List[int]],
+    rows: Iterable[tuple],
+    status: str,
+    failed_reason: str = 'insufficient_balance',
+) -> dict:
+    """
+    Ответ пакетной операции. rows — пары (id, выполнено) по заявкам,
+    которые были в статусе pending; запрошенные id, которых среди них
+    нет, не найдены или уже обработаны.
+    """
+    outcome = dict(rows)
+    results = []
+    for withdrawal_id in sorted(set(outcome).union(requested or ())):
+        if outcome.get(withdrawal_id):
+            results.append({'id': withdrawal_id, 'status': status})
+        elif withdrawal_id in outcome:
+            results.append({'id': withdrawal_id, 'status': 'skipped', 'reason': failed_reason})
+        else:
+            results.append({'id': withdrawal_id, 'status': 'skipped', 'reason': 'not_pending'})
+
+    return {
+        'success': True,
+        'processed': sum(1 for done in outcome.values() if done),
+        'results': results,
+    }
@@ -0,0 +1,229 @@
+"""
+Пул соединений с PostgreSQL, общий для всех функций.
+
+Контейнер функции переживает несколько вызовов подряд, поэтому соединения
+держим на уровне процесса: тёплый вызов получает уже открытое соединение
+и не платит за TCP + TLS + аутентификацию. Размер пула ограничен на
+контейнер, соединения проверяются перед выдачей после простоя и
+пересоздаются по достижении максимального возраста.
+
+Использование:
+
+    from shared import db
+
+    conn = db.acquire()
+    try:
+        ...
+    finally:
+        db.release(conn)
+
+или `with db.connection() as conn: ...`.
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Tuple
+
+import psycopg2
+from psycopg2 import extensions
+
+from shared.tracing import TracingCursor
+
+
+# =============================================================================
+# CONFIGURATION
+# =============================================================================
+
+def _env_int(key: str, default: int) -> int:
+    value = os.environ.get(key)
+    return int(value) if value else default
+
+
+# Функция обрабатывает один запрос за раз, поэтому двух соединений на
+# контейнер достаточно; больше нужно только при потоках внутри вызова.
+POOL_MAX_SIZE = _env_int('DB_POOL_MAX_SIZE', 2)
+# Через сколько секунд соединение закрывается и открывается заново.
+POOL_MAX_LIFETIME = _env_int('DB_POOL_MAX_LIFETIME', 600)
+# Соединение, простоявшее дольше этого, проверяется `SELECT 1` перед выдачей.
+POOL_IDLE_CHECK = _env_int('DB_POOL_IDLE_CHECK', 30)
+# Сколько секунд ждать свободного соединения, если пул заполнен.
+POOL_ACQUIRE_TIMEOUT = _env_int('DB_POOL_ACQUIRE_TIMEOUT', 10)
+CONNECT_TIMEOUT = _env_int('DB_CONNECT_TIMEOUT', 5)
+
+
+class PoolTimeout(Exception):
+    """Нет свободного соединения за отведённое время."""
+
+
+# =============================================================================
+# POOL
+# =============================================================================
+
+class ConnectionPool:
+    """Ограниченный пул соединений с проверкой и пересозданием."""
+
+    def __init__(
+        self,
+        dsn: str,
+        max_size: int = POOL_MAX_SIZE,
+        max_lifetime: int = POOL_MAX_LIFETIME,
+        idle_check: int = POOL_IDLE_CHECK,
+    ):
+        self.dsn = dsn
+        self.max_size = max(1, max_size)
+        self.max_lifetime = max_lifetime
+        self.idle_check = idle_check
+        # (соединение, время создания, время возврата в пул)
+        self._idle: List[Tuple[extensions.connection, float, float]] = []
+        # id(выданного соединения) -> время создания
+        self._in_use = {}
+        # Всего открытых и открываемых соединений
+        self._size = 0
+        self._cond = threading.Condition()
+
+    def _connect(self) -> extensions.connection:
+        return psycopg2.connect(
+            self.dsn,
+            cursor_factory=TracingCursor,
+            connect_timeout=CONNECT_TIMEOUT,
+            keepalives=1,
+            keepalives_idle=30,
+            keepalives_interval=10,
+            keepalives_count=3,
+        )
+
+    def _is_alive(self, conn: extensions.connection) -> bool:
+        try:
+            cur = conn.cursor()
+            cur.execute('SELECT 1')
+            cur.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    @staticmethod
+    def _close_quietly(conn: extensions.connection) -> None:
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def acquire(self) -> extensions.connection:
+        deadline = time.monotonic() + POOL_ACQUIRE_TIMEOUT
+        while True:
+            with self._cond:
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeout('Нет свободных соединений с БД')
+                    self._cond.wait(remaining)
+
+                if self._idle:
+                    # LIFO: самое свежее соединение с наибольшей вероятностью живо
+                    entry = self._idle.pop()
+                else:
+                    # Резервируем место до сетевых операций, чтобы не превысить лимит
+                    entry = None
+                    self._size += 1
+
+            if entry is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    self._discard(None)
+                    raise
+                with self._cond:
+                    self._in_use[id(conn)] = time.monotonic()
+                return conn
+
+            conn, created_at, released_at = entry
+            now = time.monotonic()
+            expired = now - created_at > self.max_lifetime
+            stale = now - released_at > self.idle_check
+            if conn.closed or expired or (stale and not self._is_alive(conn)):
+                self._discard(conn)
+                continue
+
+            with self._cond:
+                self._in_use[id(conn)] = created_at
+            return conn
+
+    def release(self, conn: Optional[extensions.connection]) -> None:
+        if conn is None:
+            return
+
+        with self._cond:
+            created_at = self._in_use.pop(id(conn), None)
+        if created_at is None:
+            # Соединение выдано не этим пулом
+            self._close_quietly(conn)
+            return
+
+        broken = bool(conn.closed)
+        if not broken and conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+            # Незакоммиченные изменения не должны достаться следующему запросу
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+
+        if broken or time.monotonic() - created_at > self.max_lifetime:
+            self._discard(conn)
+            return
+
+        with self._cond:
+            self._idle.append((conn, created_at, time.monotonic()))
+            self._cond.notify()
+
+    def close_all(self) -> None:
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, _, _ in idle:
+            self._close_quietly(conn)
+
+    def _discard(self, conn: Optional[extensions.connection]) -> None:
+        if conn is not None:
+            self._close_quietly(conn)
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+
+# =============================================================================
+# MODULE-LEVEL POOL
+# =============================================================================
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """Пул процесса; создаётся при первом обращении."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(os.environ['DATABASE_URL'])
+    return _pool
+
+
+def acquire() -> extensions.connection:
+    return get_pool().acquire()
+
+
+def release(conn: Optional[extensions.connection]) -> None:
+    get_pool().release(conn)
+
+
+@contextmanager
+def connection() -> Iterator[extensions.connection]:
+    conn = acquire()
+    try:
+        yield conn
+    finally:
+        release(conn)
@@ -0,0 +1,119 @@
+"""
+Условные GET-запросы по ETag.
+
+ETag строится из версий таблиц и параметров запроса. Версия таблицы —
+номер последней видимой пишущей транзакции из table_change_log (V0035).
+Если клиент прислал тот же ETag в If-None-Match, маршрут не выполняется
+и возвращается 304 без тела.
+
+Строка журнала видна вместе с изменениями своей транзакции, но транзакции
+коммитятся не в порядке номеров: более старая может закоммититься позже
+и изменить данные, не меняя максимума. Поэтому ETag выдаётся, только
+если все транзакции до последней видимой завершены (она ниже
+pg_snapshot_xmin). Пока пишущие транзакции не устоялись, ответ отдаётся
+целиком и без ETag — версия не может опередить данные.
+
+    @router.route('GET')
+    @conditional('users')
+    def list_players(request: Request) -> dict:
+        ...
+"""
+
+import hashlib
+from functools import wraps
+from typing import Callable, Iterable, Optional
+
+from shared.http import JSON_HEADERS, Request, Route
+
+SCHEMA = 't_p45110186_greeting_project_202'
+
+# Ответ можно хранить, но перед использованием браузер обязан перепроверить ETag
+CACHE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'Access-Control-Expose-Headers': 'ETag',
+}
+
+
+def table_versions(cursor, tables: Iterable[str]) -> Optional[list]:
+    """Версии таблиц или None, если какая-то ещё не устоялась."""
+    cursor.execute(
+        f"""
+        SELECT t.name, v.txid::text, v.txid IS NULL OR v.txid < pg_snapshot_xmin(pg_current_snapshot())
+        FROM unnest(%s::text[]) AS t(name)
+        LEFT JOIN LATERAL (
+            SELECT txid FROM {SCHEMA}.table_change_log
+            WHERE table_name = t.name
+            ORDER BY txid DESC
+            LIMIT 1
+        ) v ON TRUE
+        ORDER BY t.name
+        """,
+        (list(tables),)
+    )
+    rows = cursor.fetchall()
+    if not all(settled for _, _, settled in rows):
+        return None
+    return [(name, version) for name, version, _ in rows]
+
+
+def make_etag(*parts) -> str:
+    digest = hashlib.sha1(repr(parts).encode()).hexdigest()[:32]
+    return f'"{digest}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get('if-none-match')
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    candidates = [value.strip() for value in header.split(',')]
+    return etag in candidates or f'W/{etag}' in candidates
+
+
+def not_modified(etag: str) -> dict:
+    return {
+        'statusCode': 304,
+        'headers': {
+            'Access-Control-Allow-Origin': JSON_HEADERS['Access-Control-Allow-Origin'],
+            'ETag': etag,
+            **CACHE_HEADERS,
+        },
+        'body': '',
+        'isBase64Encoded': False,
+    }
+
+
+def conditional(*tables: str, vary: Optional[Callable[[], object]] = None) -> Callable[[Route], Route]:
+    """
+    Оборачивает GET-маршрут: ETag зависит от версий `tables`, параметров
+    запроса и, если задано, значения `vary()` (например, текущего часа для
+    выборок со скользящим окном по времени).
+    """
+    def decorator(fn: Route) -> Route:
+        @wraps(fn)
+        def route(request: Request) -> dict:
+            cursor = request.cursor()
+            versions = table_versions(cursor, tables)
+            cursor.close()
+            if versions is None:
+                return fn(request)
+
+            etag = make_etag(
+                versions,
+                sorted(request.query.items()),
+                vary() if vary else None,
+            )
+            if etag_matches(request, etag):
+                return not_modified(etag)
+
+            response = fn(request)
+            if response.get('statusCode') == 200:
+                exposed = response['headers'].get('Access-Control-Expose-Headers')
+                response['headers'].update(CACHE_HEADERS)
+                response['headers']['ETag'] = etag
+                if exposed:
+                    response['headers']['Access-Control-Expose-Headers'] = f'{exposed}, ETag'
+            return response
+        return route
+    return decorator
@@ -0,0 +1,269 @@
+"""
+Общий каркас HTTP-функций.
+
+Разбор события, маршрутизация по паре (метод, action), заранее собранные
+заголовки и единый формат ошибок. Функция объявляет маршруты и отдаёт
+роутер платформе как `handler`:
+
+    router = Router('GET, POST, OPTIONS')
+
+    @router.route('POST', 'login')
+    def login(request: Request) -> dict:
+        ...
+        return json_response(200, {'success': True})
+
+    handler = router
+"""
+
+import base64
+import json
+import os
+import time
+from datetime import date, datetime
+from decimal import Decimal
+from types import MappingProxyType
+from typing import Any, Callable, Dict, Mapping, Optional
+
+from shared import db, tracing
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# =============================================================================
+# JSON
+# =============================================================================
+
+# orjson заметно быстрее stdlib на больших списках; без него работаем на json
+JSON_BACKEND = os.environ.get('JSON_BACKEND') or ('orjson' if orjson else 'json')
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+if JSON_BACKEND == 'orjson' and orjson is not None:
+    def dumps(value: Any) -> str:
+        return orjson.dumps(value, default=_json_default).decode()
+
+    loads = orjson.loads
+else:
+    def dumps(value: Any) -> str:
+        return json.dumps(value, ensure_ascii=False, separators=(',', ':'), default=_json_default)
+
+    loads = json.loads
+
+
+# =============================================================================
+# RESPONSES
+# =============================================================================
+
+JSON_HEADERS: Mapping[str, str] = MappingProxyType({
+    'Content-Type': 'application/json',
+    'Access-Control-Allow-Origin': '*',
+})
+
+
+class HttpError(Exception):
+    """Ошибка, которую роутер превращает в ответ {'error': message}."""
+
+    def __init__(self, status: int, message: str, headers: Optional[Mapping[str, str]] = None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers
+
+
+def json_response(status: int, body: Any, headers: Optional[Mapping[str, str]] = None) -> dict:
+    response_headers = dict(JSON_HEADERS)
+    if headers:
+        response_headers.update(headers)
+
+    trace = tracing.current()
+    started = time.perf_counter()
+    payload = dumps(body)
+    if trace is not None:
+        trace.serialize_ms += (time.perf_counter() - started) * 1000
+
+    return {
+        'statusCode': status,
+        'headers': response_headers,
+        'body': payload,
+        'isBase64Encoded': False,
+    }
+
+
+def error_response(status: int, message: str, headers: Optional[Mapping[str, str]] = None) -> dict:
+    return json_response(status, {'error': message}, headers)
+
+
+# =============================================================================
+# REQUEST
+# =============================================================================
+
+class Request:
+    """Обёртка над событием платформы с ленивым разбором и соединением с БД."""
+
+    __slots__ = ('event', 'context', 'method', '_query', '_headers', '_body', '_conn')
+
+    def __init__(self, event: dict, context: Any, default_method: str = 'GET'):
+        self.event = event
+        self.context = context
+        self.method = event.get('httpMethod') or default_method
+        self._query = None
+        self._headers = None
+        self._body = None
+        self._conn = None
+
+    @property
+    def query(self) -> Dict[str, str]:
+        if self._query is None:
+            self._query = self.event.get('queryStringParameters') or {}
+        return self._query
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        """Заголовки запроса с ключами в нижнем регистре."""
+        if self._headers is None:
+            raw = self.event.get('headers') or {}
+            self._headers = {key.lower(): value for key, value in raw.items()}
+        return self._headers
+
+    @property
+    def body(self) -> Any:
+        if self._body is None:
+            raw = self.event.get('body') or ''
+            if self.event.get('isBase64Encoded') and raw:
+                raw = base64.b64decode(raw)
+            try:
+                self._body = loads(raw) if raw else {}
+            except ValueError:
+                raise HttpError(400, 'Invalid JSON')
+        return self._body
+
+    @property
+    def action(self) -> str:
+        action = self.query.get('action')
+        if not action and self.method not in ('GET', 'HEAD') and isinstance(self.body, dict):
+            action = self.body.get('action')
+        return action or ''
+
+    @property
+    def source_ip(self) -> str:
+        return ((self.event.get('requestContext') or {}).get('identity') or {}).get('sourceIp', '')
+
+    @property
+    def conn(self):
+        """Соединение из пула; берётся только если маршрут обратился к БД."""
+        if self._conn is None:
+            started = time.perf_counter()
+            self._conn = db.acquire()
+            trace = tracing.current()
+            if trace is not None:
+                trace.connect_ms += (time.perf_counter() - started) * 1000
+        return self._conn
+
+    def cursor(self):
+        return self.conn.cursor()
+
+    def close(self) -> None:
+        if self._conn is not None:
+            db.release(self._conn)
+            self._conn = None
+
+
+# =============================================================================
+# ROUTER
+# =============================================================================
+
+Route = Callable[[Request], dict]
+
+
+class Router:
+    """
+    Маршрутизация по (метод, action).
+
+    `route(method, action)` регистрирует точное совпадение; action='' —
+    запрос без action, action=None — любой action этого метода.
+    """
+
+    def __init__(
+        self,
+        methods: str,
+        allow_headers: str = 'Content-Type',
+        origin: str = '*',
+        preflight_status: int = 200,
+        default_method: str = 'GET',
+        unknown_action: str = 'Неизвестное действие',
+        expose_errors: bool = True,
+    ):
+        self.origin = origin
+        self.default_method = default_method
+        self.unknown_action = unknown_action
+        self.expose_errors = expose_errors
+        self._routes: Dict[tuple, Route] = {}
+        self._methods = set()
+        self._preflight_status = preflight_status
+        self._preflight_headers: Mapping[str, str] = MappingProxyType({
+            'Access-Control-Allow-Origin': origin,
+            'Access-Control-Allow-Methods': methods,
+            'Access-Control-Allow-Headers': allow_headers,
+            'Access-Control-Max-Age': '86400',
+        })
+
+    def route(self, method: str, action: Optional[str] = None) -> Callable[[Route], Route]:
+        def decorator(fn: Route) -> Route:
+            self._routes[(method, action)] = fn
+            self._methods.add(method)
+            return fn
+        return decorator
+
+    def resolve(self, request: Request) -> Route:
+        if request.method not in self._methods:
+            raise HttpError(405, 'Method not allowed')
+        action = request.action
+        fn = self._routes.get((request.method, action)) or self._routes.get((request.method, None))
+        if fn is None:
+            raise HttpError(400, self.unknown_action.format(action=action))
+        return fn
+
+    def __call__(self, event: dict, context: Any) -> dict:
+        request = Request(event, context, self.default_method)
+
+        if request.method == 'OPTIONS':
+            return {
+                'statusCode': self._preflight_status,
+                'headers': dict(self._preflight_headers),
+                'body': '',
+                'isBase64Encoded': False,
+            }
+
+        trace = tracing.start()
+        try:
+            response = self.resolve(request)(request)
+        except HttpError as e:
+            response = error_response(e.status, e.message, e.headers)
+        except Exception as e:
+            print(f'[ERROR] {request.method}: {e!r}')
+            response = error_response(500, str(e) if self.expose_errors else 'Internal server error')
+        finally:
+            request.close()
+
+        if self.origin != '*':
+            response['headers']['Access-Control-Allow-Origin'] = self.origin
+
+        tracing.finish(trace, request.method, self._action_for_log(request), response)
+        return response
+
+    @staticmethod
+    def _action_for_log(request: Request) -> str:
+        try:
+            return request.action
+        except HttpError:
+            return ''
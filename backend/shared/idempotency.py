@@ -0,0 +1,152 @@
+"""
+Повтор запросов по заголовку Idempotency-Key.
+
+Клиент присылает уникальный ключ с каждой заявкой; повтор с тем же ключом
+(после обрыва сети) получает сохранённый ответ, а вторая заявка не
+создаётся:
+
+    @router.route('POST')
+    @idempotent('withdrawals')
+    def create_withdrawal(request: Request) -> dict:
+        ...
+
+Ключ принадлежит вызывающему (caller_id, V0034): тот же ключ от другого
+пользователя — отдельная заявка. Ключ записывается в idempotency_keys
+(V0029) до выполнения маршрута, а ответ — в той же транзакции, что и сама
+заявка: маршрут под @idempotent не коммитит, коммит делает декоратор.
+Параллельный повтор ждёт на уникальном ключе, пока первый запрос не
+завершится. Ошибка маршрута или падение до коммита откатывают и запись
+ключа, поэтому сохраняются только успешные ответы, а после ошибки запрос
+можно повторить с тем же ключом.
+
+Повтор отвечает из одного поиска по первичному ключу. Тот же ключ с
+другим телом запроса — 422. Записи живут IDEMPOTENCY_TTL секунд
+(по умолчанию сутки).
+"""
+
+import hashlib
+import os
+import random
+from functools import wraps
+from typing import Callable
+
+from shared.http import JSON_HEADERS, HttpError, Request, Route
+from shared.session import caller_id
+
+SCHEMA = 't_p45110186_greeting_project_202'
+
+IDEMPOTENCY_TTL = int(os.environ.get('IDEMPOTENCY_TTL') or 86400)
+MAX_KEY_LENGTH = 255
+# Доля запросов с ключом, после которых удаляются истёкшие записи
+CLEANUP_PROBABILITY = 0.01
+
+REPLAY_HEADERS = {
+    'Idempotent-Replayed': 'true',
+    'Access-Control-Expose-Headers': 'Idempotent-Replayed',
+}
+
+
+def fingerprint(request: Request) -> str:
+    raw = request.event.get('body') or ''
+    if isinstance(raw, str):
+        raw = raw.encode()
+    return hashlib.sha256(raw).hexdigest()
+
+
+def owner_of(request: Request) -> str:
+    """Владелец ключа: id из токена или userId из тела запроса."""
+    body = request.body
+    owner = caller_id(request, body.get('userId') if isinstance(body, dict) else None)
+    return '' if owner is None else str(owner)
+
+
+def replay(cursor, scope: str, owner: str, key: str, digest: str):
+    """Сохранённый ответ или None, если ключ ещё не встречался."""
+    cursor.execute(
+        f"""
+        SELECT fingerprint, status_code, response
+        FROM {SCHEMA}.idempotency_keys
+        WHERE scope = %s AND owner = %s AND key = %s AND expires_at > NOW()
+        """,
+        (scope, owner, key)
+    )
+    row = cursor.fetchone()
+    if row is None:
+        return None
+
+    stored_digest, status_code, body = row
+    if stored_digest != digest:
+        raise HttpError(422, 'Idempotency-Key уже использован для другого запроса')
+    if status_code is None:
+        # Ответ пишется в одной транзакции с ключом; сюда попадают только
+        # записи, сделанные до V0034
+        raise HttpError(409, 'Запрос с этим Idempotency-Key ещё обрабатывается', {'Retry-After': '1'})
+
+    return {
+        'statusCode': status_code,
+        'headers': {**JSON_HEADERS, **REPLAY_HEADERS},
+        'body': body,
+        'isBase64Encoded': False,
+    }
+
+
+def idempotent(scope: str) -> Callable[[Route], Route]:
+    def decorator(fn: Route) -> Route:
+        @wraps(fn)
+        def route(request: Request) -> dict:
+            key = (request.headers.get('idempotency-key') or '').strip()
+            if not key:
+                response = fn(request)
+                request.conn.commit()
+                return response
+            if len(key) > MAX_KEY_LENGTH:
+                raise HttpError(400, f'Idempotency-Key длиннее {MAX_KEY_LENGTH} символов')
+
+            owner = owner_of(request)
+            digest = fingerprint(request)
+            cursor = request.cursor()
+            stored = replay(cursor, scope, owner, key, digest)
+            if stored is not None:
+                return stored
+
+            # Запись ключа коммитится вместе с заявкой и ответом. Параллельный
+            # повтор ждёт на конфликте и, не вставив строку, читает наш ответ
+            cursor.execute(
+                f"""
+                INSERT INTO {SCHEMA}.idempotency_keys (scope, owner, key, fingerprint, expires_at)
+                VALUES (%s, %s, %s, %s, NOW() + make_interval(secs => %s))
+                ON CONFLICT (scope, owner, key) DO UPDATE
+                SET fingerprint = EXCLUDED.fingerprint, status_code = NULL, response = NULL,
+                    created_at = NOW(), expires_at = EXCLUDED.expires_at
+                WHERE idempotency_keys.expires_at <= NOW()
+                RETURNING key
+                """,
+                (scope, owner, key, digest, IDEMPOTENCY_TTL)
+            )
+            if cursor.fetchone() is None:
+                request.conn.rollback()
+                stored = replay(request.cursor(), scope, owner, key, digest)
+                if stored is not None:
+                    return stored
+                raise HttpError(409, 'Запрос с этим Idempotency-Key ещё обрабатывается', {'Retry-After': '1'})
+
+            response = fn(request)
+            if response.get('statusCode', 500) >= 400:
+                request.conn.rollback()
+                return response
+
+            cursor = request.cursor()
+            cursor.execute(
+                f"""
+                UPDATE {SCHEMA}.idempotency_keys
+                SET status_code = %s, response = %s
+                WHERE scope = %s AND owner = %s AND key = %s
+                """,
+                (response['statusCode'], response['body'], scope, owner, key)
+            )
+            if random.random() < CLEANUP_PROBABILITY:
+                cursor.execute(f"DELETE FROM {SCHEMA}.idempotency_keys WHERE expires_at <= NOW()")
+            request.conn.commit()
+            return response
+        return route
+    return decorator
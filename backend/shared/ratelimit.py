@@ -0,0 +1,185 @@
+"""
+Ограничение частоты попыток входа.
+
+Проверка выполняется до хеширования пароля и запроса к users, так что
+перебор паролей отсекается, не нагружая базу. Ключи — IP клиента и имя
+пользователя; у каждого свой token bucket в памяти контейнера:
+
+    LOGIN_GUARD = LoginGuard('auth_login')
+
+    LOGIN_GUARD.check(request, username)   # 429, если попыток слишком много
+    ...
+    LOGIN_GUARD.succeeded(request, username)  # успешный вход сбрасывает счётчик имени
+
+Память у каждого контейнера своя, поэтому при нескольких экземплярах
+лимит фактически умножается на их число. LOGIN_RATE_SHARED=1 добавляет
+общий счётчик в Postgres (login_rate_limits, V0021): фиксированное окно,
+один INSERT ... ON CONFLICT на попытку.
+
+Отклонённые попытки считаются в SHED и пишутся строкой лога
+{"type": "rate_limited", ...}.
+
+Переменные окружения:
+    LOGIN_IP_ATTEMPTS       — попыток с одного IP за окно (по умолчанию 20)
+    LOGIN_USERNAME_ATTEMPTS — попыток на одно имя за окно (по умолчанию 5)
+    LOGIN_RATE_WINDOW       — окно, с (по умолчанию 60)
+    LOGIN_RATE_SHARED       — общий счётчик в Postgres (по умолчанию 0)
+"""
+
+import json
+import math
+import os
+import random
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from shared.http import HttpError, Request
+
+SCHEMA = 't_p45110186_greeting_project_202'
+
+LOGIN_IP_ATTEMPTS = int(os.environ.get('LOGIN_IP_ATTEMPTS') or 20)
+LOGIN_USERNAME_ATTEMPTS = int(os.environ.get('LOGIN_USERNAME_ATTEMPTS') or 5)
+LOGIN_RATE_WINDOW = int(os.environ.get('LOGIN_RATE_WINDOW') or 60)
+LOGIN_RATE_SHARED = os.environ.get('LOGIN_RATE_SHARED', '0').lower() in ('1', 'true', 'yes')
+
+# Сколько ключей держать в памяти; самые давние вытесняются
+MAX_KEYS = 10_000
+# Доля попыток, после которых из общей таблицы удаляются старые окна
+SHARED_CLEANUP_PROBABILITY = 0.01
+# Длиннее имя в ключе не попадает: ключ общей таблицы — VARCHAR(200)
+MAX_USERNAME_KEY = 100
+
+# '<limiter>:<ip|username>' -> число отклонённых попыток в этом контейнере
+SHED: Counter = Counter()
+
+
+class TokenBucket:
+    """Набор token bucket'ов по ключам: capacity попыток, восполняются за period секунд."""
+
+    def __init__(self, capacity: int, period: float, max_keys: int = MAX_KEYS):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.max_keys = max_keys
+        # key -> (токенов осталось, время последнего обновления)
+        self._buckets: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str) -> float:
+        """0, если попытка разрешена; иначе сколько секунд ждать следующего токена."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def forget(self, key: str) -> None:
+        with self._lock:
+            self._buckets.pop(key, None)
+
+
+class LoginGuard:
+    def __init__(
+        self,
+        name: str,
+        ip_attempts: int = LOGIN_IP_ATTEMPTS,
+        username_attempts: int = LOGIN_USERNAME_ATTEMPTS,
+        window: int = LOGIN_RATE_WINDOW,
+        shared: bool = LOGIN_RATE_SHARED,
+    ):
+        self.name = name
+        self.window = window
+        self.shared = shared
+        self.limits = {'ip': ip_attempts, 'username': username_attempts}
+        self.buckets = {
+            'ip': TokenBucket(ip_attempts, window),
+            'username': TokenBucket(username_attempts, window),
+        }
+
+    def _keys(self, request: Request, username: str) -> dict:
+        return {'ip': request.source_ip, 'username': username.lower()[:MAX_USERNAME_KEY]}
+
+    def _shed(self, kind: str, retry_after: float) -> None:
+        SHED[f'{self.name}:{kind}'] += 1
+        print(json.dumps({
+            'type': 'rate_limited',
+            'limiter': self.name,
+            'key': kind,
+            'shed_total': SHED[f'{self.name}:{kind}'],
+        }))
+        raise HttpError(
+            429,
+            'Слишком много попыток входа. Попробуйте позже',
+            {
+                'Retry-After': str(max(1, math.ceil(retry_after))),
+                'Access-Control-Expose-Headers': 'Retry-After',
+            }
+        )
+
+    def check(self, request: Request, username: str) -> None:
+        keys = self._keys(request, username)
+        for kind, key in keys.items():
+            if not key:
+                continue
+            wait = self.buckets[kind].take(key)
+            if wait:
+                self._shed(kind, wait)
+
+        if self.shared:
+            self._check_shared(request, keys)
+
+    def _check_shared(self, request: Request, keys: dict) -> None:
+        now = time.time()
+        window_start = int(now // self.window * self.window)
+        rows = [(f'{self.name}:{kind}:{key}', window_start) for kind, key in keys.items() if key]
+        if not rows:
+            return
+
+        cur = request.cursor()
+        cur.execute(
+            f"""
+            INSERT INTO {SCHEMA}.login_rate_limits (key, window_start, hits)
+            SELECT key, to_timestamp(window_start), 1
+            FROM unnest(%s::text[], %s::bigint[]) AS t(key, window_start)
+            ON CONFLICT (key, window_start) DO UPDATE SET hits = login_rate_limits.hits + 1
+            RETURNING key, hits
+            """,
+            ([key for key, _ in rows], [start for _, start in rows])
+        )
+        hits = dict(cur.fetchall())
+        if random.random() < SHARED_CLEANUP_PROBABILITY:
+            cur.execute(
+                f"DELETE FROM {SCHEMA}.login_rate_limits WHERE window_start < NOW() - make_interval(secs => %s)",
+                (self.window * 2,)
+            )
+        # Попытка засчитывается, даже если вход потом не удастся и транзакция откатится
+        request.conn.commit()
+
+        for kind, key in keys.items():
+            if key and hits.get(f'{self.name}:{kind}:{key}', 0) > self.limits[kind]:
+                self._shed(kind, window_start + self.window - now)
+
+    def succeeded(self, request: Request, username: str) -> None:
+        """Успешный вход: неудачные попытки по этому имени больше не учитываются."""
+        key = self._keys(request, username)['username']
+        self.buckets['username'].forget(key)
+        if self.shared:
+            # Иначе другие контейнеры продолжат считать попытки до входа
+            cur = request.cursor()
+            cur.execute(
+                f"DELETE FROM {SCHEMA}.login_rate_limits WHERE key = %s",
+                (f'{self.name}:username:{key}',)
+            )
+            request.conn.commit()
+
+
+def stats() -> dict:
+    return dict(SHED)
@@ -0,0 +1,58 @@
+"""
+Поиск пользователей по username и telegram_username.
+
+Регистр не учитывается. Совпадения по префиксу идут первыми, затем
+совпадения по подстроке. Индексы из V0015:
+    lower(...) text_pattern_ops — префиксный LIKE 'abc%' (btree)
+    lower(...) gin_trgm_ops     — LIKE '%abc%' (pg_trgm)
+
+Триграммный индекс бесполезен для строк короче трёх символов, поэтому
+короткие запросы ищутся только по префиксу.
+
+    rows = search_users(cursor, request.query.get('q'), PLAYER_COLUMNS)
+"""
+
+from typing import Optional
+
+SCHEMA = 't_p45110186_greeting_project_202'
+
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 50
+MAX_TERM_LENGTH = 64
+
+# Минимальная длина запроса для поиска по подстроке (длина триграммы)
+MIN_SUBSTRING_LENGTH = 3
+
+
+def escape_like(term: str) -> str:
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def normalize_term(term: Optional[str]) -> str:
+    """Поисковая строка без пробелов по краям и ведущего '@', в нижнем регистре."""
+    term = (term or '').strip().lstrip('@').lower()
+    if not term or len(term) > MAX_TERM_LENGTH:
+        raise ValueError(term)
+    return term
+
+
+def search_limit(value: Optional[str]) -> int:
+    return min(max(int(value or DEFAULT_SEARCH_LIMIT), 1), MAX_SEARCH_LIMIT)
+
+
+def search_users(cursor, term: str, columns: str, limit: int = DEFAULT_SEARCH_LIMIT) -> list:
+    """Строки users (columns) по уже нормализованному term, не больше limit."""
+    escaped = escape_like(term)
+    prefix = f'{escaped}%'
+    pattern = f'%{escaped}%' if len(term) >= MIN_SUBSTRING_LENGTH else prefix
+
+    cursor.execute(f'''
+        SELECT {columns}
+        FROM {SCHEMA}.users
+        WHERE lower(username) LIKE %(pattern)s
+           OR lower(telegram_username) LIKE %(pattern)s
+        ORDER BY (lower(username) LIKE %(prefix)s OR lower(telegram_username) LIKE %(prefix)s) DESC NULLS LAST,
+                 length(username), id
+        LIMIT %(limit)s
+    ''', {'pattern': pattern, 'prefix': prefix, 'limit': limit})
+    return cursor.fetchall()
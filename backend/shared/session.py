@@ -0,0 +1,230 @@
+"""
+Сессионные токены, подписанные HMAC-SHA256.
+
+auth выдаёт короткоживущий токен с id пользователя, флагом бана и сроком
+VIP. Остальные функции проверяют подпись на месте и читают эти данные без
+запроса к users:
+
+    session = authenticate(request)
+    user_id = caller_id(request, request.body.get('userId'))
+
+Токен передаётся в заголовке `Authorization: Bearer <token>`. Пока клиент
+не присылает токен, caller_id возвращает userId из запроса как раньше;
+SESSION_REQUIRED=1 отключает этот режим.
+
+Бан не должен ждать истечения токена, поэтому admin.ban_user пишет
+пользователя в session_revocations (V0019). Список небольшой (только баны
+за последние SESSION_TTL секунд) и перечитывается не чаще раза в
+SESSION_REVOCATION_REFRESH секунд на контейнер: на прогретом контейнере
+токен забаненного пользователя действует ещё до этого срока. Маршруты,
+которые двигают деньги, вызывают caller_id(..., fresh=True) — тогда отзыв
+проверяется запросом к базе и бан действует сразу.
+
+Переменные окружения:
+    SESSION_SECRET             — ключ подписи (без него токены не выдаются)
+    SESSION_TTL                — срок жизни токена, с (по умолчанию 900)
+    SESSION_REQUIRED           — требовать токен (по умолчанию 0)
+    SESSION_REVOCATION_REFRESH — период обновления списка отзыва, с (по умолчанию 30)
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+
+from shared.http import HttpError, Request
+
+SCHEMA = 't_p45110186_greeting_project_202'
+
+SESSION_SECRET = os.environ.get('SESSION_SECRET', '').encode()
+SESSION_TTL = int(os.environ.get('SESSION_TTL') or 900)
+SESSION_REQUIRED = os.environ.get('SESSION_REQUIRED', '0').lower() in ('1', 'true', 'yes')
+SESSION_REVOCATION_REFRESH = int(os.environ.get('SESSION_REVOCATION_REFRESH') or 30)
+
+TOKEN_VERSION = 'v1'
+
+
+def enabled() -> bool:
+    return bool(SESSION_SECRET)
+
+
+def _b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def _b64decode(value: str) -> bytes:
+    return base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+
+
+def _sign(payload: str) -> str:
+    digest = hmac.new(SESSION_SECRET, f'{TOKEN_VERSION}.{payload}'.encode(), hashlib.sha256).digest()
+    return _b64encode(digest)
+
+
+def _timestamp(value: Optional[datetime]) -> Optional[int]:
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp())
+
+
+# =============================================================================
+# TOKENS
+# =============================================================================
+
+class Session:
+    __slots__ = ('user_id', 'is_banned', 'vip_expires_at', 'issued_at', 'expires_at')
+
+    def __init__(self, user_id: int, is_banned: bool, vip_expires_at: Optional[int], issued_at: int, expires_at: int):
+        self.user_id = user_id
+        self.is_banned = is_banned
+        # Unix-время окончания VIP или None
+        self.vip_expires_at = vip_expires_at
+        self.issued_at = issued_at
+        self.expires_at = expires_at
+
+    @property
+    def is_vip(self) -> bool:
+        return self.vip_expires_at is not None and self.vip_expires_at > time.time()
+
+
+def issue(user_id: int, is_banned: bool = False, vip_expires_at: Optional[datetime] = None) -> Tuple[str, int]:
+    """Новый токен и его срок жизни в секундах."""
+    now = int(time.time())
+    claims = {
+        'uid': user_id,
+        'ban': bool(is_banned),
+        'vip': _timestamp(vip_expires_at),
+        'iat': now,
+        'exp': now + SESSION_TTL,
+    }
+    payload = _b64encode(json.dumps(claims, separators=(',', ':')).encode())
+    return f'{TOKEN_VERSION}.{payload}.{_sign(payload)}', SESSION_TTL
+
+
+def decode(token: str) -> Session:
+    try:
+        version, payload, signature = token.split('.')
+    except ValueError:
+        raise HttpError(401, 'Недействительный токен')
+
+    if version != TOKEN_VERSION or not hmac.compare_digest(signature, _sign(payload)):
+        raise HttpError(401, 'Недействительный токен')
+
+    try:
+        claims = json.loads(_b64decode(payload))
+        session = Session(int(claims['uid']), bool(claims['ban']), claims['vip'], int(claims['iat']), int(claims['exp']))
+    except (ValueError, KeyError, TypeError):
+        raise HttpError(401, 'Недействительный токен')
+
+    if session.expires_at <= time.time():
+        raise HttpError(401, 'Срок действия токена истёк')
+
+    return session
+
+
+# =============================================================================
+# REVOCATION
+# =============================================================================
+
+# user_id -> Unix-время отзыва; токены, выданные до него, недействительны
+_revoked: Dict[int, float] = {}
+_revoked_loaded_at = 0.0
+_revoked_lock = threading.Lock()
+
+
+def _refresh_revocations(request: Request) -> None:
+    global _revoked, _revoked_loaded_at
+    with _revoked_lock:
+        if time.monotonic() - _revoked_loaded_at < SESSION_REVOCATION_REFRESH and _revoked_loaded_at:
+            return
+        cur = request.cursor()
+        cur.execute(
+            f"""
+            SELECT user_id, EXTRACT(EPOCH FROM revoked_at)
+            FROM {SCHEMA}.session_revocations
+            WHERE revoked_at > NOW() - make_interval(secs => %s)
+            """,
+            (SESSION_TTL,)
+        )
+        _revoked = {user_id: float(revoked_at) for user_id, revoked_at in cur.fetchall()}
+        _revoked_loaded_at = time.monotonic()
+
+
+def is_revoked(request: Request, session: Session, fresh: bool = False) -> bool:
+    if fresh:
+        cur = request.cursor()
+        cur.execute(
+            f"""
+            SELECT 1 FROM {SCHEMA}.session_revocations
+            WHERE user_id = %s AND revoked_at >= to_timestamp(%s)
+            """,
+            (session.user_id, session.issued_at)
+        )
+        return cur.fetchone() is not None
+
+    _refresh_revocations(request)
+    revoked_at = _revoked.get(session.user_id)
+    return revoked_at is not None and session.issued_at <= revoked_at
+
+
+def revoke(cursor, user_id: int) -> None:
+    """Отзывает все выданные пользователю токены; коммит — на вызывающем."""
+    cursor.execute(
+        f"""
+        INSERT INTO {SCHEMA}.session_revocations (user_id, revoked_at)
+        VALUES (%s, NOW())
+        ON CONFLICT (user_id) DO UPDATE SET revoked_at = EXCLUDED.revoked_at
+        """,
+        (user_id,)
+    )
+    # Записи старше срока жизни токена больше ничего не отсекают
+    cursor.execute(
+        f"DELETE FROM {SCHEMA}.session_revocations WHERE revoked_at < NOW() - make_interval(secs => %s)",
+        (SESSION_TTL,)
+    )
+
+
+# =============================================================================
+# HANDLER HELPERS
+# =============================================================================
+
+def authenticate(request: Request, required: bool = SESSION_REQUIRED, fresh: bool = False) -> Optional[Session]:
+    """
+    Сессия из заголовка Authorization; None, если токена нет и он не
+    обязателен. fresh — проверить отзыв по базе, минуя кэш контейнера.
+    """
+    header = request.headers.get('authorization', '')
+    scheme, _, token = header.partition(' ')
+    if scheme.lower() != 'bearer' or not token.strip() or not enabled():
+        if required:
+            raise HttpError(401, 'Требуется авторизация')
+        return None
+
+    session = decode(token.strip())
+    if session.is_banned or is_revoked(request, session, fresh):
+        raise HttpError(403, 'Аккаунт заблокирован')
+    return session
+
+
+def caller_id(request: Request, claimed=None, fresh: bool = False):
+    """
+    id вызывающего пользователя: из токена, если он есть, иначе claimed
+    (userId из запроса). userId, не совпадающий с токеном, отклоняется.
+    """
+    return resolve_caller(authenticate(request, fresh=fresh), claimed)
+
+
+def resolve_caller(session: Optional[Session], claimed=None):
+    """caller_id для уже проверенной сессии."""
+    if session is None:
+        return claimed
+    if claimed not in (None, '') and str(claimed) != str(session.user_id):
+        raise HttpError(403, 'Нет доступа к данным другого пользователя')
+    return session.user_id
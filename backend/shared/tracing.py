@@ -0,0 +1,176 @@
+"""
+Трассировка запросов к функциям.
+
+Соединения из пула создаются с TracingCursor: каждый execute записывает
+нормализованный текст запроса, длительность и число строк в трассу
+текущего вызова. Router открывает трассу на входе и закрывает на выходе:
+пишет одну строку структурированного лога, отдельные строки для медленных
+запросов и, если включено, заголовок Server-Timing.
+
+Переменные окружения:
+    TRACE_LOG       — писать итоговую строку по каждому вызову (по умолчанию 1)
+    SERVER_TIMING   — добавлять заголовок Server-Timing (по умолчанию 0)
+    SLOW_QUERY_MS   — порог медленного запроса, мс (по умолчанию 100)
+    SLOW_REQUEST_MS — порог медленного вызова, мс (по умолчанию 500)
+"""
+
+import contextvars
+import json
+import os
+import re
+import time
+from typing import List, Optional
+
+from psycopg2 import extensions
+
+
+def _env_flag(key: str, default: str) -> bool:
+    return os.environ.get(key, default).lower() in ('1', 'true', 'yes')
+
+
+TRACE_LOG = _env_flag('TRACE_LOG', '1')
+SERVER_TIMING = _env_flag('SERVER_TIMING', '0')
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS') or 100)
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS') or 500)
+
+# Максимальная длина текста запроса в логе
+SQL_PREVIEW = 300
+
+_WHITESPACE = re.compile(r'\s+')
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+
+
+def normalize_sql(query) -> str:
+    """Запрос без литералов и лишних пробелов, чтобы одинаковые группировались."""
+    if isinstance(query, bytes):
+        query = query.decode(errors='replace')
+    elif not isinstance(query, str):
+        query = str(query)
+    query = _STRING_LITERAL.sub('?', query)
+    query = _NUMBER_LITERAL.sub('?', query)
+    return _WHITESPACE.sub(' ', query).strip()[:SQL_PREVIEW]
+
+
+# =============================================================================
+# TRACE
+# =============================================================================
+
+class Trace:
+    __slots__ = ('started', 'connect_ms', 'serialize_ms', 'queries')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.connect_ms = 0.0
+        self.serialize_ms = 0.0
+        # (исходный текст, длительность мс, число строк)
+        self.queries: List[tuple] = []
+
+    def add_query(self, query, duration_ms: float, rows: int) -> None:
+        self.queries.append((query, duration_ms, rows))
+
+    @property
+    def query_ms(self) -> float:
+        return sum(duration for _, duration, _ in self.queries)
+
+    @property
+    def total_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def server_timing(self, total_ms: float) -> str:
+        return (
+            f'db;dur={self.query_ms:.2f};desc="{len(self.queries)} queries", '
+            f'conn;dur={self.connect_ms:.2f}, '
+            f'ser;dur={self.serialize_ms:.2f}, '
+            f'total;dur={total_ms:.2f}'
+        )
+
+
+_current: contextvars.ContextVar = contextvars.ContextVar('trace', default=None)
+
+# Трасса последнего завершённого вызова (для tools/bench.py)
+last_trace: Optional[Trace] = None
+
+
+def start() -> Trace:
+    trace = Trace()
+    _current.set(trace)
+    return trace
+
+
+def current() -> Optional[Trace]:
+    return _current.get()
+
+
+def finish(trace: Trace, method: str, action: str, response: dict) -> None:
+    global last_trace
+    _current.set(None)
+    last_trace = trace
+
+    total_ms = trace.total_ms
+    status = response.get('statusCode')
+
+    if SERVER_TIMING:
+        headers = response.setdefault('headers', {})
+        headers['Server-Timing'] = trace.server_timing(total_ms)
+        headers['Timing-Allow-Origin'] = '*'
+
+    for query, duration, rows in trace.queries:
+        if duration >= SLOW_QUERY_MS:
+            _log({
+                'type': 'slow_query',
+                'method': method,
+                'action': action,
+                'sql': normalize_sql(query),
+                'ms': round(duration, 2),
+                'rows': rows,
+            })
+
+    if TRACE_LOG or total_ms >= SLOW_REQUEST_MS:
+        _log({
+            'type': 'request',
+            'method': method,
+            'action': action,
+            'status': status,
+            'total_ms': round(total_ms, 2),
+            'connect_ms': round(trace.connect_ms, 2),
+            'query_ms': round(trace.query_ms, 2),
+            'serialize_ms': round(trace.serialize_ms, 2),
+            'queries': len(trace.queries),
+            'statements': [
+                {'sql': normalize_sql(query), 'ms': round(duration, 2), 'rows': rows}
+                for query, duration, rows in trace.queries
+            ],
+        })
+
+
+def _log(record: dict) -> None:
+    print(json.dumps(record, ensure_ascii=False))
+
+
+# =============================================================================
+# CURSOR
+# =============================================================================
+
+class TracingCursor(extensions.cursor):
+    """Курсор, записывающий каждый запрос в трассу текущего вызова."""
+
+    def execute(self, query, vars=None):
+        trace = _current.get()
+        if trace is None:
+            return super().execute(query, vars)
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            trace.add_query(query, (time.perf_counter() - started) * 1000, self.rowcount)
+
+    def executemany(self, query, vars_list):
+        trace = _current.get()
+        if trace is None:
+            return super().executemany(query, vars_list)
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            trace.add_query(query, (time.perf_counter() - started) * 1000, self.rowcount)
@@ -1,255 +1,330 @@
-import json
+"""API для управления заявками на вывод средств"""
 import os
-import psycopg2
-from datetime import datetime
-
-def handler(event: dict, context) -> dict:
-    """API для управления заявками на вывод средств"""
-    
-    method = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
-    
-    dsn = os.environ.get('DATABASE_URL')
-    if not dsn:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Database configuration missing'}),
-            'isBase64Encoded': False
-        }
-    
-    conn = psycopg2.connect(dsn)
-    cursor = conn.cursor()
-    
+
+from shared.batch import batch_results, is_batch, parse_selection
+from shared.etag import conditional
+from shared.http import HttpError, Request, Router, json_response
+from shared.idempotency import idempotent
+from shared.session import caller_id
+
+router = Router('GET, POST, PUT, DELETE, OPTIONS', allow_headers='Content-Type, Authorization, If-None-Match, Idempotency-Key')
+
+# Аренда заявок, взятых администратором через claim (V0028), с
+WITHDRAWAL_CLAIM_LEASE = int(os.environ.get('WITHDRAWAL_CLAIM_LEASE') or 300)
+CLAIM_DEFAULT_LIMIT = 10
+CLAIM_MAX_LIMIT = 50
+
+WITHDRAWAL_COLUMNS = """
+    id, user_id, username, amount, network, wallet_address, status,
+    created_at, processed_at, admin_note
+"""
+
+# Переход pending -> approved/rejected одним запросом для одной заявки или
+# пачки (shared.batch). FOR UPDATE в target упорядочивает параллельные
+# обработки: повторная увидит заявки уже не в pending и пропустит их.
+# Заявки, взятые в работу другим администратором (claim), пропускаются,
+# пока не истекла аренда. Результат — пары (id, выполнено) по всем
+# отобранным заявкам
+TARGET_SQL = """
+    SELECT id, user_id, amount, reserved
+    FROM t_p45110186_greeting_project_202.withdrawal_requests
+    WHERE status = 'pending'
+      AND (%(ids)s::INTEGER[] IS NULL OR id = ANY(%(ids)s::INTEGER[]))
+      AND (%(max_amount)s::NUMERIC IS NULL OR amount <= %(max_amount)s::NUMERIC)
+      AND (%(network)s::TEXT IS NULL OR network = %(network)s::TEXT)
+      AND (claimed_until IS NULL OR claimed_until < NOW() OR claimed_by = %(admin_id)s::INTEGER)
+    ORDER BY id
+    LIMIT %(limit)s
+    FOR UPDATE
+"""
+
+# Зарезервированные суммы уже списаны. По старым заявкам (reserved = FALSE)
+# списываем сейчас строками журнала, если баланса хватает на все заявки
+# пользователя в пачке
+APPROVE_SQL = f"""
+    WITH target AS ({TARGET_SQL}),
+    owed AS (
+        SELECT user_id, SUM(amount) AS amount FROM target WHERE NOT reserved GROUP BY user_id
+    ),
+    payers AS (
+        SELECT u.id
+        FROM t_p45110186_greeting_project_202.users u
+        JOIN owed o ON o.user_id = u.id
+        WHERE u.balance >= o.amount
+        FOR UPDATE OF u
+    ),
+    debited AS (
+        INSERT INTO t_p45110186_greeting_project_202.balance_ledger (user_id, delta, kind, reference_id)
+        SELECT t.user_id, -t.amount, 'withdrawal', t.id
+        FROM target t
+        WHERE NOT t.reserved AND t.user_id IN (SELECT id FROM payers)
+    ),
+    done AS (
+        UPDATE t_p45110186_greeting_project_202.withdrawal_requests w
+        SET status = 'approved', processed_at = NOW(), admin_note = %(admin_note)s
+        FROM target t
+        WHERE w.id = t.id AND (t.reserved OR t.user_id IN (SELECT id FROM payers))
+        RETURNING w.id
+    )
+    SELECT t.id, t.id IN (SELECT id FROM done) FROM target t
+"""
+
+# Отклонение возвращает зарезервированные суммы строками журнала
+REJECT_SQL = f"""
+    WITH target AS ({TARGET_SQL}),
+    refunded AS (
+        INSERT INTO t_p45110186_greeting_project_202.balance_ledger (user_id, delta, kind, reference_id)
+        SELECT user_id, amount, 'withdrawal_refund', id FROM target WHERE reserved
+    ),
+    done AS (
+        UPDATE t_p45110186_greeting_project_202.withdrawal_requests w
+        SET status = 'rejected', processed_at = NOW(), admin_note = %(admin_note)s
+        FROM target t
+        WHERE w.id = t.id
+    )
+    SELECT t.id, TRUE FROM target t
+"""
+
+# Следующие свободные заявки в порядке очереди; занятые другими
+# администраторами (в том числе в соседней транзакции) пропускаются
+CLAIM_SQL = """
+    WITH next AS (
+        SELECT id
+        FROM t_p45110186_greeting_project_202.withdrawal_requests
+        WHERE status = 'pending' AND (claimed_until IS NULL OR claimed_until < NOW())
+        ORDER BY priority DESC, created_at, id
+        LIMIT %(limit)s
+        FOR UPDATE SKIP LOCKED
+    )
+    UPDATE t_p45110186_greeting_project_202.withdrawal_requests w
+    SET claimed_by = %(admin_id)s, claimed_until = NOW() + make_interval(secs => %(lease)s)
+    FROM next
+    WHERE w.id = next.id
+    RETURNING w.id, w.user_id, w.username, w.amount, w.network, w.wallet_address, w.status,
+              w.created_at, w.processed_at, w.admin_note, w.priority, w.claimed_until
+"""
+
+
+def row_to_withdrawal(row: tuple) -> dict:
+    return {
+        'id': row[0],
+        'userId': row[1],
+        'username': row[2],
+        'amount': float(row[3]),
+        'network': row[4],
+        'walletAddress': row[5],
+        'status': row[6],
+        'createdAt': row[7].isoformat() if row[7] else None,
+        'processedAt': row[8].isoformat() if row[8] else None,
+        'adminNote': row[9]
+    }
+
+@router.route('GET')
+@conditional('withdrawal_requests')
+def list_withdrawals(request: Request) -> dict:
+    status_filter = request.query.get('status', 'pending')
+
+    cursor = request.cursor()
+    cursor.execute(f"""
+        SELECT {WITHDRAWAL_COLUMNS}
+        FROM t_p45110186_greeting_project_202.withdrawal_requests
+        WHERE status = %s
+        ORDER BY created_at DESC
+    """, (status_filter,))
+    withdrawals = [row_to_withdrawal(row) for row in cursor.fetchall()]
+
+    return json_response(200, {'withdrawals': withdrawals})
+
+
+@router.route('POST')
+@idempotent('withdrawals')
+def create_withdrawal(request: Request) -> dict:
+    body = request.body
+    # Бан должен останавливать вывод сразу, без кэша отзывов контейнера
+    user_id = caller_id(request, body.get('userId'), fresh=True)
+    username = body.get('username')
+    amount = body.get('amount')
+    network = body.get('network')
+    wallet_address = body.get('walletAddress')
+
+    if not all([user_id, username, amount, network, wallet_address]):
+        raise HttpError(400, 'Missing required fields')
+
+    # Суммы и балансы хранятся целыми: дробная сумма или строка не должна
+    # попасть ни в заявку, ни в журнал
+    if not isinstance(amount, int) or isinstance(amount, bool):
+        raise HttpError(400, 'Сумма вывода должна быть целым числом')
+    if amount < 10:
+        raise HttpError(400, 'Минимальная сумма вывода 10 USDT')
+
+    # Резерв и заявка одним запросом: FOR UPDATE с условием на баланс не
+    # даст двум параллельным заявкам потратить одни и те же средства.
+    # Списание — строка журнала (V0030), баланс меняет её триггер
+    cursor = request.cursor()
+    cursor.execute("""
+        WITH payer AS (
+            SELECT id, is_vip
+            FROM t_p45110186_greeting_project_202.users
+            WHERE id = %(user_id)s AND balance >= %(amount)s
+            FOR UPDATE
+        ),
+        created AS (
+            INSERT INTO t_p45110186_greeting_project_202.withdrawal_requests
+            (user_id, username, amount, network, wallet_address, status, reserved, priority)
+            SELECT id, %(username)s, %(amount)s, %(network)s, %(wallet_address)s, 'pending', TRUE,
+                   CASE WHEN is_vip THEN 1 ELSE 0 END
+            FROM payer
+            RETURNING id, user_id, amount
+        ),
+        debited AS (
+            INSERT INTO t_p45110186_greeting_project_202.balance_ledger (user_id, delta, kind, reference_id)
+            SELECT user_id, -amount, 'withdrawal', id FROM created
+        )
+        SELECT id FROM created
+    """, {
+        'user_id': user_id,
+        'username': username,
+        'amount': amount,
+        'network': network,
+        'wallet_address': wallet_address,
+    })
+
+    result = cursor.fetchone()
+    if not result:
+        raise HttpError(400, 'Недостаточно средств')
+
+    withdrawal_id = result[0]
+    # Коммит — в @idempotent, вместе с сохранённым ответом
+
+    return json_response(200, {
+        'success': True,
+        'message': 'Заявка подана администратору',
+        'withdrawalId': withdrawal_id
+    })
+
+
+@router.route('POST', 'claim')
+def claim_withdrawals(request: Request) -> dict:
+    '''Берёт в работу следующие limit заявок из очереди для adminId'''
+    body = request.body
+    admin_id = body.get('adminId')
+    if not admin_id:
+        raise HttpError(400, 'adminId required')
+
     try:
-        if method == 'GET':
-            params = event.get('queryStringParameters') or {}
-            status_filter = params.get('status', 'pending')
-            
-            cursor.execute("""
-                SELECT id, user_id, username, amount, network, wallet_address, status, 
-                       created_at, processed_at, admin_note
-                FROM t_p45110186_greeting_project_202.withdrawal_requests
-                WHERE status = %s
-                ORDER BY created_at DESC
-            """, (status_filter,))
-            rows = cursor.fetchall()
-            
-            withdrawals = []
-            for row in rows:
-                withdrawals.append({
-                    'id': row[0],
-                    'userId': row[1],
-                    'username': row[2],
-                    'amount': float(row[3]),
-                    'network': row[4],
-                    'walletAddress': row[5],
-                    'status': row[6],
-                    'createdAt': row[7].isoformat() if row[7] else None,
-                    'processedAt': row[8].isoformat() if row[8] else None,
-                    'adminNote': row[9]
-                })
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'withdrawals': withdrawals}),
-                'isBase64Encoded': False
-            }
-        
-        elif method == 'POST':
-            body = json.loads(event.get('body', '{}'))
-            user_id = body.get('userId')
-            username = body.get('username')
-            amount = body.get('amount')
-            network = body.get('network')
-            wallet_address = body.get('walletAddress')
-            
-            if not all([user_id, username, amount, network, wallet_address]):
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Missing required fields'}),
-                    'isBase64Encoded': False
-                }
-            
-            if amount < 10:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Минимальная сумма вывода 10 USDT'}),
-                    'isBase64Encoded': False
-                }
-            
-            cursor.execute("""
-                SELECT balance FROM t_p45110186_greeting_project_202.users
-                WHERE id = %s
-            """, (user_id,))
-            
-            result = cursor.fetchone()
-            if not result or result[0] < amount:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Недостаточно средств'}),
-                    'isBase64Encoded': False
-                }
-            
-            cursor.execute("""
-                INSERT INTO t_p45110186_greeting_project_202.withdrawal_requests
-                (user_id, username, amount, network, wallet_address, status)
-                VALUES (%s, %s, %s, %s, %s, 'pending')
-                RETURNING id
-            """, (user_id, username, amount, network, wallet_address))
-            
-            withdrawal_id = cursor.fetchone()[0]
-            conn.commit()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
-                    'success': True,
-                    'message': 'Заявка подана администратору',
-                    'withdrawalId': withdrawal_id
-                }),
-                'isBase64Encoded': False
-            }
-        
-        elif method == 'PUT':
-            body = json.loads(event.get('body', '{}'))
-            withdrawal_id = body.get('withdrawalId')
-            action = body.get('action')
-            admin_note = body.get('adminNote', '')
-            
-            if not withdrawal_id or action not in ['approve', 'reject']:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Invalid request'}),
-                    'isBase64Encoded': False
-                }
-            
-            cursor.execute("""
-                SELECT user_id, amount, status 
-                FROM t_p45110186_greeting_project_202.withdrawal_requests
-                WHERE id = %s
-            """, (withdrawal_id,))
-            result = cursor.fetchone()
-            
-            if not result or result[2] != 'pending':
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Request not found or already processed'}),
-                    'isBase64Encoded': False
-                }
-            
-            user_id, amount = result[0], result[1]
-            
-            if action == 'approve':
-                cursor.execute("""
-                    UPDATE t_p45110186_greeting_project_202.users
-                    SET balance = balance - %s
-                    WHERE id = %s
-                """, (amount, user_id))
-                
-                cursor.execute("""
-                    UPDATE t_p45110186_greeting_project_202.withdrawal_requests
-                    SET status = 'approved', processed_at = %s, admin_note = %s
-                    WHERE id = %s
-                """, (datetime.now(), admin_note, withdrawal_id))
-            else:
-                cursor.execute("""
-                    UPDATE t_p45110186_greeting_project_202.withdrawal_requests
-                    SET status = 'rejected', processed_at = %s, admin_note = %s
-                    WHERE id = %s
-                """, (datetime.now(), admin_note, withdrawal_id))
-            
-            conn.commit()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'success': True, 'message': 'Статус обновлён'}),
-                'isBase64Encoded': False
-            }
-        
-        elif method == 'DELETE':
-            body = json.loads(event.get('body', '{}'))
-            withdrawal_id = body.get('withdrawalId')
-            
-            if not withdrawal_id:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Missing withdrawalId'}),
-                    'isBase64Encoded': False
-                }
-            
-            cursor.execute("""
-                SELECT status FROM t_p45110186_greeting_project_202.withdrawals
-                WHERE id = %s
-            """, (withdrawal_id,))
-            result = cursor.fetchone()
-            
-            if not result:
-                return {
-                    'statusCode': 404,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Заявка не найдена'}),
-                    'isBase64Encoded': False
-                }
-            
-            if result[0] == 'pending':
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Нельзя удалить заявку со статусом "В ожидании"'}),
-                    'isBase64Encoded': False
-                }
-            
-            cursor.execute("""
-                DELETE FROM t_p45110186_greeting_project_202.withdrawals
-                WHERE id = %s
-            """, (withdrawal_id,))
-            
-            conn.commit()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'success': True, 'message': 'Заявка удалена'}),
-                'isBase64Encoded': False
-            }
-        
-        else:
-            return {
-                'statusCode': 405,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Method not allowed'}),
-                'isBase64Encoded': False
-            }
-    
-    except Exception as e:
-        conn.rollback()
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': str(e)}),
-            'isBase64Encoded': False
-        }
-    finally:
-        cursor.close()
-        conn.close()
\ No newline at end of file
+        limit = max(1, min(int(body.get('limit') or CLAIM_DEFAULT_LIMIT), CLAIM_MAX_LIMIT))
+    except (TypeError, ValueError):
+        raise HttpError(400, 'limit must be a number')
+
+    cursor = request.cursor()
+    cursor.execute(CLAIM_SQL, {'admin_id': admin_id, 'limit': limit, 'lease': WITHDRAWAL_CLAIM_LEASE})
+    # RETURNING не сохраняет порядок очереди
+    rows = sorted(cursor.fetchall(), key=lambda row: (-row[10], row[7], row[0]))
+    request.conn.commit()
+
+    withdrawals = []
+    for row in rows:
+        withdrawal = row_to_withdrawal(row)
+        withdrawal['priority'] = row[10]
+        withdrawal['claimedUntil'] = row[11].isoformat()
+        withdrawals.append(withdrawal)
+
+    return json_response(200, {'withdrawals': withdrawals, 'leaseSeconds': WITHDRAWAL_CLAIM_LEASE})
+
+
+@router.route('POST', 'release')
+def release_withdrawals(request: Request) -> dict:
+    '''Возвращает в очередь заявки adminId (все или из withdrawalIds)'''
+    body = request.body
+    admin_id = body.get('adminId')
+    if not admin_id:
+        raise HttpError(400, 'adminId required')
+
+    ids = body.get('withdrawalIds')
+    if ids is not None and (
+        not isinstance(ids, list)
+        or not all(isinstance(value, int) and not isinstance(value, bool) for value in ids)
+    ):
+        raise HttpError(400, 'withdrawalIds must be a list of integers')
+
+    cursor = request.cursor()
+    cursor.execute("""
+        UPDATE t_p45110186_greeting_project_202.withdrawal_requests
+        SET claimed_by = NULL, claimed_until = NULL
+        WHERE claimed_by = %s AND status = 'pending'
+          AND (%s::INTEGER[] IS NULL OR id = ANY(%s::INTEGER[]))
+    """, (admin_id, ids, ids))
+    released = cursor.rowcount
+    request.conn.commit()
+
+    return json_response(200, {'success': True, 'released': released})
+
+
+@router.route('PUT')
+def process_withdrawal(request: Request) -> dict:
+    body = request.body
+    withdrawal_id = body.get('withdrawalId')
+    action = body.get('action')
+    admin_note = body.get('adminNote', '')
+
+    if action not in ['approve', 'reject']:
+        raise HttpError(400, 'Invalid request')
+
+    if is_batch(body):
+        selection = parse_selection(body, ('maxAmount', 'network'))
+    elif withdrawal_id:
+        selection = {'ids': [withdrawal_id], 'max_amount': None, 'network': None, 'limit': 1}
+    else:
+        raise HttpError(400, 'Invalid request')
+    selection['admin_id'] = body.get('adminId')
+
+    cursor = request.cursor()
+    cursor.execute(APPROVE_SQL if action == 'approve' else REJECT_SQL, {
+        **selection,
+        'admin_note': admin_note,
+    })
+    rows = cursor.fetchall()
+    request.conn.commit()
+
+    if is_batch(body):
+        return json_response(200, batch_results(selection['ids'], rows, 'approved' if action == 'approve' else 'rejected'))
+
+    if not rows:
+        raise HttpError(400, 'Request not found or already processed')
+    if not rows[0][1]:
+        raise HttpError(400, 'Недостаточно средств')
+
+    return json_response(200, {'success': True, 'message': 'Статус обновлён'})
+
+
+@router.route('DELETE')
+def delete_withdrawal(request: Request) -> dict:
+    withdrawal_id = request.body.get('withdrawalId')
+
+    if not withdrawal_id:
+        raise HttpError(400, 'Missing withdrawalId')
+
+    cursor = request.cursor()
+    cursor.execute("""
+        SELECT status FROM t_p45110186_greeting_project_202.withdrawals
+        WHERE id = %s
+    """, (withdrawal_id,))
+    result = cursor.fetchone()
+
+    if not result:
+        raise HttpError(404, 'Заявка не найдена')
+
+    if result[0] == 'pending':
+        raise HttpError(400, 'Нельзя удалить заявку со статусом "В ожидании"')
+
+    cursor.execute("""
+        DELETE FROM t_p45110186_greeting_project_202.withdrawals
+        WHERE id = %s
+    """, (withdrawal_id,))
+
+    request.conn.commit()
+
+    return json_response(200, {'success': True, 'message': 'Заявка удалена'})
+
+
+handler = router
@@ -0,0 +1,25 @@
+-- Ключ постраничной выборки игроков (created_at, id) не должен содержать NULL
+UPDATE t_p45110186_greeting_project_202.users SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL;
+UPDATE t_p45110186_greeting_project_202.users SET is_banned = FALSE WHERE is_banned IS NULL;
+UPDATE t_p45110186_greeting_project_202.users SET is_vip = FALSE WHERE is_vip IS NULL;
+
+ALTER TABLE t_p45110186_greeting_project_202.users ALTER COLUMN created_at SET NOT NULL;
+ALTER TABLE t_p45110186_greeting_project_202.users ALTER COLUMN is_banned SET NOT NULL;
+ALTER TABLE t_p45110186_greeting_project_202.users ALTER COLUMN is_vip SET NOT NULL;
+
+-- Основной индекс для keyset-пагинации
+CREATE INDEX IF NOT EXISTS idx_users_created_at_id
+    ON t_p45110186_greeting_project_202.users (created_at DESC, id DESC);
+
+-- Частичные индексы под фильтры по редким значениям
+CREATE INDEX IF NOT EXISTS idx_users_banned_created_at_id
+    ON t_p45110186_greeting_project_202.users (created_at DESC, id DESC)
+    WHERE is_banned = TRUE;
+
+CREATE INDEX IF NOT EXISTS idx_users_vip_created_at_id
+    ON t_p45110186_greeting_project_202.users (created_at DESC, id DESC)
+    WHERE is_vip = TRUE;
+
+CREATE INDEX IF NOT EXISTS idx_users_telegram_created_at_id
+    ON t_p45110186_greeting_project_202.users (created_at DESC, id DESC)
+    WHERE telegram_id IS NOT NULL;
@@ -0,0 +1,32 @@
+-- Счётчики изменений таблиц для ETag: читающие эндпоинты сравнивают версию
+-- с If-None-Match и отвечают 304, не выполняя основной запрос
+CREATE TABLE IF NOT EXISTS t_p45110186_greeting_project_202.table_versions (
+    table_name VARCHAR(63) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO t_p45110186_greeting_project_202.table_versions (table_name)
+VALUES ('users'), ('withdrawal_requests')
+ON CONFLICT (table_name) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION t_p45110186_greeting_project_202.bump_table_version()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE t_p45110186_greeting_project_202.table_versions
+    SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+    WHERE table_name = TG_TABLE_NAME;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Триггеры уровня оператора: одно обновление счётчика на запрос, а не на строку
+DROP TRIGGER IF EXISTS trg_users_version ON t_p45110186_greeting_project_202.users;
+CREATE TRIGGER trg_users_version
+    AFTER INSERT OR UPDATE OR DELETE ON t_p45110186_greeting_project_202.users
+    FOR EACH STATEMENT EXECUTE FUNCTION t_p45110186_greeting_project_202.bump_table_version();
+
+DROP TRIGGER IF EXISTS trg_withdrawal_requests_version ON t_p45110186_greeting_project_202.withdrawal_requests;
+CREATE TRIGGER trg_withdrawal_requests_version
+    AFTER INSERT OR UPDATE OR DELETE ON t_p45110186_greeting_project_202.withdrawal_requests
+    FOR EACH STATEMENT EXECUTE FUNCTION t_p45110186_greeting_project_202.bump_table_version();
@@ -0,0 +1,16 @@
+-- Поиск пользователей по username и telegram_username (shared/search.py)
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Префиксный поиск: lower(...) LIKE 'abc%'
+CREATE INDEX IF NOT EXISTS idx_users_username_prefix
+    ON t_p45110186_greeting_project_202.users (lower(username) text_pattern_ops);
+
+CREATE INDEX IF NOT EXISTS idx_users_telegram_username_prefix
+    ON t_p45110186_greeting_project_202.users (lower(telegram_username) text_pattern_ops);
+
+-- Поиск по подстроке: lower(...) LIKE '%abc%'
+CREATE INDEX IF NOT EXISTS idx_users_username_trgm
+    ON t_p45110186_greeting_project_202.users USING gin (lower(username) gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_users_telegram_username_trgm
+    ON t_p45110186_greeting_project_202.users USING gin (lower(telegram_username) gin_trgm_ops);
@@ -0,0 +1,196 @@
+-- Счётчики для шапки админки: читаются одним запросом по первичному ключу
+-- вместо выгрузки полных списков. Поддерживаются построчными триггерами
+-- на users, withdrawal_requests, vip_requests и support_messages
+CREATE TABLE IF NOT EXISTS t_p45110186_greeting_project_202.admin_counters (
+    name VARCHAR(63) PRIMARY KEY,
+    value NUMERIC NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO t_p45110186_greeting_project_202.admin_counters (name)
+VALUES
+    ('users_total'),
+    ('users_banned'),
+    ('users_vip'),
+    ('users_balance'),
+    ('withdrawals_pending'),
+    ('vip_requests_pending'),
+    ('support_unread_chats')
+ON CONFLICT (name) DO NOTHING;
+
+-- Нулевые приращения пропускаются: частые UPDATE users (например,
+-- last_login_at) не блокируют строки счётчиков
+CREATE OR REPLACE FUNCTION t_p45110186_greeting_project_202.add_admin_counter(counter_name VARCHAR, delta NUMERIC)
+RETURNS VOID AS $$
+BEGIN
+    IF delta <> 0 THEN
+        UPDATE t_p45110186_greeting_project_202.admin_counters
+        SET value = value + delta, updated_at = CURRENT_TIMESTAMP
+        WHERE name = counter_name;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Пересчёт всех счётчиков полным проходом; вызывается при миграции
+-- и вручную, если значения разошлись
+CREATE OR REPLACE FUNCTION t_p45110186_greeting_project_202.recount_admin_counters()
+RETURNS VOID AS $$
+BEGIN
+    UPDATE t_p45110186_greeting_project_202.admin_counters c
+    SET value = s.value, updated_at = CURRENT_TIMESTAMP
+    FROM (
+        SELECT 'users_total' AS name, COUNT(*)::NUMERIC AS value
+        FROM t_p45110186_greeting_project_202.users
+        UNION ALL
+        SELECT 'users_banned', COUNT(*) FILTER (WHERE is_banned)
+        FROM t_p45110186_greeting_project_202.users
+        UNION ALL
+        SELECT 'users_vip', COUNT(*) FILTER (WHERE is_vip)
+        FROM t_p45110186_greeting_project_202.users
+        UNION ALL
+        SELECT 'users_balance', COALESCE(SUM(balance), 0)
+        FROM t_p45110186_greeting_project_202.users
+        UNION ALL
+        SELECT 'withdrawals_pending', COUNT(*)
+        FROM t_p45110186_greeting_project_202.withdrawal_requests
+        WHERE status = 'pending'
+        UNION ALL
+        SELECT 'vip_requests_pending', COUNT(*)
+        FROM t_p45110186_greeting_project_202.vip_requests
+        WHERE status = 'pending'
+        UNION ALL
+        SELECT 'support_unread_chats', COUNT(DISTINCT user_id)
+        FROM t_p45110186_greeting_project_202.support_messages
+        WHERE is_read IS NOT TRUE AND is_admin_reply IS NOT TRUE
+    ) s
+    WHERE c.name = s.name;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION t_p45110186_greeting_project_202.count_users()
+RETURNS TRIGGER AS $$
+DECLARE
+    d_total INTEGER := 0;
+    d_banned INTEGER := 0;
+    d_vip INTEGER := 0;
+    d_balance NUMERIC := 0;
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        d_total := d_total + 1;
+        d_banned := d_banned + NEW.is_banned::INTEGER;
+        d_vip := d_vip + NEW.is_vip::INTEGER;
+        d_balance := d_balance + COALESCE(NEW.balance, 0);
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        d_total := d_total - 1;
+        d_banned := d_banned - OLD.is_banned::INTEGER;
+        d_vip := d_vip - OLD.is_vip::INTEGER;
+        d_balance := d_balance - COALESCE(OLD.balance, 0);
+    END IF;
+
+    PERFORM t_p45110186_greeting_project_202.add_admin_counter('users_total', d_total);
+    PERFORM t_p45110186_greeting_project_202.add_admin_counter('users_banned', d_banned);
+    PERFORM t_p45110186_greeting_project_202.add_admin_counter('users_vip', d_vip);
+    PERFORM t_p45110186_greeting_project_202.add_admin_counter('users_balance', d_balance);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Общая функция для таблиц заявок со статусом 'pending';
+-- имя счётчика передаётся аргументом триггера
+CREATE OR REPLACE FUNCTION t_p45110186_greeting_project_202.count_pending()
+RETURNS TRIGGER AS $$
+DECLARE
+    delta INTEGER := 0;
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.status = 'pending' THEN
+        delta := delta + 1;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.status = 'pending' THEN
+        delta := delta - 1;
+    END IF;
+
+    PERFORM t_p45110186_greeting_project_202.add_admin_counter(TG_ARGV[0], delta);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Чат считается непрочитанным, пока в нём есть хотя бы одно непрочитанное
+-- сообщение пользователя: счётчик меняется только на переходах 0 <-> 1.
+-- Триггер BEFORE: он видит строки, уже обработанные тем же оператором,
+-- поэтому массовый UPDATE по одному чату не посчитает переход дважды
+CREATE OR REPLACE FUNCTION t_p45110186_greeting_project_202.count_support_unread()
+RETURNS TRIGGER AS $$
+DECLARE
+    was_unread BOOLEAN := FALSE;
+    is_unread BOOLEAN := FALSE;
+    others BOOLEAN;
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        is_unread := NEW.is_read IS NOT TRUE AND NEW.is_admin_reply IS NOT TRUE;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        was_unread := OLD.is_read IS NOT TRUE AND OLD.is_admin_reply IS NOT TRUE;
+    END IF;
+
+    IF TG_OP = 'UPDATE' AND OLD.user_id = NEW.user_id AND was_unread = is_unread THEN
+        RETURN NEW;
+    END IF;
+
+    -- Снятие старой версии строки с чата OLD.user_id
+    IF was_unread THEN
+        SELECT EXISTS (
+            SELECT 1 FROM t_p45110186_greeting_project_202.support_messages
+            WHERE user_id = OLD.user_id AND id <> OLD.id
+              AND is_read IS NOT TRUE AND is_admin_reply IS NOT TRUE
+        ) INTO others;
+        IF NOT others AND NOT (is_unread AND NEW.user_id = OLD.user_id) THEN
+            PERFORM t_p45110186_greeting_project_202.add_admin_counter('support_unread_chats', -1);
+        END IF;
+    END IF;
+
+    -- Добавление новой версии строки в чат NEW.user_id
+    IF is_unread AND NOT (was_unread AND NEW.user_id = OLD.user_id) THEN
+        SELECT EXISTS (
+            SELECT 1 FROM t_p45110186_greeting_project_202.support_messages
+            WHERE user_id = NEW.user_id AND id <> NEW.id
+              AND is_read IS NOT TRUE AND is_admin_reply IS NOT TRUE
+        ) INTO others;
+        IF NOT others THEN
+            PERFORM t_p45110186_greeting_project_202.add_admin_counter('support_unread_chats', 1);
+        END IF;
+    END IF;
+
+    IF TG_OP = 'DELETE' THEN
+        RETURN OLD;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_users_admin_counters ON t_p45110186_greeting_project_202.users;
+CREATE TRIGGER trg_users_admin_counters
+    AFTER INSERT OR UPDATE OF is_banned, is_vip, balance OR DELETE ON t_p45110186_greeting_project_202.users
+    FOR EACH ROW EXECUTE FUNCTION t_p45110186_greeting_project_202.count_users();
+
+DROP TRIGGER IF EXISTS trg_withdrawal_requests_admin_counters ON t_p45110186_greeting_project_202.withdrawal_requests;
+CREATE TRIGGER trg_withdrawal_requests_admin_counters
+    AFTER INSERT OR UPDATE OF status OR DELETE ON t_p45110186_greeting_project_202.withdrawal_requests
+    FOR EACH ROW EXECUTE FUNCTION t_p45110186_greeting_project_202.count_pending('withdrawals_pending');
+
+DROP TRIGGER IF EXISTS trg_vip_requests_admin_counters ON t_p45110186_greeting_project_202.vip_requests;
+CREATE TRIGGER trg_vip_requests_admin_counters
+    AFTER INSERT OR UPDATE OF status OR DELETE ON t_p45110186_greeting_project_202.vip_requests
+    FOR EACH ROW EXECUTE FUNCTION t_p45110186_greeting_project_202.count_pending('vip_requests_pending');
+
+DROP TRIGGER IF EXISTS trg_support_messages_admin_counters ON t_p45110186_greeting_project_202.support_messages;
+CREATE TRIGGER trg_support_messages_admin_counters
+    BEFORE INSERT OR UPDATE OR DELETE ON t_p45110186_greeting_project_202.support_messages
+    FOR EACH ROW EXECUTE FUNCTION t_p45110186_greeting_project_202.count_support_unread();
+
+-- Для проверки «есть ли ещё непрочитанные» в count_support_unread
+CREATE INDEX IF NOT EXISTS idx_support_messages_unread
+    ON t_p45110186_greeting_project_202.support_messages (user_id)
+    WHERE is_read IS NOT TRUE AND is_admin_reply IS NOT TRUE;
+
+SELECT t_p45110186_greeting_project_202.recount_admin_counters();
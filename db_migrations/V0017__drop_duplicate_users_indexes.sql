@@ -0,0 +1,5 @@
+-- Регистрация опирается на уникальные ограничения users.username и
+-- users.referral_code (INSERT ... ON CONFLICT). Обычные индексы на тех же
+-- столбцах дублируют уникальные и лишь удорожают каждую вставку
+DROP INDEX IF EXISTS t_p45110186_greeting_project_202.idx_users_username;
+DROP INDEX IF EXISTS t_p45110186_greeting_project_202.idx_users_referral_code;
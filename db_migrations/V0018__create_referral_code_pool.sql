@@ -0,0 +1,47 @@
+-- Пул заранее сгенерированных и проверенных реферальных кодов.
+-- Регистрация забирает код через DELETE ... RETURNING с SKIP LOCKED,
+-- пул пополняется пачками функцией refill_referral_code_pool
+CREATE TABLE IF NOT EXISTS t_p45110186_greeting_project_202.referral_code_pool (
+    code VARCHAR(20) PRIMARY KEY,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Дополняет пул до target кодов; возвращает число добавленных
+CREATE OR REPLACE FUNCTION t_p45110186_greeting_project_202.refill_referral_code_pool(target INTEGER)
+RETURNS INTEGER AS $$
+DECLARE
+    chars CONSTANT TEXT := 'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789';
+    missing INTEGER;
+    added INTEGER;
+BEGIN
+    SELECT target - COUNT(*) INTO missing
+    FROM t_p45110186_greeting_project_202.referral_code_pool;
+
+    IF missing <= 0 THEN
+        RETURN 0;
+    END IF;
+
+    -- Условие g.n > 0 делает подзапрос коррелированным, иначе он
+    -- вычислился бы один раз и все строки получили бы один код
+    INSERT INTO t_p45110186_greeting_project_202.referral_code_pool (code)
+    SELECT c.code
+    FROM (
+        SELECT (
+            SELECT string_agg(substr(chars, 1 + floor(random() * 36)::INTEGER, 1), '')
+            FROM generate_series(1, 8)
+            WHERE g.n > 0
+        ) AS code
+        FROM generate_series(1, missing) AS g(n)
+    ) c
+    WHERE NOT EXISTS (
+        SELECT 1 FROM t_p45110186_greeting_project_202.users u
+        WHERE u.referral_code = c.code
+    )
+    ON CONFLICT (code) DO NOTHING;
+
+    GET DIAGNOSTICS added = ROW_COUNT;
+    RETURN added;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT t_p45110186_greeting_project_202.refill_referral_code_pool(10000);
@@ -0,0 +1,10 @@
+-- Отзыв сессионных токенов (shared/session.py): токены пользователя,
+-- выданные до revoked_at, отклоняются. Хранятся только записи моложе
+-- срока жизни токена, поэтому таблица остаётся маленькой
+CREATE TABLE IF NOT EXISTS t_p45110186_greeting_project_202.session_revocations (
+    user_id INTEGER PRIMARY KEY REFERENCES t_p45110186_greeting_project_202.users(id) ON DELETE CASCADE,
+    revoked_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_session_revocations_revoked_at
+    ON t_p45110186_greeting_project_202.session_revocations (revoked_at);
@@ -0,0 +1,36 @@
+-- Массовый импорт пользователей (tools/import_users.py) вставляет сотни
+-- тысяч строк одним оператором; построчное обновление admin_counters
+-- превратило бы это в столько же UPDATE одной строки. Импорт выставляет
+-- SET LOCAL app.bulk_import = 'on' и сам добавляет итоговые приращения
+CREATE OR REPLACE FUNCTION t_p45110186_greeting_project_202.count_users()
+RETURNS TRIGGER AS $$
+DECLARE
+    d_total INTEGER := 0;
+    d_banned INTEGER := 0;
+    d_vip INTEGER := 0;
+    d_balance NUMERIC := 0;
+BEGIN
+    IF current_setting('app.bulk_import', TRUE) = 'on' THEN
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        d_total := d_total + 1;
+        d_banned := d_banned + NEW.is_banned::INTEGER;
+        d_vip := d_vip + NEW.is_vip::INTEGER;
+        d_balance := d_balance + COALESCE(NEW.balance, 0);
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        d_total := d_total - 1;
+        d_banned := d_banned - OLD.is_banned::INTEGER;
+        d_vip := d_vip - OLD.is_vip::INTEGER;
+        d_balance := d_balance - COALESCE(OLD.balance, 0);
+    END IF;
+
+    PERFORM t_p45110186_greeting_project_202.add_admin_counter('users_total', d_total);
+    PERFORM t_p45110186_greeting_project_202.add_admin_counter('users_banned', d_banned);
+    PERFORM t_p45110186_greeting_project_202.add_admin_counter('users_vip', d_vip);
+    PERFORM t_p45110186_greeting_project_202.add_admin_counter('users_balance', d_balance);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
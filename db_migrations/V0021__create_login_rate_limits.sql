@@ -0,0 +1,12 @@
+-- Общий счётчик попыток входа для нескольких экземпляров функций
+-- (shared/ratelimit.py, LOGIN_RATE_SHARED=1): фиксированные окна по ключу.
+-- UNLOGGED: потеря счётчиков при сбое сервера допустима, а запись без WAL дешевле
+CREATE UNLOGGED TABLE IF NOT EXISTS t_p45110186_greeting_project_202.login_rate_limits (
+    key VARCHAR(200) NOT NULL,
+    window_start TIMESTAMPTZ NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (key, window_start)
+);
+
+CREATE INDEX IF NOT EXISTS idx_login_rate_limits_window_start
+    ON t_p45110186_greeting_project_202.login_rate_limits (window_start);
@@ -0,0 +1,46 @@
+-- Переходы по реферальным ссылкам пишутся сюда только вставками, без
+-- блокировки строки реферера в users. Периодическая агрегация
+-- (aggregate_referral_clicks) переносит их в users.referral_clicks пачками
+CREATE TABLE IF NOT EXISTS t_p45110186_greeting_project_202.referral_click_events (
+    id BIGSERIAL PRIMARY KEY,
+    ref_user_id INTEGER NOT NULL,
+    visitor_ip VARCHAR(45),
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Для «счётчик + ещё не агрегированные» в статистике реферера
+CREATE INDEX IF NOT EXISTS idx_referral_click_events_ref_user_id
+    ON t_p45110186_greeting_project_202.referral_click_events (ref_user_id);
+
+-- Переносит до batch_size событий в счётчики; возвращает число перенесённых.
+-- SKIP LOCKED позволяет запускать несколько агрегаторов одновременно.
+-- Клики по несуществующим пользователям просто удаляются
+CREATE OR REPLACE FUNCTION t_p45110186_greeting_project_202.aggregate_referral_clicks(batch_size INTEGER)
+RETURNS INTEGER AS $$
+DECLARE
+    moved INTEGER;
+BEGIN
+    WITH batch AS (
+        DELETE FROM t_p45110186_greeting_project_202.referral_click_events
+        WHERE id IN (
+            SELECT id FROM t_p45110186_greeting_project_202.referral_click_events
+            ORDER BY id
+            LIMIT batch_size
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING ref_user_id
+    ),
+    counts AS (
+        SELECT ref_user_id, COUNT(*) AS clicks FROM batch GROUP BY ref_user_id
+    ),
+    updated AS (
+        UPDATE t_p45110186_greeting_project_202.users u
+        SET referral_clicks = COALESCE(u.referral_clicks, 0) + c.clicks
+        FROM counts c
+        WHERE u.id = c.ref_user_id
+    )
+    SELECT COUNT(*) INTO moved FROM batch;
+
+    RETURN moved;
+END;
+$$ LANGUAGE plpgsql;
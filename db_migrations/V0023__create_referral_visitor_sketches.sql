@@ -0,0 +1,118 @@
+-- Уникальные посетители реферальных ссылок: по одному HyperLogLog-скетчу
+-- (1024 регистра по байту, ~3% погрешности) на реферера и сутки.
+-- IP в скетче не хранятся, а сами события удаляются после агрегации
+CREATE TABLE IF NOT EXISTS t_p45110186_greeting_project_202.referral_visitor_sketches (
+    ref_user_id INTEGER NOT NULL,
+    day DATE NOT NULL,
+    sketch BYTEA NOT NULL,
+    PRIMARY KEY (ref_user_id, day)
+);
+
+-- Добавляет значение в скетч; NULL-скетч считается пустым
+CREATE OR REPLACE FUNCTION t_p45110186_greeting_project_202.hll_add(sketch BYTEA, value TEXT)
+RETURNS BYTEA AS $$
+DECLARE
+    h BIGINT;
+    register INTEGER;
+    rank INTEGER;
+BEGIN
+    IF value IS NULL THEN
+        RETURN sketch;
+    END IF;
+    IF sketch IS NULL THEN
+        sketch := decode(repeat('00', 1024), 'hex');
+    END IF;
+
+    h := ('x' || substr(md5(value), 1, 16))::BIT(64)::BIGINT;
+    -- Младшие 10 бит выбирают регистр, в остальных 54 ищем первую единицу
+    register := (h & 1023)::INTEGER;
+    rank := 55 - length(ltrim((h >> 10)::BIT(54)::TEXT, '0'));
+
+    IF get_byte(sketch, register) < rank THEN
+        sketch := set_byte(sketch, register, rank);
+    END IF;
+    RETURN sketch;
+END;
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+-- Объединение скетчей: максимум по каждому регистру
+CREATE OR REPLACE FUNCTION t_p45110186_greeting_project_202.hll_merge(a BYTEA, b BYTEA)
+RETURNS BYTEA AS $$
+    SELECT CASE
+        WHEN a IS NULL THEN b
+        WHEN b IS NULL THEN a
+        ELSE (
+            SELECT decode(string_agg(lpad(to_hex(greatest(get_byte(a, i), get_byte(b, i))), 2, '0'), '' ORDER BY i), 'hex')
+            FROM generate_series(0, 1023) AS i
+        )
+    END
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Оценка числа различных значений; пустой скетч — 0
+CREATE OR REPLACE FUNCTION t_p45110186_greeting_project_202.hll_estimate(sketch BYTEA)
+RETURNS BIGINT AS $$
+    SELECT CASE
+        WHEN sketch IS NULL THEN 0
+        -- Поправка для малых значений: linear counting по пустым регистрам
+        WHEN raw <= 2.5 * 1024 AND zeros > 0 THEN round(1024 * ln(1024.0 / zeros))::BIGINT
+        ELSE round(raw)::BIGINT
+    END
+    FROM (
+        SELECT 0.7213 / (1 + 1.079 / 1024) * 1024 * 1024 / sum(power(2.0, -get_byte(sketch, i))) AS raw,
+               count(*) FILTER (WHERE get_byte(sketch, i) = 0) AS zeros
+        FROM generate_series(0, 1023) AS i
+    ) AS registers
+$$ LANGUAGE sql IMMUTABLE;
+
+DROP AGGREGATE IF EXISTS t_p45110186_greeting_project_202.hll_agg(TEXT);
+CREATE AGGREGATE t_p45110186_greeting_project_202.hll_agg(TEXT) (
+    SFUNC = t_p45110186_greeting_project_202.hll_add,
+    STYPE = BYTEA
+);
+
+DROP AGGREGATE IF EXISTS t_p45110186_greeting_project_202.hll_union(BYTEA);
+CREATE AGGREGATE t_p45110186_greeting_project_202.hll_union(BYTEA) (
+    SFUNC = t_p45110186_greeting_project_202.hll_merge,
+    STYPE = BYTEA
+);
+
+-- Агрегация кликов (V0022) теперь ещё и складывает IP посетителей в
+-- суточные скетчи — в той же пачке, без отдельного запроса на клик
+CREATE OR REPLACE FUNCTION t_p45110186_greeting_project_202.aggregate_referral_clicks(batch_size INTEGER)
+RETURNS INTEGER AS $$
+DECLARE
+    moved INTEGER;
+BEGIN
+    WITH batch AS (
+        DELETE FROM t_p45110186_greeting_project_202.referral_click_events
+        WHERE id IN (
+            SELECT id FROM t_p45110186_greeting_project_202.referral_click_events
+            ORDER BY id
+            LIMIT batch_size
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING ref_user_id, visitor_ip, created_at
+    ),
+    counts AS (
+        SELECT ref_user_id, COUNT(*) AS clicks FROM batch GROUP BY ref_user_id
+    ),
+    updated AS (
+        UPDATE t_p45110186_greeting_project_202.users u
+        SET referral_clicks = COALESCE(u.referral_clicks, 0) + c.clicks
+        FROM counts c
+        WHERE u.id = c.ref_user_id
+    ),
+    sketched AS (
+        INSERT INTO t_p45110186_greeting_project_202.referral_visitor_sketches AS s (ref_user_id, day, sketch)
+        SELECT ref_user_id, created_at::DATE, t_p45110186_greeting_project_202.hll_agg(visitor_ip)
+        FROM batch
+        WHERE visitor_ip IS NOT NULL
+        GROUP BY ref_user_id, created_at::DATE
+        ON CONFLICT (ref_user_id, day) DO UPDATE
+        SET sketch = t_p45110186_greeting_project_202.hll_merge(s.sketch, EXCLUDED.sketch)
+    )
+    SELECT COUNT(*) INTO moved FROM batch;
+
+    RETURN moved;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,124 @@
+-- Статистика рефереров по часам и по суткам для графиков. Клики попадают
+-- сюда при агрегации referral_click_events, регистрации — триггером на
+-- users.referred_by; график читает несколько готовых строк вместо
+-- сканирования событий
+CREATE TABLE IF NOT EXISTS t_p45110186_greeting_project_202.referral_stats_hourly (
+    ref_user_id INTEGER NOT NULL,
+    bucket TIMESTAMP NOT NULL,
+    clicks INTEGER NOT NULL DEFAULT 0,
+    registrations INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (ref_user_id, bucket)
+);
+
+CREATE TABLE IF NOT EXISTS t_p45110186_greeting_project_202.referral_stats_daily (
+    ref_user_id INTEGER NOT NULL,
+    day DATE NOT NULL,
+    clicks INTEGER NOT NULL DEFAULT 0,
+    registrations INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (ref_user_id, day)
+);
+
+-- Регистрация считается, когда у пользователя появляется или меняется
+-- referred_by. Повторный track_registration с тем же реферером (после
+-- регистрации через auth) не засчитывается. Массовый импорт пропускается:
+-- это не новые регистрации
+CREATE OR REPLACE FUNCTION t_p45110186_greeting_project_202.count_referral_registration()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF current_setting('app.bulk_import', TRUE) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    IF NEW.referred_by IS NULL THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'UPDATE' AND OLD.referred_by IS NOT DISTINCT FROM NEW.referred_by THEN
+        RETURN NULL;
+    END IF;
+
+    INSERT INTO t_p45110186_greeting_project_202.referral_stats_hourly AS h (ref_user_id, bucket, registrations)
+    VALUES (NEW.referred_by, date_trunc('hour', CURRENT_TIMESTAMP::TIMESTAMP), 1)
+    ON CONFLICT (ref_user_id, bucket) DO UPDATE SET registrations = h.registrations + 1;
+
+    INSERT INTO t_p45110186_greeting_project_202.referral_stats_daily AS d (ref_user_id, day, registrations)
+    VALUES (NEW.referred_by, CURRENT_DATE, 1)
+    ON CONFLICT (ref_user_id, day) DO UPDATE SET registrations = d.registrations + 1;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_users_referral_stats ON t_p45110186_greeting_project_202.users;
+CREATE TRIGGER trg_users_referral_stats
+    AFTER INSERT OR UPDATE OF referred_by ON t_p45110186_greeting_project_202.users
+    FOR EACH ROW EXECUTE FUNCTION t_p45110186_greeting_project_202.count_referral_registration();
+
+-- Регистрации из истории: дата создания приглашённого пользователя.
+-- Клики до этой миграции известны только общим числом и в графики не попадают
+INSERT INTO t_p45110186_greeting_project_202.referral_stats_daily (ref_user_id, day, registrations)
+SELECT referred_by, created_at::DATE, COUNT(*)
+FROM t_p45110186_greeting_project_202.users
+WHERE referred_by IS NOT NULL AND created_at IS NOT NULL
+GROUP BY referred_by, created_at::DATE
+ON CONFLICT (ref_user_id, day) DO NOTHING;
+
+INSERT INTO t_p45110186_greeting_project_202.referral_stats_hourly (ref_user_id, bucket, registrations)
+SELECT referred_by, date_trunc('hour', created_at), COUNT(*)
+FROM t_p45110186_greeting_project_202.users
+WHERE referred_by IS NOT NULL AND created_at > CURRENT_TIMESTAMP - INTERVAL '31 days'
+GROUP BY referred_by, date_trunc('hour', created_at)
+ON CONFLICT (ref_user_id, bucket) DO NOTHING;
+
+-- Агрегация кликов (V0022, V0023) дополнительно раскладывает пачку по
+-- часовым и суточным корзинам
+CREATE OR REPLACE FUNCTION t_p45110186_greeting_project_202.aggregate_referral_clicks(batch_size INTEGER)
+RETURNS INTEGER AS $$
+DECLARE
+    moved INTEGER;
+BEGIN
+    WITH batch AS (
+        DELETE FROM t_p45110186_greeting_project_202.referral_click_events
+        WHERE id IN (
+            SELECT id FROM t_p45110186_greeting_project_202.referral_click_events
+            ORDER BY id
+            LIMIT batch_size
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING ref_user_id, visitor_ip, created_at
+    ),
+    counts AS (
+        SELECT ref_user_id, COUNT(*) AS clicks FROM batch GROUP BY ref_user_id
+    ),
+    updated AS (
+        UPDATE t_p45110186_greeting_project_202.users u
+        SET referral_clicks = COALESCE(u.referral_clicks, 0) + c.clicks
+        FROM counts c
+        WHERE u.id = c.ref_user_id
+    ),
+    sketched AS (
+        INSERT INTO t_p45110186_greeting_project_202.referral_visitor_sketches AS s (ref_user_id, day, sketch)
+        SELECT ref_user_id, created_at::DATE, t_p45110186_greeting_project_202.hll_agg(visitor_ip)
+        FROM batch
+        WHERE visitor_ip IS NOT NULL
+        GROUP BY ref_user_id, created_at::DATE
+        ON CONFLICT (ref_user_id, day) DO UPDATE
+        SET sketch = t_p45110186_greeting_project_202.hll_merge(s.sketch, EXCLUDED.sketch)
+    ),
+    hourly AS (
+        INSERT INTO t_p45110186_greeting_project_202.referral_stats_hourly AS h (ref_user_id, bucket, clicks)
+        SELECT ref_user_id, date_trunc('hour', created_at), COUNT(*)
+        FROM batch
+        GROUP BY ref_user_id, date_trunc('hour', created_at)
+        ON CONFLICT (ref_user_id, bucket) DO UPDATE SET clicks = h.clicks + EXCLUDED.clicks
+    ),
+    daily AS (
+        INSERT INTO t_p45110186_greeting_project_202.referral_stats_daily AS d (ref_user_id, day, clicks)
+        SELECT ref_user_id, created_at::DATE, COUNT(*)
+        FROM batch
+        GROUP BY ref_user_id, created_at::DATE
+        ON CONFLICT (ref_user_id, day) DO UPDATE SET clicks = d.clicks + EXCLUDED.clicks
+    )
+    SELECT COUNT(*) INTO moved FROM batch;
+
+    RETURN moved;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,22 @@
+-- Снимок рейтинга рефереров. Сортировка всех users по referral_count
+-- выполняется только при обновлении (tools/refresh_referral_leaderboard.py),
+-- а страница рейтинга и «ваше место» читают готовые строки по индексам.
+-- Заблокированные и пользователи без приглашённых в рейтинг не попадают
+CREATE MATERIALIZED VIEW IF NOT EXISTS t_p45110186_greeting_project_202.referral_leaderboard AS
+SELECT
+    RANK() OVER (ORDER BY referral_count DESC) AS rank,
+    id AS user_id,
+    username,
+    referral_count,
+    NOW() AS refreshed_at
+FROM t_p45110186_greeting_project_202.users
+WHERE referral_count > 0 AND is_banned IS NOT TRUE
+WITH DATA;
+
+-- Уникальный индекс нужен для REFRESH MATERIALIZED VIEW CONCURRENTLY
+-- и для поиска места пользователя
+CREATE UNIQUE INDEX IF NOT EXISTS idx_referral_leaderboard_user_id
+    ON t_p45110186_greeting_project_202.referral_leaderboard (user_id);
+
+CREATE INDEX IF NOT EXISTS idx_referral_leaderboard_rank
+    ON t_p45110186_greeting_project_202.referral_leaderboard (rank, user_id);
@@ -0,0 +1,98 @@
+-- Дерево рефералов как closure table: строка на каждую пару
+-- (предок, потомок) с глубиной 1..10. Численность уровней и списки
+-- приглашённых на уровне N читаются по индексу без рекурсии по users.
+-- Глубина ограничена, чтобы регистрация добавляла не больше 10 строк
+CREATE TABLE IF NOT EXISTS t_p45110186_greeting_project_202.referral_tree (
+    ancestor_id INTEGER NOT NULL,
+    descendant_id INTEGER NOT NULL,
+    depth SMALLINT NOT NULL,
+    PRIMARY KEY (ancestor_id, descendant_id)
+);
+
+-- Уровни и списки приглашённых по уровню
+CREATE INDEX IF NOT EXISTS idx_referral_tree_ancestor_depth
+    ON t_p45110186_greeting_project_202.referral_tree (ancestor_id, depth, descendant_id);
+
+-- Предки пользователя при перестройке ветки
+CREATE INDEX IF NOT EXISTS idx_referral_tree_descendant
+    ON t_p45110186_greeting_project_202.referral_tree (descendant_id);
+
+-- При появлении или смене referred_by ветка пользователя (он сам и его
+-- потомки) отцепляется от старых предков и подвешивается к новым
+CREATE OR REPLACE FUNCTION t_p45110186_greeting_project_202.maintain_referral_tree()
+RETURNS TRIGGER AS $$
+DECLARE
+    max_depth CONSTANT INTEGER := 10;
+BEGIN
+    IF TG_OP = 'UPDATE' AND OLD.referred_by IS NOT DISTINCT FROM NEW.referred_by THEN
+        RETURN NULL;
+    END IF;
+
+    IF NEW.referred_by IS NOT NULL AND (
+        NEW.referred_by = NEW.id OR EXISTS (
+            SELECT 1 FROM t_p45110186_greeting_project_202.referral_tree
+            WHERE ancestor_id = NEW.id AND descendant_id = NEW.referred_by
+        )
+    ) THEN
+        RAISE EXCEPTION 'referral cycle: user % cannot be referred by %', NEW.id, NEW.referred_by;
+    END IF;
+
+    IF TG_OP = 'UPDATE' AND OLD.referred_by IS NOT NULL THEN
+        DELETE FROM t_p45110186_greeting_project_202.referral_tree t
+        WHERE t.ancestor_id IN (
+                SELECT ancestor_id FROM t_p45110186_greeting_project_202.referral_tree
+                WHERE descendant_id = NEW.id
+            )
+          AND (t.descendant_id = NEW.id OR t.descendant_id IN (
+                SELECT descendant_id FROM t_p45110186_greeting_project_202.referral_tree
+                WHERE ancestor_id = NEW.id
+            ));
+    END IF;
+
+    IF NEW.referred_by IS NOT NULL THEN
+        INSERT INTO t_p45110186_greeting_project_202.referral_tree (ancestor_id, descendant_id, depth)
+        SELECT a.ancestor_id, d.descendant_id, a.depth + d.depth + 1
+        FROM (
+            SELECT NEW.referred_by AS ancestor_id, 0 AS depth
+            UNION ALL
+            SELECT ancestor_id, depth FROM t_p45110186_greeting_project_202.referral_tree
+            WHERE descendant_id = NEW.referred_by
+        ) a
+        CROSS JOIN (
+            SELECT NEW.id AS descendant_id, 0 AS depth
+            UNION ALL
+            SELECT descendant_id, depth FROM t_p45110186_greeting_project_202.referral_tree
+            WHERE ancestor_id = NEW.id
+        ) d
+        WHERE a.depth + d.depth + 1 <= max_depth
+        ON CONFLICT (ancestor_id, descendant_id) DO UPDATE SET depth = EXCLUDED.depth;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_users_referral_tree ON t_p45110186_greeting_project_202.users;
+CREATE TRIGGER trg_users_referral_tree
+    AFTER INSERT OR UPDATE OF referred_by ON t_p45110186_greeting_project_202.users
+    FOR EACH ROW EXECUTE FUNCTION t_p45110186_greeting_project_202.maintain_referral_tree();
+
+-- Дерево из уже существующих связей. visited защищает от циклов в старых
+-- данных (новые триггер не допускает)
+INSERT INTO t_p45110186_greeting_project_202.referral_tree (ancestor_id, descendant_id, depth)
+WITH RECURSIVE paths (ancestor_id, descendant_id, depth, visited) AS (
+    SELECT referred_by, id, 1, ARRAY[referred_by, id]
+    FROM t_p45110186_greeting_project_202.users
+    WHERE referred_by IS NOT NULL AND referred_by <> id
+    UNION ALL
+    SELECT u.referred_by, p.descendant_id, p.depth + 1, p.visited || u.referred_by
+    FROM paths p
+    JOIN t_p45110186_greeting_project_202.users u ON u.id = p.ancestor_id
+    WHERE u.referred_by IS NOT NULL
+      AND p.depth < 10
+      AND u.referred_by <> ALL (p.visited)
+)
+SELECT ancestor_id, descendant_id, MIN(depth)
+FROM paths
+GROUP BY ancestor_id, descendant_id
+ON CONFLICT (ancestor_id, descendant_id) DO NOTHING;
@@ -0,0 +1,6 @@
+-- Заявка на вывод теперь сразу резервирует сумму: баланс списывается
+-- при создании, отклонение возвращает его. Заявки, созданные до этой
+-- миграции, ничего не резервировали (reserved = FALSE) — при одобрении
+-- сумма по ним списывается, как раньше
+ALTER TABLE t_p45110186_greeting_project_202.withdrawal_requests
+ADD COLUMN IF NOT EXISTS reserved BOOLEAN NOT NULL DEFAULT FALSE;
@@ -0,0 +1,24 @@
+-- Очередь заявок на вывод для нескольких администраторов: «взять следующие
+-- N» выдаёт заявки в аренду (claimed_by до claimed_until) через
+-- FOR UPDATE SKIP LOCKED, так что двое не получат одну заявку и не ждут
+-- блокировок друг друга. Аренда истекает сама, если заявку не обработали
+ALTER TABLE t_p45110186_greeting_project_202.withdrawal_requests
+ADD COLUMN IF NOT EXISTS claimed_by INTEGER;
+
+ALTER TABLE t_p45110186_greeting_project_202.withdrawal_requests
+ADD COLUMN IF NOT EXISTS claimed_until TIMESTAMP;
+
+-- Приоритет фиксируется при создании заявки: 1 — VIP, 0 — остальные
+ALTER TABLE t_p45110186_greeting_project_202.withdrawal_requests
+ADD COLUMN IF NOT EXISTS priority SMALLINT NOT NULL DEFAULT 0;
+
+UPDATE t_p45110186_greeting_project_202.withdrawal_requests w
+SET priority = 1
+FROM t_p45110186_greeting_project_202.users u
+WHERE w.status = 'pending' AND u.id = w.user_id AND u.is_vip;
+
+-- Порядок выдачи: сначала VIP, затем самые старые. Индекс содержит только
+-- ожидающие заявки и не растёт с историей
+CREATE INDEX IF NOT EXISTS idx_withdrawal_requests_pending_queue
+    ON t_p45110186_greeting_project_202.withdrawal_requests (priority DESC, created_at, id)
+    WHERE status = 'pending';
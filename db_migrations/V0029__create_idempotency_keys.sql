@@ -0,0 +1,18 @@
+-- Ответы на заявки, присланные с заголовком Idempotency-Key
+-- (shared/idempotency.py). Повтор запроса отвечает из этой таблицы по
+-- первичному ключу; status_code = NULL — заявка сохранена, ответ ещё
+-- не записан
+CREATE TABLE IF NOT EXISTS t_p45110186_greeting_project_202.idempotency_keys (
+    scope VARCHAR(50) NOT NULL,
+    key VARCHAR(255) NOT NULL,
+    fingerprint CHAR(64) NOT NULL,
+    status_code SMALLINT,
+    response TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (scope, key)
+);
+
+-- Для удаления истёкших записей
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires_at
+    ON t_p45110186_greeting_project_202.idempotency_keys (expires_at);
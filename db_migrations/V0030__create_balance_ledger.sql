@@ -0,0 +1,155 @@
+-- Журнал движений баланса: только вставки, каждая строка — знаковое
+-- изменение с видом операции. users.balance остаётся кэшем текущего
+-- значения и поддерживается триггерами так, что сумма журнала по
+-- пользователю всегда равна его балансу:
+--   * вставка в журнал (пополнение, вывод, корректировка админом)
+--     применяется к users.balance триггером apply_balance_entry;
+--   * прямое изменение users.balance в обход журнала записывается в журнал
+--     как 'direct' (или 'opening' для нового пользователя) триггером
+--     record_balance_change.
+-- pg_trigger_depth() отличает одно от другого, чтобы изменение не
+-- применялось дважды. При массовом импорте (app.bulk_import) оба триггера
+-- пропускаются, импорт сам пишет строки 'opening'
+CREATE TABLE IF NOT EXISTS t_p45110186_greeting_project_202.balance_ledger (
+    id BIGSERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    delta NUMERIC NOT NULL,
+    kind VARCHAR(30) NOT NULL,
+    reference_id INTEGER,
+    note TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- История пользователя и суммы «после снимка» — диапазон по (user_id, id)
+CREATE INDEX IF NOT EXISTS idx_balance_ledger_user_id
+    ON t_p45110186_greeting_project_202.balance_ledger (user_id, id);
+
+-- Периодические снимки: баланс пользователя по журналу до ledger_id
+-- включительно. Текущий баланс = последний снимок + движения после него
+CREATE TABLE IF NOT EXISTS t_p45110186_greeting_project_202.balance_snapshots (
+    user_id INTEGER NOT NULL,
+    ledger_id BIGINT NOT NULL,
+    balance NUMERIC NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, ledger_id)
+);
+
+-- Граница последнего снятия снимков
+CREATE INDEX IF NOT EXISTS idx_balance_snapshots_ledger_id
+    ON t_p45110186_greeting_project_202.balance_snapshots (ledger_id);
+
+-- Начальные остатки до создания триггеров, чтобы они не применились повторно
+INSERT INTO t_p45110186_greeting_project_202.balance_ledger (user_id, delta, kind, note)
+SELECT id, balance, 'opening', 'баланс при переходе на журнал'
+FROM t_p45110186_greeting_project_202.users
+WHERE COALESCE(balance, 0) <> 0
+  AND NOT EXISTS (SELECT 1 FROM t_p45110186_greeting_project_202.balance_ledger);
+
+CREATE OR REPLACE FUNCTION t_p45110186_greeting_project_202.apply_balance_entry()
+RETURNS TRIGGER AS $$
+BEGIN
+    -- Запись сделана record_balance_change: баланс уже изменён
+    IF pg_trigger_depth() > 1 OR current_setting('app.bulk_import', TRUE) = 'on' THEN
+        RETURN NULL;
+    END IF;
+
+    UPDATE t_p45110186_greeting_project_202.users
+    SET balance = COALESCE(balance, 0) + NEW.delta
+    WHERE id = NEW.user_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION t_p45110186_greeting_project_202.record_balance_change()
+RETURNS TRIGGER AS $$
+DECLARE
+    delta NUMERIC;
+BEGIN
+    -- Изменение пришло из apply_balance_entry: строка журнала уже есть
+    IF pg_trigger_depth() > 1 OR current_setting('app.bulk_import', TRUE) = 'on' THEN
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP = 'INSERT' THEN
+        delta := COALESCE(NEW.balance, 0);
+    ELSE
+        delta := COALESCE(NEW.balance, 0) - COALESCE(OLD.balance, 0);
+    END IF;
+    IF delta = 0 THEN
+        RETURN NULL;
+    END IF;
+
+    INSERT INTO t_p45110186_greeting_project_202.balance_ledger (user_id, delta, kind)
+    VALUES (NEW.id, delta, CASE WHEN TG_OP = 'INSERT' THEN 'opening' ELSE 'direct' END);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_balance_ledger_apply ON t_p45110186_greeting_project_202.balance_ledger;
+CREATE TRIGGER trg_balance_ledger_apply
+    AFTER INSERT ON t_p45110186_greeting_project_202.balance_ledger
+    FOR EACH ROW EXECUTE FUNCTION t_p45110186_greeting_project_202.apply_balance_entry();
+
+DROP TRIGGER IF EXISTS trg_users_balance_ledger ON t_p45110186_greeting_project_202.users;
+CREATE TRIGGER trg_users_balance_ledger
+    AFTER INSERT OR UPDATE OF balance ON t_p45110186_greeting_project_202.users
+    FOR EACH ROW EXECUTE FUNCTION t_p45110186_greeting_project_202.record_balance_change();
+
+-- Снимки для пользователей с движениями после прошлого снятия; возвращает
+-- число снимков. Берутся только записи старше settle_seconds: BIGSERIAL
+-- выдаёт id до коммита, и запись из ещё открытой транзакции могла бы
+-- оказаться ниже границы уже после снятия
+CREATE OR REPLACE FUNCTION t_p45110186_greeting_project_202.take_balance_snapshots(settle_seconds INTEGER DEFAULT 60)
+RETURNS INTEGER AS $$
+DECLARE
+    watermark BIGINT;
+    upto BIGINT;
+    taken INTEGER;
+BEGIN
+    SELECT COALESCE(MAX(ledger_id), 0) INTO watermark
+    FROM t_p45110186_greeting_project_202.balance_snapshots;
+
+    SELECT MAX(id) INTO upto
+    FROM t_p45110186_greeting_project_202.balance_ledger
+    WHERE id > watermark AND created_at < NOW() - make_interval(secs => settle_seconds);
+
+    IF upto IS NULL THEN
+        RETURN 0;
+    END IF;
+
+    INSERT INTO t_p45110186_greeting_project_202.balance_snapshots (user_id, ledger_id, balance)
+    SELECT m.user_id, upto, COALESCE(s.balance, 0) + (
+               SELECT SUM(l.delta) FROM t_p45110186_greeting_project_202.balance_ledger l
+               WHERE l.user_id = m.user_id AND l.id > COALESCE(s.ledger_id, 0) AND l.id <= upto
+           )
+    FROM (
+        SELECT DISTINCT user_id FROM t_p45110186_greeting_project_202.balance_ledger
+        WHERE id > watermark AND id <= upto
+    ) m
+    LEFT JOIN LATERAL (
+        SELECT ledger_id, balance FROM t_p45110186_greeting_project_202.balance_snapshots
+        WHERE user_id = m.user_id
+        ORDER BY ledger_id DESC
+        LIMIT 1
+    ) s ON TRUE;
+
+    GET DIAGNOSTICS taken = ROW_COUNT;
+    RETURN taken;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Баланс по журналу: последний снимок + движения после него
+CREATE OR REPLACE FUNCTION t_p45110186_greeting_project_202.ledger_balance(target_user_id INTEGER)
+RETURNS NUMERIC AS $$
+    SELECT COALESCE(s.balance, 0) + COALESCE((
+               SELECT SUM(l.delta) FROM t_p45110186_greeting_project_202.balance_ledger l
+               WHERE l.user_id = target_user_id AND l.id > COALESCE(s.ledger_id, 0)
+           ), 0)
+    FROM (SELECT 1) AS one
+    LEFT JOIN LATERAL (
+        SELECT ledger_id, balance FROM t_p45110186_greeting_project_202.balance_snapshots
+        WHERE user_id = target_user_id
+        ORDER BY ledger_id DESC
+        LIMIT 1
+    ) s ON TRUE
+$$ LANGUAGE sql STABLE;
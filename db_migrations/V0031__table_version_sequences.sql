@@ -0,0 +1,45 @@
+-- Версии таблиц для ETag (V0014) хранились в одной строке table_versions
+-- на таблицу: каждый оператор над users обновлял её и держал блокировку
+-- до коммита, так что все записи в users выстраивались в очередь за этой
+-- строкой. Теперь версия — последовательность: nextval не блокирует и не
+-- ждёт других транзакций
+CREATE SEQUENCE IF NOT EXISTS t_p45110186_greeting_project_202.users_version_seq;
+CREATE SEQUENCE IF NOT EXISTS t_p45110186_greeting_project_202.withdrawal_requests_version_seq;
+
+-- Отложенный триггер выдаёт новую версию при коммите, а не в начале
+-- транзакции: читатель, увидевший новую версию, почти сразу видит и
+-- данные. Окно остаётся только между триггером и фиксацией коммита
+CREATE OR REPLACE FUNCTION t_p45110186_greeting_project_202.bump_table_version_seq()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM nextval(TG_ARGV[0]::regclass);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_users_version ON t_p45110186_greeting_project_202.users;
+DROP TRIGGER IF EXISTS trg_withdrawal_requests_version ON t_p45110186_greeting_project_202.withdrawal_requests;
+
+-- Только столбцы, которые отдают кэшируемые списки players, admin и
+-- withdrawals: клики, referred_by, пароли и аренды заявок ETag не меняют
+CREATE CONSTRAINT TRIGGER trg_users_version
+    AFTER INSERT OR DELETE OR UPDATE OF
+        username, balance, referral_count, created_at, is_banned, ban_reason,
+        is_vip, vip_expires_at, telegram_username, last_login_at, is_pinned
+    ON t_p45110186_greeting_project_202.users
+    DEFERRABLE INITIALLY DEFERRED
+    FOR EACH ROW EXECUTE FUNCTION t_p45110186_greeting_project_202.bump_table_version_seq(
+        't_p45110186_greeting_project_202.users_version_seq'
+    );
+
+CREATE CONSTRAINT TRIGGER trg_withdrawal_requests_version
+    AFTER INSERT OR DELETE OR UPDATE OF
+        user_id, username, amount, network, wallet_address, status, processed_at, admin_note
+    ON t_p45110186_greeting_project_202.withdrawal_requests
+    DEFERRABLE INITIALLY DEFERRED
+    FOR EACH ROW EXECUTE FUNCTION t_p45110186_greeting_project_202.bump_table_version_seq(
+        't_p45110186_greeting_project_202.withdrawal_requests_version_seq'
+    );
+
+DROP FUNCTION IF EXISTS t_p45110186_greeting_project_202.bump_table_version();
+DROP TABLE IF EXISTS t_p45110186_greeting_project_202.table_versions;
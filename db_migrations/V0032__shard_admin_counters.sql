@@ -0,0 +1,66 @@
+-- Счётчики админки (V0016) были одной строкой на счётчик: построчные
+-- триггеры на users и заявках обновляли её и держали блокировку до
+-- коммита, так что параллельные записи выстраивались в очередь. Теперь
+-- у счётчика 16 строк-шардов; приращение попадает в шард своего
+-- соединения, значение — сумма шардов
+ALTER TABLE t_p45110186_greeting_project_202.admin_counters
+    ADD COLUMN IF NOT EXISTS shard SMALLINT NOT NULL DEFAULT 0;
+
+ALTER TABLE t_p45110186_greeting_project_202.admin_counters
+    DROP CONSTRAINT IF EXISTS admin_counters_pkey;
+ALTER TABLE t_p45110186_greeting_project_202.admin_counters
+    ADD PRIMARY KEY (name, shard);
+
+-- Шард выбирается по pid соединения: транзакция не ждёт сама себя, а
+-- разные соединения почти всегда пишут в разные строки. Нулевые
+-- приращения по-прежнему пропускаются
+CREATE OR REPLACE FUNCTION t_p45110186_greeting_project_202.add_admin_counter(counter_name VARCHAR, delta NUMERIC)
+RETURNS VOID AS $$
+BEGIN
+    IF delta <> 0 THEN
+        INSERT INTO t_p45110186_greeting_project_202.admin_counters (name, shard, value)
+        VALUES (counter_name, pg_backend_pid() % 16, delta)
+        ON CONFLICT (name, shard) DO UPDATE
+        SET value = admin_counters.value + EXCLUDED.value, updated_at = CURRENT_TIMESTAMP;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Пересчёт сворачивает шарды: полное значение пишется в шард 0,
+-- остальные удаляются
+CREATE OR REPLACE FUNCTION t_p45110186_greeting_project_202.recount_admin_counters()
+RETURNS VOID AS $$
+BEGIN
+    DELETE FROM t_p45110186_greeting_project_202.admin_counters WHERE shard <> 0;
+
+    INSERT INTO t_p45110186_greeting_project_202.admin_counters (name, shard, value)
+    SELECT s.name, 0, s.value
+    FROM (
+        SELECT 'users_total' AS name, COUNT(*)::NUMERIC AS value
+        FROM t_p45110186_greeting_project_202.users
+        UNION ALL
+        SELECT 'users_banned', COUNT(*) FILTER (WHERE is_banned)
+        FROM t_p45110186_greeting_project_202.users
+        UNION ALL
+        SELECT 'users_vip', COUNT(*) FILTER (WHERE is_vip)
+        FROM t_p45110186_greeting_project_202.users
+        UNION ALL
+        SELECT 'users_balance', COALESCE(SUM(balance), 0)
+        FROM t_p45110186_greeting_project_202.users
+        UNION ALL
+        SELECT 'withdrawals_pending', COUNT(*)
+        FROM t_p45110186_greeting_project_202.withdrawal_requests
+        WHERE status = 'pending'
+        UNION ALL
+        SELECT 'vip_requests_pending', COUNT(*)
+        FROM t_p45110186_greeting_project_202.vip_requests
+        WHERE status = 'pending'
+        UNION ALL
+        SELECT 'support_unread_chats', COUNT(DISTINCT user_id)
+        FROM t_p45110186_greeting_project_202.support_messages
+        WHERE is_read IS NOT TRUE AND is_admin_reply IS NOT TRUE
+    ) s
+    ON CONFLICT (name, shard) DO UPDATE
+    SET value = EXCLUDED.value, updated_at = CURRENT_TIMESTAMP;
+END;
+$$ LANGUAGE plpgsql;
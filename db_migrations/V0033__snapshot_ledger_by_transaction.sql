@@ -0,0 +1,97 @@
+-- Снимки балансов (V0030) брали журнал до MAX(id) среди строк старше
+-- settle_seconds. BIGSERIAL выдаёт id до коммита: строка из транзакции,
+-- открытой дольше settle_seconds, оказывалась ниже уже снятой границы и
+-- навсегда выпадала из баланса по журналу. Теперь граница снимка —
+-- номер транзакции: каждая строка журнала помнит свою транзакцию, а снимок
+-- покрывает строки транзакций младше pg_snapshot_xmin — все они уже
+-- завершены, и новых строк ниже границы появиться не может
+ALTER TABLE t_p45110186_greeting_project_202.balance_ledger
+    ADD COLUMN IF NOT EXISTS txid xid8 NOT NULL DEFAULT pg_current_xact_id();
+
+-- Суммы и балансы в приложении целые (users.balance INTEGER): дробное
+-- изменение расходилось бы с кэшем в users
+ALTER TABLE t_p45110186_greeting_project_202.balance_ledger
+    ALTER COLUMN delta TYPE INTEGER USING round(delta)::INTEGER;
+
+-- Строки после снимка пользователя и новые строки для следующего снимка
+CREATE INDEX IF NOT EXISTS idx_balance_ledger_user_txid
+    ON t_p45110186_greeting_project_202.balance_ledger (user_id, txid);
+CREATE INDEX IF NOT EXISTS idx_balance_ledger_txid
+    ON t_p45110186_greeting_project_202.balance_ledger (txid);
+
+-- Старые снимки границы по транзакции не имеют; они производные и
+-- пересоздаются первым запуском tools/balance_snapshots.py
+DELETE FROM t_p45110186_greeting_project_202.balance_snapshots;
+
+ALTER TABLE t_p45110186_greeting_project_202.balance_snapshots
+    ADD COLUMN IF NOT EXISTS txid_bound xid8 NOT NULL;
+ALTER TABLE t_p45110186_greeting_project_202.balance_snapshots
+    DROP CONSTRAINT IF EXISTS balance_snapshots_pkey;
+ALTER TABLE t_p45110186_greeting_project_202.balance_snapshots
+    ADD PRIMARY KEY (user_id, txid_bound);
+
+DROP INDEX IF EXISTS t_p45110186_greeting_project_202.idx_balance_snapshots_ledger_id;
+CREATE INDEX IF NOT EXISTS idx_balance_snapshots_txid_bound
+    ON t_p45110186_greeting_project_202.balance_snapshots (txid_bound);
+
+DROP FUNCTION IF EXISTS t_p45110186_greeting_project_202.take_balance_snapshots(INTEGER);
+
+-- Снимки для пользователей с движениями после прошлого снятия; возвращает
+-- число снимков. Снимок покрывает строки с txid < txid_bound, ledger_id —
+-- последняя из них (для истории)
+CREATE OR REPLACE FUNCTION t_p45110186_greeting_project_202.take_balance_snapshots()
+RETURNS INTEGER AS $$
+DECLARE
+    bound xid8 := pg_snapshot_xmin(pg_current_snapshot());
+    watermark xid8;
+    taken INTEGER;
+BEGIN
+    SELECT txid_bound INTO watermark
+    FROM t_p45110186_greeting_project_202.balance_snapshots
+    ORDER BY txid_bound DESC
+    LIMIT 1;
+
+    IF watermark IS NOT NULL AND bound <= watermark THEN
+        RETURN 0;
+    END IF;
+
+    INSERT INTO t_p45110186_greeting_project_202.balance_snapshots (user_id, ledger_id, txid_bound, balance)
+    SELECT m.user_id, d.ledger_id, bound, COALESCE(s.balance, 0) + d.delta
+    FROM (
+        SELECT DISTINCT user_id FROM t_p45110186_greeting_project_202.balance_ledger
+        WHERE (watermark IS NULL OR txid >= watermark) AND txid < bound
+    ) m
+    LEFT JOIN LATERAL (
+        SELECT balance, txid_bound FROM t_p45110186_greeting_project_202.balance_snapshots
+        WHERE user_id = m.user_id
+        ORDER BY txid_bound DESC
+        LIMIT 1
+    ) s ON TRUE
+    CROSS JOIN LATERAL (
+        SELECT MAX(l.id) AS ledger_id, SUM(l.delta) AS delta
+        FROM t_p45110186_greeting_project_202.balance_ledger l
+        WHERE l.user_id = m.user_id
+          AND (s.txid_bound IS NULL OR l.txid >= s.txid_bound) AND l.txid < bound
+    ) d;
+
+    GET DIAGNOSTICS taken = ROW_COUNT;
+    RETURN taken;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Баланс по журналу: последний снимок + строки транзакций не ниже его границы
+CREATE OR REPLACE FUNCTION t_p45110186_greeting_project_202.ledger_balance(target_user_id INTEGER)
+RETURNS NUMERIC AS $$
+    SELECT COALESCE(s.balance, 0) + COALESCE((
+               SELECT SUM(l.delta) FROM t_p45110186_greeting_project_202.balance_ledger l
+               WHERE l.user_id = target_user_id
+                 AND (s.txid_bound IS NULL OR l.txid >= s.txid_bound)
+           ), 0)
+    FROM (SELECT 1) AS one
+    LEFT JOIN LATERAL (
+        SELECT txid_bound, balance FROM t_p45110186_greeting_project_202.balance_snapshots
+        WHERE user_id = target_user_id
+        ORDER BY txid_bound DESC
+        LIMIT 1
+    ) s ON TRUE
+$$ LANGUAGE sql STABLE;
@@ -0,0 +1,10 @@
+-- Ключи идемпотентности (V0029) были общими для всех пользователей одной
+-- заявки: чужой запрос с тем же Idempotency-Key получал сохранённый ответ
+-- первого. Теперь ключ принадлежит вызывающему (id из токена или userId)
+ALTER TABLE t_p45110186_greeting_project_202.idempotency_keys
+    ADD COLUMN IF NOT EXISTS owner VARCHAR(64) NOT NULL DEFAULT '';
+
+ALTER TABLE t_p45110186_greeting_project_202.idempotency_keys
+    DROP CONSTRAINT IF EXISTS idempotency_keys_pkey;
+ALTER TABLE t_p45110186_greeting_project_202.idempotency_keys
+    ADD PRIMARY KEY (scope, owner, key);
@@ -0,0 +1,58 @@
+-- Версии таблиц для ETag на последовательностях (V0031) становились
+-- видны раньше коммита пишущей транзакции: GET мог прочитать новую версию
+-- со старыми строками и раздавать их под новым ETag, пока не случится
+-- следующая запись. Теперь версия — MVCC-данные: каждая пишущая
+-- транзакция оставляет строку со своим номером транзакции, и строка
+-- становится видна ровно вместе с её изменениями. shared/etag.py выдаёт
+-- ETag, только если все транзакции не новее последней видимой уже
+-- завершены; иначе ответ отдаётся без ETag
+CREATE TABLE IF NOT EXISTS t_p45110186_greeting_project_202.table_change_log (
+    table_name VARCHAR(63) NOT NULL,
+    txid xid8 NOT NULL DEFAULT pg_current_xact_id(),
+    PRIMARY KEY (table_name, txid)
+);
+
+-- Строка на таблицу и транзакцию: разные транзакции пишут разные строки
+-- и друг друга не ждут. Изредка удаляются строки ниже последней
+-- завершённой — версию определяет только она
+CREATE OR REPLACE FUNCTION t_p45110186_greeting_project_202.log_table_change()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO t_p45110186_greeting_project_202.table_change_log (table_name)
+    VALUES (TG_ARGV[0])
+    ON CONFLICT DO NOTHING;
+
+    IF random() < 0.01 THEN
+        DELETE FROM t_p45110186_greeting_project_202.table_change_log
+        WHERE table_name = TG_ARGV[0]
+          AND txid < (
+              SELECT txid FROM t_p45110186_greeting_project_202.table_change_log
+              WHERE table_name = TG_ARGV[0] AND txid < pg_snapshot_xmin(pg_current_snapshot())
+              ORDER BY txid DESC
+              LIMIT 1
+          );
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_users_version ON t_p45110186_greeting_project_202.users;
+DROP TRIGGER IF EXISTS trg_withdrawal_requests_version ON t_p45110186_greeting_project_202.withdrawal_requests;
+
+-- Те же столбцы, что отдают кэшируемые списки (V0031)
+CREATE TRIGGER trg_users_version
+    AFTER INSERT OR DELETE OR UPDATE OF
+        username, balance, referral_count, created_at, is_banned, ban_reason,
+        is_vip, vip_expires_at, telegram_username, last_login_at, is_pinned
+    ON t_p45110186_greeting_project_202.users
+    FOR EACH STATEMENT EXECUTE FUNCTION t_p45110186_greeting_project_202.log_table_change('users');
+
+CREATE TRIGGER trg_withdrawal_requests_version
+    AFTER INSERT OR DELETE OR UPDATE OF
+        user_id, username, amount, network, wallet_address, status, processed_at, admin_note
+    ON t_p45110186_greeting_project_202.withdrawal_requests
+    FOR EACH STATEMENT EXECUTE FUNCTION t_p45110186_greeting_project_202.log_table_change('withdrawal_requests');
+
+DROP FUNCTION IF EXISTS t_p45110186_greeting_project_202.bump_table_version_seq();
+DROP SEQUENCE IF EXISTS t_p45110186_greeting_project_202.users_version_seq;
+DROP SEQUENCE IF EXISTS t_p45110186_greeting_project_202.withdrawal_requests_version_seq;
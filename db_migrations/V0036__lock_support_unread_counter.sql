@@ -0,0 +1,70 @@
+-- count_support_unread (V0016) проверял «есть ли в чате другие
+-- непрочитанные» без блокировки: под READ COMMITTED два параллельных
+-- первых сообщения одного пользователя оба видели пустой чат и оба
+-- добавляли +1, две параллельные пометки прочитанным — оба -1, и
+-- support_unread_chats расходился навсегда. Теперь чат блокируется
+-- advisory-блокировкой транзакции до проверки; проверка после ожидания
+-- видит закоммиченные строки соседа
+CREATE OR REPLACE FUNCTION t_p45110186_greeting_project_202.count_support_unread()
+RETURNS TRIGGER AS $$
+DECLARE
+    was_unread BOOLEAN := FALSE;
+    is_unread BOOLEAN := FALSE;
+    others BOOLEAN;
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        is_unread := NEW.is_read IS NOT TRUE AND NEW.is_admin_reply IS NOT TRUE;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        was_unread := OLD.is_read IS NOT TRUE AND OLD.is_admin_reply IS NOT TRUE;
+    END IF;
+
+    IF TG_OP = 'UPDATE' AND OLD.user_id = NEW.user_id AND was_unread = is_unread THEN
+        RETURN NEW;
+    END IF;
+
+    -- Блокировка чата до конца транзакции; два чата — по возрастанию id
+    IF TG_OP = 'INSERT' THEN
+        PERFORM pg_advisory_xact_lock(hashtext('support_unread_chats'), NEW.user_id);
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM pg_advisory_xact_lock(hashtext('support_unread_chats'), OLD.user_id);
+    ELSE
+        PERFORM pg_advisory_xact_lock(hashtext('support_unread_chats'), LEAST(OLD.user_id, NEW.user_id));
+        IF OLD.user_id <> NEW.user_id THEN
+            PERFORM pg_advisory_xact_lock(hashtext('support_unread_chats'), GREATEST(OLD.user_id, NEW.user_id));
+        END IF;
+    END IF;
+
+    -- Снятие старой версии строки с чата OLD.user_id
+    IF was_unread THEN
+        SELECT EXISTS (
+            SELECT 1 FROM t_p45110186_greeting_project_202.support_messages
+            WHERE user_id = OLD.user_id AND id <> OLD.id
+              AND is_read IS NOT TRUE AND is_admin_reply IS NOT TRUE
+        ) INTO others;
+        IF NOT others AND NOT (is_unread AND NEW.user_id = OLD.user_id) THEN
+            PERFORM t_p45110186_greeting_project_202.add_admin_counter('support_unread_chats', -1);
+        END IF;
+    END IF;
+
+    -- Добавление новой версии строки в чат NEW.user_id
+    IF is_unread AND NOT (was_unread AND NEW.user_id = OLD.user_id) THEN
+        SELECT EXISTS (
+            SELECT 1 FROM t_p45110186_greeting_project_202.support_messages
+            WHERE user_id = NEW.user_id AND id <> NEW.id
+              AND is_read IS NOT TRUE AND is_admin_reply IS NOT TRUE
+        ) INTO others;
+        IF NOT others THEN
+            PERFORM t_p45110186_greeting_project_202.add_admin_counter('support_unread_chats', 1);
+        END IF;
+    END IF;
+
+    IF TG_OP = 'DELETE' THEN
+        RETURN OLD;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Значение, уже разошедшееся до этой миграции
+SELECT t_p45110186_greeting_project_202.recount_admin_counters();
@@ -0,0 +1,24 @@
+-- Журнал целый с V0033, а ledger_balance по-прежнему возвращал NUMERIC:
+-- история баланса отдавала 100.0 рядом с целым users.balance. Тип
+-- результата меняется только пересозданием функции
+DROP FUNCTION IF EXISTS t_p45110186_greeting_project_202.ledger_balance(INTEGER);
+
+ALTER TABLE t_p45110186_greeting_project_202.balance_snapshots
+    ALTER COLUMN balance TYPE BIGINT USING round(balance)::BIGINT;
+
+-- Баланс по журналу: последний снимок + строки транзакций не ниже его границы
+CREATE FUNCTION t_p45110186_greeting_project_202.ledger_balance(target_user_id INTEGER)
+RETURNS BIGINT AS $$
+    SELECT COALESCE(s.balance, 0) + COALESCE((
+               SELECT SUM(l.delta) FROM t_p45110186_greeting_project_202.balance_ledger l
+               WHERE l.user_id = target_user_id
+                 AND (s.txid_bound IS NULL OR l.txid >= s.txid_bound)
+           ), 0)
+    FROM (SELECT 1) AS one
+    LEFT JOIN LATERAL (
+        SELECT txid_bound, balance FROM t_p45110186_greeting_project_202.balance_snapshots
+        WHERE user_id = target_user_id
+        ORDER BY txid_bound DESC
+        LIMIT 1
+    ) s ON TRUE
+$$ LANGUAGE sql STABLE;
@@ -72,6 +72,8 @@ const Index = () => {
   const [tempRegisterUrl, setTempRegisterUrl] = useState('');
   const [tempSiteName, setTempSiteName] = useState('');
   const [allPlayers, setAllPlayers] = useState<any[]>([]);
+  const [playersCursor, setPlayersCursor] = useState<string | null>(null);
+  const [playersLoading, setPlayersLoading] = useState(false);
   const [supportChats, setSupportChats] = useState<any[]>([]);
   const [selectedChat, setSelectedChat] = useState<any | null>(null);
   const [chatMessages, setChatMessages] = useState<any[]>([]);
@@ -715,6 +717,25 @@ const Index = () => {
     }
   };
 
+  // Список игроков отдаётся страницами: первая при открытии экрана,
+  // следующие — по кнопке «Загрузить ещё» с курсором next
+  const loadPlayersPage = async (cursor: string | null) => {
+    setPlayersLoading(true);
+    try {
+      const params = new URLSearchParams();
+      if (cursor) params.set('cursor', cursor);
+      const res = await fetch(`${PLAYERS_URL}?${params}`);
+      const data = await res.json();
+      if (!res.ok) {
+        throw new Error(data.error || `HTTP ${res.status}`);
+      }
+      setAllPlayers((prev) => (cursor ? [...prev, ...(data.players || [])] : data.players || []));
+      setPlayersCursor(data.next || null);
+    } finally {
+      setPlayersLoading(false);
+    }
+  };
+
   const handleUpdateUser = async () => {
     if (!selectedUser) return;
 
@@ -1746,9 +1767,7 @@ const Index = () => {
             <Card 
               onClick={async () => {
                 try {
-                  const res = await fetch(PLAYERS_URL);
-                  const data = await res.json();
-                  setAllPlayers(data.players || []);
+                  await loadPlayersPage(null);
                   setScreen('admin_players');
                 } catch (err) {
                   toast.error('Ошибка загрузки игроков');
@@ -2639,7 +2658,7 @@ const Index = () => {
 
           <Card className="bg-black/60 border border-[#9b87f5]/30 p-4 sm:p-6">
             <h2 className="text-2xl font-bold mb-6 text-center gradient-text">
-              👥 Все игроки ({allPlayers.length})
+              👥 Все игроки ({allPlayers.length}{playersCursor ? '+' : ''})
             </h2>
 
             <div className="space-y-3 max-h-[600px] overflow-y-auto">
@@ -2671,6 +2690,23 @@ const Index = () => {
                 </Card>
               ))}
             </div>
+
+            {playersCursor && (
+              <Button
+                onClick={async () => {
+                  try {
+                    await loadPlayersPage(playersCursor);
+                  } catch (err) {
+                    toast.error('Ошибка загрузки игроков');
+                  }
+                }}
+                disabled={playersLoading}
+                variant="outline"
+                className="w-full mt-4 border-[#9b87f5]/30 text-[#9b87f5]"
+              >
+                {playersLoading ? 'Загрузка...' : 'Загрузить ещё'}
+              </Button>
+            )}
           </Card>
         </div>
       </div>
@@ -0,0 +1,74 @@
+"""
+Перенос переходов по реферальным ссылкам в счётчики (V0022).
+
+referral.track_click только дописывает события в referral_click_events;
+этот скрипт запускается по расписанию (раз в минуту или чаще) и
+агрегирует их в users.referral_clicks пачками по --batch, по одной
+транзакции на пачку. IP посетителей при этом складываются в суточные
+HyperLogLog-скетчи (V0023), а клики — в часовые и суточные корзины
+графиков (V0024). Скетчи старше --keep-days и часовые корзины старше
+--keep-hourly-days удаляются:
+
+    DATABASE_URL=... python tools/aggregate_referral_clicks.py
+
+Вывод: сколько событий перенесено и сколько устаревших строк удалено.
+"""
+
+import argparse
+import os
+import sys
+from typing import Tuple
+
+import psycopg2
+
+SCHEMA = 't_p45110186_greeting_project_202'
+
+
+def aggregate(dsn: str, batch: int, keep_days: int, keep_hourly_days: int) -> Tuple[int, int]:
+    '''Возвращает (сколько событий перенесено, сколько устаревших строк удалено)'''
+    conn = psycopg2.connect(dsn)
+    try:
+        cur = conn.cursor()
+        total = 0
+        while True:
+            cur.execute(f'SELECT {SCHEMA}.aggregate_referral_clicks(%s)', (batch,))
+            moved = cur.fetchone()[0]
+            conn.commit()
+            total += moved
+            if moved < batch:
+                break
+
+        cur.execute(
+            f'DELETE FROM {SCHEMA}.referral_visitor_sketches WHERE day < CURRENT_DATE - %s',
+            (keep_days,)
+        )
+        pruned = cur.rowcount
+        cur.execute(
+            f'DELETE FROM {SCHEMA}.referral_stats_hourly WHERE bucket < CURRENT_DATE - %s',
+            (keep_hourly_days,)
+        )
+        pruned += cur.rowcount
+        conn.commit()
+        return total, pruned
+    finally:
+        conn.close()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--dsn', default=os.environ.get('DATABASE_URL'), help='по умолчанию DATABASE_URL')
+    parser.add_argument('--batch', type=int, default=10_000, help='сколько событий переносить за транзакцию')
+    parser.add_argument('--keep-days', type=int, default=90, help='сколько суток хранить скетчи посетителей')
+    parser.add_argument('--keep-hourly-days', type=int, default=31, help='сколько суток хранить часовые корзины')
+    args = parser.parse_args()
+
+    if not args.dsn:
+        parser.error('нужен --dsn или DATABASE_URL')
+
+    moved, pruned = aggregate(args.dsn, max(1, args.batch), max(1, args.keep_days), max(1, args.keep_hourly_days))
+    print(f'aggregated {moved} clicks, pruned {pruned} rows')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,92 @@
+"""
+Снимки балансов по журналу (balance_ledger, V0030) и сверка.
+
+Запускается по расписанию (раз в час или чаще): для каждого пользователя
+с движениями после прошлого запуска записывает снимок, так что баланс по
+журналу — это снимок плюс несколько последних строк. Граница снимка —
+номер транзакции (V0033): строки ещё открытых транзакций попадут в
+следующий снимок. С --reconcile
+дополнительно сравнивает users.balance с журналом и печатает расхождения:
+
+    DATABASE_URL=... python tools/balance_snapshots.py --reconcile
+
+Вывод: сколько снимков записано; при сверке — строки
+`user_id cached ledger` и код возврата 1, если расхождения есть.
+"""
+
+import argparse
+import os
+import sys
+from typing import List, Tuple
+
+import psycopg2
+
+SCHEMA = 't_p45110186_greeting_project_202'
+
+
+def take_snapshots(cur) -> int:
+    cur.execute(f'SELECT {SCHEMA}.take_balance_snapshots()')
+    return cur.fetchone()[0]
+
+
+def reconcile(cur) -> List[Tuple[int, object, object]]:
+    '''Пользователи, у которых кэш в users расходится с журналом'''
+    cur.execute(f'''
+        WITH latest AS (
+            SELECT DISTINCT ON (user_id) user_id, txid_bound, balance
+            FROM {SCHEMA}.balance_snapshots
+            ORDER BY user_id, txid_bound DESC
+        ),
+        recent AS (
+            SELECT l.user_id, SUM(l.delta) AS delta
+            FROM {SCHEMA}.balance_ledger l
+            LEFT JOIN latest s ON s.user_id = l.user_id
+            WHERE s.txid_bound IS NULL OR l.txid >= s.txid_bound
+            GROUP BY l.user_id
+        ),
+        ledger AS (
+            SELECT COALESCE(s.user_id, r.user_id) AS user_id,
+                   COALESCE(s.balance, 0) + COALESCE(r.delta, 0) AS balance
+            FROM latest s
+            FULL JOIN recent r ON r.user_id = s.user_id
+        )
+        SELECT u.id, COALESCE(u.balance, 0), COALESCE(l.balance, 0)
+        FROM {SCHEMA}.users u
+        LEFT JOIN ledger l ON l.user_id = u.id
+        WHERE COALESCE(u.balance, 0) <> COALESCE(l.balance, 0)
+        ORDER BY u.id
+    ''')
+    return cur.fetchall()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--dsn', default=os.environ.get('DATABASE_URL'), help='по умолчанию DATABASE_URL')
+    parser.add_argument('--reconcile', action='store_true', help='сверить users.balance с журналом')
+    args = parser.parse_args()
+
+    if not args.dsn:
+        parser.error('нужен --dsn или DATABASE_URL')
+
+    conn = psycopg2.connect(args.dsn)
+    try:
+        cur = conn.cursor()
+        taken = take_snapshots(cur)
+        conn.commit()
+        print(f'snapshots taken {taken}')
+
+        if not args.reconcile:
+            return 0
+
+        mismatches = reconcile(cur)
+        conn.rollback()
+        for user_id, cached, ledger in mismatches:
+            print(f'{user_id} {cached} {ledger}')
+        print(f'mismatches {len(mismatches)}')
+        return 1 if mismatches else 0
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,376 @@
+"""
+Нагрузочный прогон backend-функций на локальном PostgreSQL.
+
+Поднимает временный кластер (initdb + pg_ctl, без контейнеров) или берёт
+готовую пустую базу из --dsn, накатывает db_migrations/V*.sql, заполняет
+синтетическими данными нужного масштаба и вызывает handler(event, context)
+каждой функции напрямую по сценариям из её tests.json. По умолчанию
+прогоняются только GET-сценарии: остальные меняют данные, и сотни
+повторов искажают и базу, и следующие замеры. --include-writes
+добавляет их явно.
+
+Для каждого сценария выводятся p50/p95/p99, пропускная способность и
+число SQL-запросов на вызов. Результат можно сохранить как baseline и
+сравнивать с ним следующие прогоны:
+
+    python tools/bench.py --users 10000 --save bench/baseline.json
+    python tools/bench.py --users 10000 --baseline bench/baseline.json
+
+Код возврата 1, если какой-то сценарий стал медленнее порога или начал
+делать больше запросов.
+"""
+
+import argparse
+import atexit
+import importlib.util
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import parse_qsl, urlsplit
+
+import psycopg2
+from psycopg2 import extensions
+
+ROOT = Path(__file__).resolve().parent.parent
+BACKEND = ROOT / 'backend'
+MIGRATIONS = ROOT / 'db_migrations'
+SCHEMA = 't_p45110186_greeting_project_202'
+
+sys.path.insert(0, str(BACKEND))
+
+from shared import tracing  # noqa: E402
+
+
+# =============================================================================
+# POSTGRES
+# =============================================================================
+
+def find_pg_binary(name: str) -> str:
+    path = shutil.which(name)
+    if path:
+        return path
+    try:
+        bindir = subprocess.run(['pg_config', '--bindir'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        raise SystemExit(f'{name} not found: install PostgreSQL or pass --dsn')
+    return str(Path(bindir) / name)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_temp_cluster() -> str:
+    """Временный кластер в tmp-каталоге; останавливается и удаляется при выходе."""
+    data_dir = tempfile.mkdtemp(prefix='bench-pg-')
+    port = free_port()
+
+    subprocess.run(
+        [find_pg_binary('initdb'), '-D', data_dir, '-U', 'postgres', '-A', 'trust', '-E', 'UTF8', '--no-locale'],
+        check=True, stdout=subprocess.DEVNULL
+    )
+    pg_ctl = find_pg_binary('pg_ctl')
+    subprocess.run(
+        [pg_ctl, '-D', data_dir, '-w', '-l', os.path.join(data_dir, 'server.log'),
+         '-o', f"-p {port} -k {data_dir} -c listen_addresses='' -c fsync=off -c synchronous_commit=off",
+         'start'],
+        check=True, stdout=subprocess.DEVNULL
+    )
+
+    def stop() -> None:
+        subprocess.run([pg_ctl, '-D', data_dir, '-m', 'immediate', 'stop'], stdout=subprocess.DEVNULL)
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    atexit.register(stop)
+    return f'host={data_dir} port={port} user=postgres dbname=postgres'
+
+
+def prepare_schema(dsn: str, reset: bool) -> None:
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    cur = conn.cursor()
+
+    cur.execute('SELECT 1 FROM information_schema.schemata WHERE schema_name = %s', (SCHEMA,))
+    if cur.fetchone():
+        if not reset:
+            raise SystemExit(f'Schema {SCHEMA} already exists; pass --reset to drop it')
+        cur.execute(f'DROP SCHEMA {SCHEMA} CASCADE')
+
+    cur.execute(f'CREATE SCHEMA {SCHEMA}')
+    cur.execute(f'SET search_path TO {SCHEMA}')
+
+    for migration in sorted(MIGRATIONS.glob('V*.sql')):
+        cur.execute(migration.read_text())
+
+    conn.close()
+
+
+# =============================================================================
+# SEED DATA
+# =============================================================================
+
+def seed(dsn: str, users: int) -> None:
+    """Синтетические данные: пользователи за год и заявки пропорционально им."""
+    conn = psycopg2.connect(dsn)
+    cur = conn.cursor()
+    cur.execute(f'SET search_path TO {SCHEMA}')
+    # Счётчики админки пересчитываются в конце, а не построчным триггером
+    cur.execute("SET LOCAL app.bulk_import = 'on'")
+
+    cur.execute('''
+        INSERT INTO users (username, password_hash, balance, referral_count, referral_code,
+                           is_banned, is_vip, telegram_id, telegram_username, created_at,
+                           referral_clicks, referral_registrations)
+        SELECT
+            'user' || g,
+            encode(sha256(('password' || g)::bytea), 'hex'),
+            (g * 37) % 500,
+            g % 7,
+            'C' || lpad(to_hex(g), 7, '0'),
+            g % 50 = 0,
+            g % 20 = 0,
+            CASE WHEN g % 3 = 0 THEN (100000 + g)::text END,
+            CASE WHEN g % 3 = 0 THEN 'tg_user' || g END,
+            CURRENT_TIMESTAMP - (g % 365) * INTERVAL '1 day' - (g % 86400) * INTERVAL '1 second',
+            g % 40,
+            g % 7
+        FROM generate_series(1, %s) AS g
+    ''', (users,))
+
+    # Построчные триггеры журнала баланса тоже отключены флагом импорта
+    cur.execute('''
+        INSERT INTO balance_ledger (user_id, delta, kind)
+        SELECT id, balance, 'opening' FROM users WHERE balance <> 0
+    ''')
+
+    cur.execute('''
+        UPDATE users SET referred_by = 1 + (id * 7919) % (id - 1)
+        WHERE id > 1 AND id % 4 = 0
+    ''')
+
+    cur.execute('''
+        INSERT INTO withdrawal_requests (user_id, username, amount, network, wallet_address, status, created_at)
+        SELECT id, username, 10 + id % 90, 'TRC20', 'T' || md5(id::text),
+               (ARRAY['pending', 'approved', 'rejected'])[1 + id % 3],
+               created_at + INTERVAL '1 hour'
+        FROM users WHERE id % 10 = 0
+    ''')
+
+    cur.execute('''
+        INSERT INTO referral_withdrawal_requests (user_id, username, amount, crypto_type, network, wallet_address, status)
+        SELECT id, username, 10 + id % 40, 'USDT', 'TRC20', 'T' || md5(id::text),
+               (ARRAY['pending', 'approved', 'rejected'])[1 + id % 3]
+        FROM users WHERE id % 25 = 0
+    ''')
+
+    cur.execute('''
+        INSERT INTO vip_requests (user_id, payment_screenshot_url, status)
+        SELECT id, 'https://example.com/' || id || '.png',
+               (ARRAY['pending', 'approved', 'rejected'])[1 + id % 3]
+        FROM users WHERE id % 30 = 0
+    ''')
+
+    cur.execute('''
+        INSERT INTO support_messages (user_id, username, message, is_admin_reply, created_at)
+        SELECT u.id, u.username, 'Сообщение ' || m, m % 2 = 0,
+               u.created_at + m * INTERVAL '1 minute'
+        FROM users u, generate_series(1, 3) AS m
+        WHERE u.id % 15 = 0 OR u.id = 1
+    ''')
+
+    cur.execute('SELECT recount_admin_counters()')
+    cur.execute('ANALYZE')
+    conn.commit()
+    conn.close()
+
+
+# =============================================================================
+# SCENARIOS
+# =============================================================================
+
+def load_function(path: Path):
+    name = 'bench_' + path.parent.relative_to(BACKEND).as_posix().replace('/', '_').replace('-', '_')
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def build_event(test: dict) -> dict:
+    url = urlsplit(test.get('path', '/'))
+    query = dict(parse_qsl(url.query))
+    event = {
+        'httpMethod': test.get('method', 'GET'),
+        'path': url.path,
+        'queryStringParameters': query or None,
+        'headers': dict(test.get('headers') or {}),
+        'requestContext': {'identity': {'sourceIp': '127.0.0.1'}},
+        'isBase64Encoded': False,
+    }
+    if 'body' in test:
+        event['body'] = json.dumps(test['body'])
+    return event
+
+
+def collect_scenarios(only: Optional[str], include_writes: bool = False) -> List[dict]:
+    scenarios = []
+    for tests_file in sorted(BACKEND.glob('**/tests.json')):
+        function = tests_file.parent.relative_to(BACKEND).as_posix()
+        index = tests_file.parent / 'index.py'
+        if not index.exists():
+            continue
+        for test in json.loads(tests_file.read_text()).get('tests', []):
+            name = f"{function}: {test['name']}"
+            if only and only not in name:
+                continue
+            if not include_writes and test.get('method', 'GET') != 'GET':
+                continue
+            scenarios.append({
+                'name': name,
+                'index': index,
+                'event': build_event(test),
+                'expected_status': test.get('expectedStatus'),
+            })
+    return scenarios
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    k = (len(ordered) - 1) * pct / 100
+    lower = int(k)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (k - lower)
+
+
+def run_scenario(scenario: dict, modules: Dict[Path, object], iterations: int, warmup: int) -> dict:
+    module = modules.get(scenario['index'])
+    if module is None:
+        module = modules[scenario['index']] = load_function(scenario['index'])
+
+    for _ in range(warmup):
+        module.handler(dict(scenario['event']), None)
+
+    timings = []
+    queries = []
+    mismatches = 0
+    started = time.perf_counter()
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        response = module.handler(dict(scenario['event']), None)
+        timings.append((time.perf_counter() - t0) * 1000)
+        queries.append(len(tracing.last_trace.queries) if tracing.last_trace else 0)
+        if scenario['expected_status'] and response.get('statusCode') != scenario['expected_status']:
+            mismatches += 1
+    elapsed = time.perf_counter() - started
+
+    return {
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+        'rps': round(iterations / elapsed, 1),
+        'queries': round(statistics.mean(queries), 2),
+        'status_mismatches': mismatches,
+    }
+
+
+# =============================================================================
+# REPORT
+# =============================================================================
+
+def print_report(results: Dict[str, dict]) -> None:
+    width = max((len(name) for name in results), default=10)
+    print(f"{'scenario':<{width}}  {'p50':>9} {'p95':>9} {'p99':>9} {'req/s':>9} {'queries':>8} {'bad':>5}")
+    for name, r in results.items():
+        print(f"{name:<{width}}  {r['p50_ms']:>7.2f}ms {r['p95_ms']:>7.2f}ms {r['p99_ms']:>7.2f}ms "
+              f"{r['rps']:>9.1f} {r['queries']:>8.2f} {r['status_mismatches']:>5}")
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], threshold: float) -> List[str]:
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        if current['p95_ms'] > previous['p95_ms'] * (1 + threshold):
+            regressions.append(f"{name}: p95 {previous['p95_ms']:.2f}ms -> {current['p95_ms']:.2f}ms")
+        if current['queries'] > previous['queries']:
+            regressions.append(f"{name}: queries {previous['queries']} -> {current['queries']}")
+    return regressions
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--dsn', help='пустая база вместо временного кластера')
+    parser.add_argument('--reset', action='store_true', help='удалить существующую схему в --dsn')
+    parser.add_argument('--users', type=int, default=10_000, help='сколько пользователей сгенерировать (10000, 1000000)')
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--only', help='запускать только сценарии, содержащие подстроку')
+    parser.add_argument('--include-writes', action='store_true', help='прогонять и не-GET сценарии (меняют данные)')
+    parser.add_argument('--save', help='сохранить результат как baseline в файл')
+    parser.add_argument('--baseline', help='сравнить с сохранённым baseline')
+    parser.add_argument('--threshold', type=float, default=0.2, help='допустимый рост p95, доля (0.2 = 20%%)')
+    args = parser.parse_args()
+
+    dsn = args.dsn or start_temp_cluster()
+    prepare_schema(dsn, args.reset)
+    seed(dsn, args.users)
+
+    # Функции работают с неквалифицированными именами таблиц через search_path
+    bench_dsn = extensions.make_dsn(dsn, options=f'-c search_path={SCHEMA}')
+    os.environ['DATABASE_URL'] = bench_dsn
+    os.environ['MAIN_DB_SCHEMA'] = SCHEMA
+    # Число запросов берём из трассы, а построчный лог только мешает замерам
+    tracing.TRACE_LOG = False
+    tracing.SLOW_REQUEST_MS = float('inf')
+    tracing.SLOW_QUERY_MS = float('inf')
+
+    modules: Dict[Path, object] = {}
+    results = {}
+    for scenario in collect_scenarios(args.only, args.include_writes):
+        results[scenario['name']] = run_scenario(scenario, modules, args.iterations, args.warmup)
+
+    print_report(results)
+
+    if args.save:
+        Path(args.save).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.save).write_text(json.dumps({
+            'meta': {'users': args.users, 'iterations': args.iterations, 'revision': git_revision()},
+            'scenarios': results,
+        }, indent=2, ensure_ascii=False) + '\n')
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        if baseline.get('meta', {}).get('users') != args.users:
+            print(f"warning: baseline was recorded with {baseline['meta'].get('users')} users")
+        regressions = compare(results, baseline.get('scenarios', {}), args.threshold)
+        if regressions:
+            print('\nRegressions:')
+            for line in regressions:
+                print(f'  {line}')
+            return 1
+        print('\nNo regressions against baseline')
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,167 @@
+"""
+Замер холодного старта backend-функций.
+
+Каждая функция импортируется в новом процессе интерпретатора, как при
+первом вызове в свежем контейнере. Замеряется время импорта index.py и
+первого вызова handler с OPTIONS-запросом (preflight, без обращений к БД).
+По выводу `python -X importtime` показываются самые тяжёлые пакеты:
+
+    python tools/coldstart.py
+    python tools/coldstart.py --only telegram --runs 10 --target-ms 150
+
+Код возврата 1, если медиана импорта какой-то функции выше --target-ms.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional
+
+ROOT = Path(__file__).resolve().parent.parent
+BACKEND = ROOT / 'backend'
+
+# Выполняется в дочернем процессе: печатает замеры последней строкой stdout.
+# Метка в stderr отделяет импорты самого замера от импортов функции
+MARKER = 'coldstart: begin'
+PROBE = '''
+import importlib.util, json, sys, time
+path = sys.argv[1]
+sys.stderr.write('%s\\n')
+started = time.perf_counter()
+spec = importlib.util.spec_from_file_location('coldstart_index', path)
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+imported = time.perf_counter()
+module.handler({'httpMethod': 'OPTIONS', 'headers': {}}, None)
+called = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'first_call_ms': (called - imported) * 1000,
+    'modules': len(sys.modules),
+}))
+''' % MARKER
+
+
+def collect_functions(only: Optional[str]) -> List[Path]:
+    functions = []
+    for index in sorted(BACKEND.glob('**/index.py')):
+        name = index.parent.relative_to(BACKEND).as_posix()
+        if only and only not in name:
+            continue
+        functions.append(index)
+    return functions
+
+
+def parse_importtime(stderr: str) -> Dict[str, int]:
+    '''Накопленное время (мкс) пакетов верхнего уровня из -X importtime'''
+    packages: Dict[str, int] = {}
+    lines = stderr.splitlines()
+    if MARKER in lines:
+        lines = lines[lines.index(MARKER) + 1:]
+    for line in lines:
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2].rstrip()
+        # Вложенные импорты выводятся с отступом; берём только верхний уровень
+        if name.startswith('  '):
+            continue
+        packages[name.strip()] = packages.get(name.strip(), 0) + int(parts[1])
+    return packages
+
+
+def measure(index: Path) -> dict:
+    env = {
+        **os.environ,
+        'PYTHONPATH': os.pathsep.join(filter(None, [str(BACKEND), os.environ.get('PYTHONPATH')])),
+        'PYTHONDONTWRITEBYTECODE': '1',
+        'TRACE_LOG': '0',
+    }
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', PROBE, str(index)],
+        capture_output=True, text=True, env=env, cwd=index.parent,
+    )
+    if proc.returncode != 0:
+        error = [
+            line for line in proc.stderr.splitlines()
+            if not line.startswith('import time:') and line != MARKER
+        ]
+        return {'error': error[-1] if error else f'exit code {proc.returncode}'}
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result['packages'] = parse_importtime(proc.stderr)
+    return result
+
+
+def run(index: Path, runs: int) -> dict:
+    samples = [measure(index) for _ in range(runs)]
+    failed = [sample for sample in samples if 'error' in sample]
+    if failed:
+        return {'error': failed[0]['error']}
+
+    packages: Dict[str, List[int]] = {}
+    for sample in samples:
+        for name, us in sample['packages'].items():
+            packages.setdefault(name, []).append(us)
+    heaviest = sorted(
+        ((name, statistics.median(values) / 1000) for name, values in packages.items()),
+        key=lambda item: item[1], reverse=True,
+    )
+
+    return {
+        'import_ms': statistics.median(sample['import_ms'] for sample in samples),
+        'first_call_ms': statistics.median(sample['first_call_ms'] for sample in samples),
+        'modules': samples[0]['modules'],
+        'heaviest': heaviest,
+    }
+
+
+def print_report(results: Dict[str, dict], top: int) -> None:
+    width = max((len(name) for name in results), default=10)
+    print(f"{'function':<{width}}  {'import ms':>10}  {'1st call':>9}  {'modules':>8}")
+    for name, result in results.items():
+        if 'error' in result:
+            print(f"{name:<{width}}  error: {result['error']}")
+            continue
+        print(f"{name:<{width}}  {result['import_ms']:>10.1f}  {result['first_call_ms']:>9.1f}  {result['modules']:>8}")
+        heaviest = ', '.join(f'{package} {ms:.1f}' for package, ms in result['heaviest'][:top])
+        print(f"{'':<{width}}  {heaviest}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--only', help='замерять только функции, содержащие подстроку')
+    parser.add_argument('--runs', type=int, default=5, help='сколько новых процессов на функцию')
+    parser.add_argument('--top', type=int, default=5, help='сколько тяжёлых пакетов показывать')
+    parser.add_argument('--target-ms', type=float, help='допустимая медиана импорта, мс')
+    parser.add_argument('--json', dest='json_path', help='сохранить результат в файл')
+    args = parser.parse_args()
+
+    results = {}
+    for index in collect_functions(args.only):
+        name = index.parent.relative_to(BACKEND).as_posix()
+        results[name] = run(index, max(1, args.runs))
+
+    print_report(results, args.top)
+
+    if args.json_path:
+        Path(args.json_path).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.json_path).write_text(json.dumps(results, indent=2, ensure_ascii=False) + '\n')
+
+    failed = [name for name, result in results.items() if 'error' in result]
+    slow = [
+        name for name, result in results.items()
+        if args.target_ms is not None and 'error' not in result and result['import_ms'] > args.target_ms
+    ]
+    if slow:
+        print(f'\nAbove {args.target_ms:.0f} ms: {", ".join(slow)}')
+    return 1 if failed or slow else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
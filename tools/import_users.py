@@ -0,0 +1,394 @@
+"""
+Массовый импорт пользователей из CSV или NDJSON.
+
+Файл потоком идёт через COPY во временную таблицу, проверки и
+дедупликация выполняются над всей таблицей сразу, реферальные коды
+выдаются пачкой из referral_code_pool (V0018), затем всё переносится в
+users одним INSERT ... SELECT в одной транзакции:
+
+    DATABASE_URL=... python tools/import_users.py partners.csv --rejects rejected.csv
+    python tools/import_users.py partners.ndjson --dsn ... --dry-run
+
+Поля записи (заголовок CSV или ключи NDJSON):
+    username        — обязательно, 3–50 символов
+    password        — пароль в открытом виде, хешируется как в auth
+    password_hash   — или готовый sha256 в hex
+    balance         — целое, по умолчанию 0
+    referral_code   — свой код; при совпадении с занятым выдаётся новый
+    referrer_code   — код пригласившего (существующего или импортируемого)
+    created_at      — ISO 8601, по умолчанию время импорта
+
+Отклонённые строки (номер, username, причина) пишутся в --rejects.
+"""
+
+import argparse
+import csv
+import hashlib
+import io
+import json
+import os
+import re
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import psycopg2
+
+SCHEMA = 't_p45110186_greeting_project_202'
+
+STAGING_COLUMNS = ('line_no', 'username', 'password_hash', 'balance', 'referral_code', 'referrer_code', 'created_at')
+PASSWORD_HASH = re.compile(r'^[0-9a-f]{64}$')
+REFERRAL_CODE_MAX_LENGTH = 20
+
+# Сколько раз пополнять пул, если сгенерированные коды совпали с занятыми
+CODE_REFILL_ATTEMPTS = 3
+
+
+# =============================================================================
+# INPUT
+# =============================================================================
+
+def read_records(path: Path, fmt: str) -> Iterator[Tuple[int, dict]]:
+    with path.open(newline='', encoding='utf-8') as source:
+        if fmt == 'csv':
+            # Строка 1 — заголовок
+            for line_no, record in enumerate(csv.DictReader(source), start=2):
+                yield line_no, record
+        else:
+            for line_no, line in enumerate(source, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    record = None
+                yield line_no, record if isinstance(record, dict) else {'__invalid__': True}
+
+
+def clean(value) -> Optional[str]:
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def normalize(record: dict) -> Tuple[Optional[tuple], Optional[str]]:
+    '''Проверки одной строки; (поля для COPY, None) или (None, причина)'''
+    if record.get('__invalid__'):
+        return None, 'invalid_json'
+
+    username = clean(record.get('username'))
+    if not username or not 3 <= len(username) <= 50:
+        return None, 'invalid_username'
+
+    password_hash = clean(record.get('password_hash'))
+    password = clean(record.get('password'))
+    if password_hash:
+        password_hash = password_hash.lower()
+        if not PASSWORD_HASH.match(password_hash):
+            return None, 'invalid_password_hash'
+    elif password and len(password) >= 4:
+        password_hash = hashlib.sha256(password.encode()).hexdigest()
+    else:
+        return None, 'invalid_password'
+
+    balance = clean(record.get('balance'))
+    if balance is not None:
+        try:
+            balance = str(int(balance))
+        except ValueError:
+            return None, 'invalid_balance'
+
+    referral_code = clean(record.get('referral_code'))
+    if referral_code and len(referral_code) > REFERRAL_CODE_MAX_LENGTH:
+        referral_code = None
+
+    created_at = clean(record.get('created_at'))
+    if created_at is not None:
+        try:
+            created_at = datetime.fromisoformat(created_at.replace('Z', '+00:00')).isoformat()
+        except ValueError:
+            return None, 'invalid_created_at'
+
+    return (username, password_hash, balance, referral_code, clean(record.get('referrer_code')), created_at), None
+
+
+class CopySource(io.RawIOBase):
+    '''Файлоподобный поток CSV-строк для cursor.copy_expert без буфера на весь файл'''
+
+    def __init__(self, rows: Iterator[tuple]):
+        self._rows = rows
+        self._pending = b''
+
+    def readable(self) -> bool:
+        return True
+
+    def _encode(self, row: tuple) -> bytes:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow(['' if value is None else value for value in row])
+        return buffer.getvalue().encode()
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self._pending) < size:
+            row = next(self._rows, None)
+            if row is None:
+                break
+            self._pending += self._encode(row)
+        if size < 0:
+            size = len(self._pending)
+        chunk, self._pending = self._pending[:size], self._pending[size:]
+        return chunk
+
+
+# =============================================================================
+# IMPORT
+# =============================================================================
+
+def stage(cur, path: Path, fmt: str, rejects: List[tuple]) -> int:
+    '''COPY корректных строк во временную таблицу; возвращает их число'''
+    cur.execute('''
+        CREATE TEMP TABLE import_users (
+            line_no INTEGER PRIMARY KEY,
+            username TEXT NOT NULL,
+            password_hash TEXT NOT NULL,
+            balance INTEGER,
+            referral_code TEXT,
+            referrer_code TEXT,
+            created_at TIMESTAMP,
+            reject_reason TEXT
+        ) ON COMMIT DROP
+    ''')
+
+    def rows() -> Iterator[tuple]:
+        for line_no, record in read_records(path, fmt):
+            values, reason = normalize(record)
+            if reason:
+                rejects.append((line_no, clean(record.get('username')), reason))
+                continue
+            yield (line_no,) + values
+
+    # В CSV-формате COPY пустое поле без кавычек — NULL
+    cur.copy_expert(
+        f"COPY import_users ({', '.join(STAGING_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+        CopySource(rows()),
+    )
+    cur.execute('ANALYZE import_users')
+    cur.execute('SELECT COUNT(*) FROM import_users')
+    return cur.fetchone()[0]
+
+
+def validate(cur) -> None:
+    '''Проверки, требующие всей выборки: дубли в файле и с существующими'''
+    cur.execute('''
+        UPDATE import_users s SET reject_reason = 'duplicate_in_file'
+        FROM (
+            SELECT line_no, row_number() OVER (PARTITION BY username ORDER BY line_no) AS rn
+            FROM import_users
+        ) d
+        WHERE s.line_no = d.line_no AND d.rn > 1
+    ''')
+
+    cur.execute(f'''
+        UPDATE import_users s SET reject_reason = 'username_taken'
+        FROM {SCHEMA}.users u
+        WHERE u.username = s.username AND s.reject_reason IS NULL
+    ''')
+
+    # Занятые и повторяющиеся коды сбрасываются: строка получит код из пула
+    cur.execute(f'''
+        UPDATE import_users s SET referral_code = NULL
+        WHERE s.referral_code IS NOT NULL AND (
+            EXISTS (SELECT 1 FROM {SCHEMA}.users u WHERE u.referral_code = s.referral_code)
+            OR EXISTS (
+                SELECT 1 FROM import_users o
+                WHERE o.referral_code = s.referral_code AND o.line_no < s.line_no
+                  AND o.reject_reason IS NULL
+            )
+        )
+    ''')
+
+    # Собственные коды импортируемых не должны потом выдаваться из пула
+    cur.execute(f'''
+        DELETE FROM {SCHEMA}.referral_code_pool p
+        USING import_users s
+        WHERE p.code = s.referral_code AND s.reject_reason IS NULL
+    ''')
+
+
+def assign_referral_codes(cur) -> None:
+    for attempt in range(CODE_REFILL_ATTEMPTS + 1):
+        cur.execute('''
+            SELECT COUNT(*) FROM import_users
+            WHERE reject_reason IS NULL AND referral_code IS NULL
+        ''')
+        missing = cur.fetchone()[0]
+        if not missing:
+            return
+        if attempt == CODE_REFILL_ATTEMPTS:
+            break
+
+        cur.execute(f'SELECT COUNT(*) FROM {SCHEMA}.referral_code_pool')
+        cur.execute(f'SELECT {SCHEMA}.refill_referral_code_pool(%s)', (cur.fetchone()[0] + missing,))
+
+        cur.execute(f'''
+            WITH need AS (
+                SELECT line_no, row_number() OVER (ORDER BY line_no) AS rn
+                FROM import_users
+                WHERE reject_reason IS NULL AND referral_code IS NULL
+            ),
+            claimed AS (
+                DELETE FROM {SCHEMA}.referral_code_pool
+                WHERE code IN (
+                    SELECT code FROM {SCHEMA}.referral_code_pool
+                    ORDER BY code
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING code
+            ),
+            numbered AS (
+                SELECT code, row_number() OVER (ORDER BY code) AS rn FROM claimed
+            )
+            UPDATE import_users s SET referral_code = n.code
+            FROM need JOIN numbered n USING (rn)
+            WHERE s.line_no = need.line_no
+        ''', (missing,))
+
+    raise SystemExit('Не удалось выдать реферальные коды всем строкам')
+
+
+def merge(cur) -> Tuple[int, int]:
+    '''Перенос в users; возвращает (добавлено, привязано к рефереру)'''
+    cur.execute("SET LOCAL app.bulk_import = 'on'")
+
+    # ON CONFLICT страхует от регистраций, прошедших во время импорта
+    cur.execute(f'''
+        WITH inserted AS (
+            INSERT INTO {SCHEMA}.users (username, password_hash, balance, referral_code, created_at)
+            SELECT username, password_hash, COALESCE(balance, 0), referral_code,
+                   COALESCE(created_at, CURRENT_TIMESTAMP)
+            FROM import_users
+            WHERE reject_reason IS NULL
+            ORDER BY line_no
+            ON CONFLICT DO NOTHING
+            RETURNING username
+        )
+        UPDATE import_users s SET reject_reason = 'conflict'
+        WHERE s.reject_reason IS NULL
+          AND NOT EXISTS (SELECT 1 FROM inserted i WHERE i.username = s.username)
+    ''')
+
+    cur.execute(f'''
+        UPDATE {SCHEMA}.users u SET referred_by = ref.id
+        FROM import_users s
+        JOIN {SCHEMA}.users ref ON ref.referral_code = s.referrer_code
+        WHERE s.reject_reason IS NULL AND u.username = s.username AND ref.id <> u.id
+    ''')
+    referred = cur.rowcount
+
+    cur.execute(f'''
+        UPDATE {SCHEMA}.users u SET referral_count = referral_count + c.n
+        FROM (
+            SELECT ref.id, COUNT(*) AS n
+            FROM import_users s
+            JOIN {SCHEMA}.users ref ON ref.referral_code = s.referrer_code
+            WHERE s.reject_reason IS NULL AND ref.username <> s.username
+            GROUP BY ref.id
+        ) c
+        WHERE u.id = c.id
+    ''')
+
+    # Начальные остатки в журнал баланса (V0030) одним шагом: построчные
+    # триггеры журнала при импорте тоже отключены
+    cur.execute(f'''
+        INSERT INTO {SCHEMA}.balance_ledger (user_id, delta, kind, note)
+        SELECT u.id, s.balance, 'opening', 'импорт'
+        FROM import_users s
+        JOIN {SCHEMA}.users u ON u.username = s.username
+        WHERE s.reject_reason IS NULL AND COALESCE(s.balance, 0) <> 0
+    ''')
+
+    # Построчный триггер счётчиков был отключён — добавляем итог одним шагом
+    cur.execute('''
+        SELECT COUNT(*), COALESCE(SUM(COALESCE(balance, 0)), 0)
+        FROM import_users WHERE reject_reason IS NULL
+    ''')
+    inserted, balance = cur.fetchone()
+    cur.execute(f'''
+        SELECT {SCHEMA}.add_admin_counter('users_total', %s),
+               {SCHEMA}.add_admin_counter('users_balance', %s)
+    ''', (inserted, balance))
+
+    return inserted, referred
+
+
+def collect_rejects(cur, rejects: List[tuple]) -> None:
+    cur.execute('''
+        SELECT line_no, username, reject_reason FROM import_users
+        WHERE reject_reason IS NOT NULL
+    ''')
+    rejects.extend(cur.fetchall())
+    rejects.sort(key=lambda row: row[0])
+
+
+def write_rejects(path: str, rejects: List[tuple]) -> None:
+    with open(path, 'w', newline='', encoding='utf-8') as target:
+        writer = csv.writer(target)
+        writer.writerow(['line', 'username', 'reason'])
+        writer.writerows(rejects)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('file', help='CSV с заголовком или NDJSON')
+    parser.add_argument('--dsn', default=os.environ.get('DATABASE_URL'), help='по умолчанию DATABASE_URL')
+    parser.add_argument('--format', choices=('csv', 'ndjson'), help='по умолчанию по расширению файла')
+    parser.add_argument('--rejects', help='записать отклонённые строки в CSV')
+    parser.add_argument('--dry-run', action='store_true', help='всё проверить и откатить транзакцию')
+    args = parser.parse_args()
+
+    if not args.dsn:
+        parser.error('нужен --dsn или DATABASE_URL')
+
+    path = Path(args.file)
+    fmt = args.format or ('ndjson' if path.suffix in ('.ndjson', '.jsonl') else 'csv')
+
+    started = time.perf_counter()
+    rejects: List[tuple] = []
+    conn = psycopg2.connect(args.dsn)
+    try:
+        cur = conn.cursor()
+        staged = stage(cur, path, fmt, rejects)
+        total = staged + len(rejects)
+        validate(cur)
+        assign_referral_codes(cur)
+        inserted, referred = merge(cur)
+        collect_rejects(cur, rejects)
+
+        if args.dry_run:
+            conn.rollback()
+        else:
+            conn.commit()
+    finally:
+        conn.close()
+
+    if args.rejects:
+        write_rejects(args.rejects, rejects)
+
+    elapsed = time.perf_counter() - started
+    verb = 'would import' if args.dry_run else 'imported'
+    print(f'{verb} {inserted} users ({referred} with referrer), '
+          f'rejected {len(rejects)} of {total} rows '
+          f'in {elapsed:.1f}s')
+    reasons: Dict[str, int] = {}
+    for _, _, reason in rejects:
+        reasons[reason] = reasons.get(reason, 0) + 1
+    for reason, count in sorted(reasons.items(), key=lambda item: -item[1]):
+        print(f'  {reason}: {count}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,69 @@
+"""
+Пополнение пула реферальных кодов (referral_code_pool, V0018).
+
+Регистрация забирает по одному коду из пула; этот скрипт запускается по
+расписанию и дополняет пул до --target кодов пачками по --batch, чтобы
+одна вставка не держала долгую транзакцию:
+
+    DATABASE_URL=... python tools/refill_referral_codes.py --target 10000
+
+Вывод: сколько кодов добавлено и сколько теперь в пуле.
+"""
+
+import argparse
+import os
+import sys
+from typing import Tuple
+
+import psycopg2
+
+SCHEMA = 't_p45110186_greeting_project_202'
+
+
+def pool_size(cur) -> int:
+    cur.execute(f'SELECT COUNT(*) FROM {SCHEMA}.referral_code_pool')
+    return cur.fetchone()[0]
+
+
+def refill(dsn: str, target: int, batch: int) -> Tuple[int, int]:
+    '''Возвращает (сколько добавлено, размер пула после пополнения)'''
+    conn = psycopg2.connect(dsn)
+    try:
+        cur = conn.cursor()
+        added_total = 0
+        while True:
+            size = pool_size(cur)
+            if size >= target:
+                break
+            cur.execute(
+                f'SELECT {SCHEMA}.refill_referral_code_pool(%s)',
+                (min(target, size + batch),)
+            )
+            added = cur.fetchone()[0]
+            conn.commit()
+            if not added:
+                # Все кандидаты пачки совпали с существующими кодами
+                break
+            added_total += added
+        return added_total, pool_size(cur)
+    finally:
+        conn.close()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--dsn', default=os.environ.get('DATABASE_URL'), help='по умолчанию DATABASE_URL')
+    parser.add_argument('--target', type=int, default=10_000, help='сколько кодов держать в пуле')
+    parser.add_argument('--batch', type=int, default=2_000, help='сколько кодов добавлять за транзакцию')
+    args = parser.parse_args()
+
+    if not args.dsn:
+        parser.error('нужен --dsn или DATABASE_URL')
+
+    added, size = refill(args.dsn, args.target, max(1, args.batch))
+    print(f'added {added}, pool size {size}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,50 @@
+"""
+Обновление снимка рейтинга рефереров (referral_leaderboard, V0025).
+
+Запускается по расписанию (раз в несколько минут). REFRESH ... CONCURRENTLY
+не блокирует чтение рейтинга на время пересчёта:
+
+    DATABASE_URL=... python tools/refresh_referral_leaderboard.py
+
+Вывод: сколько пользователей в рейтинге и сколько занял пересчёт.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import psycopg2
+
+SCHEMA = 't_p45110186_greeting_project_202'
+
+
+def refresh(dsn: str) -> int:
+    '''Возвращает число пользователей в обновлённом рейтинге'''
+    conn = psycopg2.connect(dsn)
+    try:
+        cur = conn.cursor()
+        cur.execute(f'REFRESH MATERIALIZED VIEW CONCURRENTLY {SCHEMA}.referral_leaderboard')
+        conn.commit()
+        cur.execute(f'SELECT COUNT(*) FROM {SCHEMA}.referral_leaderboard')
+        return cur.fetchone()[0]
+    finally:
+        conn.close()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--dsn', default=os.environ.get('DATABASE_URL'), help='по умолчанию DATABASE_URL')
+    args = parser.parse_args()
+
+    if not args.dsn:
+        parser.error('нужен --dsn или DATABASE_URL')
+
+    started = time.perf_counter()
+    size = refresh(args.dsn)
+    print(f'leaderboard size {size}, refreshed in {(time.perf_counter() - started) * 1000:.0f} ms')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())